@@ -0,0 +1,192 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Persistent image index for ViewerSlidePictures.
+# A SQLite file in the folder keeps, per image, its mtime and file size,
+# its dimensions (read from the header, no decode) and, once the thumbnail
+# grid has made it, a small JPEG thumbnail. A launch lists the folder once
+# and only reads the files whose mtime or size changed since the last one,
+# so reopening a large (or network mounted) folder touches almost nothing.
+
+import io
+import os
+import sqlite3
+import threading
+import numpy as np
+from PIL import Image
+
+index_name = ".slides_index.sqlite"
+index_version = 1
+image_extensions = ('.png', '.jpg', '.jpeg', '.bmp')
+thumb_quality = 85
+# Thumbnail writes are committed in batches of this size (and on close).
+commit_every = 64
+# Thumbnail reads from an index file that could not be written wait at most
+# this long for a lock held by another process.
+source_timeout_ms = 100
+
+
+class DirectoryIndex:
+    def __init__(self, directory_path):
+        self.directory = directory_path
+        self.path = os.path.join(directory_path, index_name)
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+        self.stats = {'listed': 0, 'unchanged': 0, 'read': 0, 'removed': 0}
+        try:
+            self.db = self.open(self.path)
+        except sqlite3.Error as e:
+            print(f"Unable to write image index {self.path}: {e}")
+            self.path = ":memory:"
+            self.db = self.open(self.path)
+        self.source = None
+        self.listed = {}
+        self.files = []
+        self.sizes = {}
+
+    @staticmethod
+    def open(path):
+        db = sqlite3.connect(path, check_same_thread=False)
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        if version != index_version:
+            db.execute("DROP TABLE IF EXISTS images")
+            db.execute("PRAGMA user_version = %d" % index_version)
+        db.execute("CREATE TABLE IF NOT EXISTS images (name TEXT PRIMARY KEY, mtime REAL, size INTEGER, "
+                   "width INTEGER, height INTEGER, thumb BLOB)")
+        db.commit()
+        return db
+
+    def refresh(self):
+        # One directory listing; headers are read only for new or modified
+        # files. Returns the sorted image paths.
+        listed = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(image_extensions) and entry.is_file():
+                    st = entry.stat()
+                    listed[entry.name] = (st.st_mtime, st.st_size)
+        read = {}
+        with self.lock:
+            try:
+                removed, changed = self.sync(listed, read)
+            except sqlite3.Error as e:
+                self.fall_back(e)
+                removed, changed = self.sync(listed, read)
+            self.listed = listed
+        self.stats = {'listed': len(listed), 'unchanged': len(listed) - len(changed), 'read': len(changed),
+                      'removed': len(removed)}
+        self.files = [os.path.join(self.directory, name) for name in sorted(listed)]
+        return self.files
+
+    def sync(self, listed, read):
+        # Lock held. Brings the table in line with the listing; `read` keeps
+        # the header sizes already read if this has to run again.
+        known = {name: (mtime, size, width, height) for name, mtime, size, width, height
+                 in self.db.execute("SELECT name, mtime, size, width, height FROM images")}
+        removed = [name for name in known if name not in listed]
+        self.db.executemany("DELETE FROM images WHERE name = ?", [(name,) for name in removed])
+        changed = []
+        self.sizes = {}
+        for name, (mtime, size) in listed.items():
+            entry = known.get(name)
+            if entry is not None and entry[:2] == (mtime, size):
+                self.sizes[name] = entry[2:]
+                continue
+            if name not in read:
+                read[name] = self.read_size(os.path.join(self.directory, name))
+            dims = read[name]
+            self.sizes[name] = dims
+            changed.append((name, mtime, size, dims[0], dims[1]))
+        # A changed file also loses its thumbnail.
+        self.db.executemany("INSERT OR REPLACE INTO images (name, mtime, size, width, height, thumb) "
+                            "VALUES (?, ?, ?, ?, ?, NULL)", changed)
+        self.db.commit()
+        return removed, changed
+
+    def fall_back(self, error):
+        # Lock held. The index file cannot be written (read-only, locked):
+        # the session goes on with an in-memory copy of its entries, and the
+        # file stays open to read the thumbnails still valid in it.
+        if self.path == ":memory:":
+            raise error
+        print(f"Unable to write image index {self.path}: {error}")
+        memory = self.open(":memory:")
+        try:
+            self.db.rollback()
+            if self.listed:
+                # After a refresh, its listing is the index content.
+                rows = [(name, mtime, size) + tuple(self.sizes.get(name, (None, None)))
+                        for name, (mtime, size) in self.listed.items()]
+            else:
+                rows = self.db.execute("SELECT name, mtime, size, width, height FROM images").fetchall()
+        except sqlite3.Error:
+            # Not even readable (locked): start from an empty index.
+            rows = []
+        memory.executemany("INSERT INTO images (name, mtime, size, width, height) VALUES (?, ?, ?, ?, ?)", rows)
+        memory.commit()
+        self.source = self.db
+        self.source.execute("PRAGMA busy_timeout = %d" % source_timeout_ms)
+        self.db = memory
+        self.path = ":memory:"
+        self.uncommitted = 0
+
+    @staticmethod
+    def read_size(path):
+        try:
+            with Image.open(path) as im:
+                return im.size
+        except OSError:
+            return (None, None)
+
+    def size(self, path):
+        # (width, height) from the index, (None, None) if unreadable.
+        return self.sizes.get(os.path.basename(path), (None, None))
+
+    def get_thumbnail(self, path):
+        with self.lock:
+            try:
+                row = self.db.execute("SELECT thumb, mtime, size FROM images WHERE name = ?",
+                                      (os.path.basename(path),)).fetchone()
+                if row is not None and row[0] is None and self.source is not None:
+                    # Read-only index file: its thumbnail, if the image is unchanged.
+                    row = self.source.execute("SELECT thumb FROM images WHERE name = ? AND mtime = ? AND size = ?",
+                                              (os.path.basename(path), row[1], row[2])).fetchone()
+            except sqlite3.Error:
+                # Locked by another process: the thumbnail is decoded instead.
+                row = None
+        if row is None or row[0] is None:
+            return None
+        with Image.open(io.BytesIO(row[0])) as im:
+            return np.asarray(im.convert('RGB'))
+
+    def put_thumbnail(self, path, image):
+        buffer = io.BytesIO()
+        Image.fromarray(image).save(buffer, 'JPEG', quality=thumb_quality)
+        row = (buffer.getvalue(), os.path.basename(path))
+        with self.lock:
+            try:
+                self.write_thumbnail(row)
+            except sqlite3.Error as e:
+                self.fall_back(e)
+                self.write_thumbnail(row)
+
+    def write_thumbnail(self, row):
+        self.db.execute("UPDATE images SET thumb = ? WHERE name = ?", row)
+        self.uncommitted += 1
+        if self.uncommitted >= commit_every:
+            self.db.commit()
+            self.uncommitted = 0
+
+    def close(self):
+        with self.lock:
+            try:
+                self.db.commit()
+            except sqlite3.Error as e:
+                print(f"Unable to write image index {self.path}: {e}")
+            self.db.close()
+            if self.source is not None:
+                self.source.close()
+
+    def summary(self):
+        s = self.stats
+        return (f"Image index : {s['listed']} images, {s['unchanged']} unchanged, {s['read']} read, "
+                f"{s['removed']} removed ({self.path})")
@@ -0,0 +1,86 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Decoded-clip cache for ViewerMovieInVBO.
+# The first pass of a looping video stores its decoded frames in memory,
+# optionally compressed (zlib: lossless, jpeg: lossy and smaller). If the
+# whole clip fits in the budget, later passes are served from memory and the
+# decoder is closed; as soon as the budget is exceeded the cache is dropped
+# and the video keeps streaming from the file.
+
+import zlib
+import cv2
+import numpy as np
+
+cache_compressions = ('none', 'zlib', 'jpeg')
+jpeg_quality = 92
+
+
+class FrameCache:
+    def __init__(self, budget_bytes, compression='none'):
+        if compression not in cache_compressions:
+            raise ValueError(f"Unknown cache compression {compression}")
+        self.budget = budget_bytes
+        self.compression = compression
+        self.frames = []
+        self.shape = None
+        self.dtype = None
+        self.bytes = 0
+        self.raw_bytes = 0
+        self.complete = False
+        self.abandoned = False
+
+    @property
+    def count(self):
+        return len(self.frames)
+
+    @property
+    def active(self):
+        return not self.abandoned and not self.complete
+
+    def add(self, index, image):
+        # Frames are only kept in order from frame 0; anything else (after a
+        # seek) is ignored until the clip comes back to the next missing one.
+        if not self.active or index != self.count:
+            return
+        if self.shape is None:
+            self.shape, self.dtype = image.shape, image.dtype
+        if self.compression == 'jpeg' and image.ndim == 3:
+            data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])[1]
+        elif self.compression != 'none':
+            # Planar YUV frames are not JPEG encoded, zlib instead.
+            data = zlib.compress(np.ascontiguousarray(image).data, 1)
+        else:
+            data = image.copy()
+        self.frames.append(data)
+        self.bytes += data.nbytes if isinstance(data, np.ndarray) else len(data)
+        self.raw_bytes += image.nbytes
+        if self.bytes > self.budget:
+            self.abandon()
+
+    def finish(self, frame_count):
+        # End of a pass: the clip has frame_count frames. After a seek some
+        # are still missing and the next pass goes on filling.
+        if self.active and frame_count == self.count and self.count > 0:
+            self.complete = True
+        return self.complete
+
+    def abandon(self):
+        self.abandoned = True
+        self.frames = []
+        self.bytes = 0
+
+    def get(self, index):
+        # Read only for compressed frames, the stored array otherwise.
+        data = self.frames[index]
+        if isinstance(data, bytes):
+            return np.frombuffer(zlib.decompress(data), dtype=self.dtype).reshape(self.shape)
+        if self.compression == 'jpeg' and data.ndim == 1:
+            return cv2.imdecode(data, cv2.IMREAD_COLOR)
+        return data
+
+    def summary(self):
+        if self.abandoned:
+            return "Frame cache : clip larger than the budget, streaming"
+        state = "looping from memory" if self.complete else "filling"
+        return (f"Frame cache : {state}, {self.count} frames, {self.bytes / 2 ** 20:.0f} MB "
+                f"({self.compression}, {self.raw_bytes / max(1, self.bytes):.1f}:1) of {self.budget / 2 ** 20:.0f} MB")
@@ -0,0 +1,153 @@
+# Author(s): Dr. Patrick Lemoine
+
+# GL object registry shared by the viewers.
+# Buffers and textures are created and deleted through these functions, which
+# keep every live object with an owner tag and its estimated size: each
+# viewer reports what it still holds on exit, LeakCheck flags objects that
+# keep piling up while it runs and growth() lets the viewers' --LeakTest
+# runs compare two snapshots. Image quads are shared per aspect ratio
+# instead of being rebuilt for every image.
+
+from collections import Counter, deque
+import numpy as np
+import OpenGL.GL as gl
+
+live = {'buffer': {}, 'texture': {}}
+quads = {}
+quad_texcoords = None
+# LeakCheck reports a leak when the live objects grew over each of
+# leak_windows consecutive windows of leak_window frames: a slow leak (one
+# object per slide change) shows up, while a cache filling once plateaus.
+leak_window = 120
+leak_windows = 3
+
+
+def gen_buffers(count=1, owner=''):
+    ids = [int(b) for b in np.atleast_1d(gl.glGenBuffers(count))]
+    for object_id in ids:
+        live['buffer'][object_id] = {'owner': owner, 'bytes': 0}
+    return ids[0] if count == 1 else ids
+
+
+def gen_textures(count=1, owner=''):
+    ids = [int(t) for t in np.atleast_1d(gl.glGenTextures(count))]
+    for object_id in ids:
+        live['texture'][object_id] = {'owner': owner, 'bytes': 0}
+    return ids[0] if count == 1 else ids
+
+
+def set_bytes(kind, object_id, nbytes):
+    # Estimated storage of a live object (texture levels, buffer data).
+    if object_id in live[kind]:
+        live[kind][object_id]['bytes'] = int(nbytes)
+
+
+def buffer_data(target, buffer_id, nbytes, data, usage):
+    # glBufferData on the bound buffer, size recorded.
+    gl.glBufferData(target, nbytes, data, usage)
+    set_bytes('buffer', buffer_id, nbytes)
+
+
+def delete_buffers(ids):
+    ids = [int(b) for b in ids]
+    if ids:
+        gl.glDeleteBuffers(len(ids), ids)
+    for object_id in ids:
+        live['buffer'].pop(object_id, None)
+
+
+def delete_textures(ids):
+    ids = [int(t) for t in ids]
+    if ids:
+        gl.glDeleteTextures(ids)
+    for object_id in ids:
+        live['texture'].pop(object_id, None)
+
+
+def track(kind, key, nbytes, owner=''):
+    # Objects whose GL name is created elsewhere (PyOpenGL VBO wrappers).
+    live[kind][key] = {'owner': owner, 'bytes': int(nbytes)}
+
+
+def untrack(kind, key):
+    live[kind].pop(key, None)
+
+
+def quad(width, height):
+    # Vertex and texcoord buffers of a centred width x height image quad,
+    # created once per aspect and shared.
+    global quad_texcoords
+    if quad_texcoords is None:
+        texcoords = np.array([[0.0, 1.0], [1.0, 1.0], [1.0, 0.0], [0.0, 0.0]], dtype=np.float32)
+        quad_texcoords = gen_buffers(1, 'quad')
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, quad_texcoords)
+        buffer_data(gl.GL_ARRAY_BUFFER, quad_texcoords, texcoords.nbytes, texcoords, gl.GL_STATIC_DRAW)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+    key = (round(width, 4), round(height, 4))
+    if key not in quads:
+        vertices = np.array([
+            [-width / 2, -height / 2, 0.0],
+            [width / 2, -height / 2, 0.0],
+            [width / 2, height / 2, 0.0],
+            [-width / 2, height / 2, 0.0]
+        ], dtype=np.float32)
+        vbo = gen_buffers(1, 'quad')
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vbo)
+        buffer_data(gl.GL_ARRAY_BUFFER, vbo, vertices.nbytes, vertices, gl.GL_STATIC_DRAW)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+        quads[key] = vbo
+    return quads[key], quad_texcoords
+
+
+def release_quads():
+    global quad_texcoords
+    ids = list(quads.values()) + ([quad_texcoords] if quad_texcoords is not None else [])
+    delete_buffers(ids)
+    quads.clear()
+    quad_texcoords = None
+
+
+def counts():
+    return {kind: len(objects) for kind, objects in live.items()}
+
+
+def live_bytes(kind=None):
+    kinds = [kind] if kind is not None else list(live)
+    return sum(o['bytes'] for k in kinds for o in live[k].values())
+
+
+def owners():
+    return Counter(f"{o['owner'] or '?'} {kind}" for kind, objects in live.items() for o in objects.values())
+
+
+def growth(before):
+    # Live objects per owner and kind beyond an earlier owners() snapshot.
+    return owners() - before
+
+
+def summary():
+    c = counts()
+    return (f"GL resources : {c['buffer']} buffers ({live_bytes('buffer') / 2 ** 20:.1f} MB), "
+            f"{c['texture']} textures ({live_bytes('texture') / 2 ** 20:.1f} MB), {len(quads)} quads")
+
+
+class LeakCheck:
+    # Called once per rendered frame: reports (once) when the number of live
+    # objects is higher at the end of each of the last `windows` windows of
+    # `window` frames than at its start.
+    def __init__(self, window=leak_window, windows=leak_windows):
+        self.window = window
+        self.totals = deque(maxlen=window * windows + 1)
+        self.leaking = False
+
+    def frame(self):
+        self.totals.append(sum(counts().values()))
+        if self.leaking or len(self.totals) < self.totals.maxlen:
+            return self.leaking
+        ends = list(self.totals)[::self.window]
+        if all(b > a for a, b in zip(ends, ends[1:])):
+            self.leaking = True
+            top = ", ".join(f"{name} x{n}" for name, n in owners().most_common(3))
+            print(f"GL leak : live objects grew over each of the last {len(ends) - 1} windows of {self.window} "
+                  f"frames ({ends[0]} -> {ends[-1]}; {top})")
+        return self.leaking
@@ -0,0 +1,139 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Spatial clustering of triangle soups for ViewerOBJ.
+# Triangles are reordered by a median-split BVH so that every node covers a
+# contiguous range of the vertex buffer. Per frame the BVH is tested against
+# the view frustum and only the visible ranges are submitted.
+
+import numpy as np
+
+leaf_triangles = 4096
+
+
+class BVH:
+    def __init__(self, bbox_min, bbox_max, first, count, left, right):
+        self.bbox_min = bbox_min
+        self.bbox_max = bbox_max
+        self.first = first
+        self.count = count
+        self.left = left
+        self.right = right
+
+    def __len__(self):
+        return len(self.first)
+
+
+def build_clusters(data, stride, vertex_offset, leaf_size=leaf_triangles):
+    # data: flat float array of triangles (3 vertices of `stride` floats each).
+    # Returns the reordered data and the BVH over triangle ranges.
+    tris = np.asarray(data, dtype=np.float32).reshape(-1, 3 * stride)
+    n = len(tris)
+    positions = tris.reshape(n, 3, stride)[:, :, vertex_offset:vertex_offset + 3]
+    tri_min = positions.min(axis=1)
+    tri_max = positions.max(axis=1)
+    centroids = 0.5 * (tri_min + tri_max)
+
+    order = np.arange(n)
+    first, count, left, right = [], [], [], []
+    stack = [(0, n, -1, 0)]
+    while stack:
+        start, size, parent, side = stack.pop()
+        node = len(first)
+        first.append(start)
+        count.append(size)
+        left.append(-1)
+        right.append(-1)
+        if parent >= 0:
+            (left if side == 0 else right)[parent] = node
+        if size <= leaf_size:
+            continue
+        ids = order[start:start + size]
+        c = centroids[ids]
+        axis = int(np.argmax(c.max(axis=0) - c.min(axis=0)))
+        half = size // 2
+        part = np.argpartition(c[:, axis], half)
+        order[start:start + size] = ids[part]
+        stack.append((start + half, size - half, node, 1))
+        stack.append((start, half, node, 0))
+
+    first = np.array(first, dtype=np.int64)
+    count = np.array(count, dtype=np.int64)
+    left = np.array(left, dtype=np.int64)
+    right = np.array(right, dtype=np.int64)
+    tri_min = tri_min[order]
+    tri_max = tri_max[order]
+    bbox_min = np.zeros((len(first), 3), dtype=np.float32)
+    bbox_max = np.zeros((len(first), 3), dtype=np.float32)
+    # Children are always created after their parent: walk backwards.
+    for node in range(len(first) - 1, -1, -1):
+        if left[node] < 0:
+            s, e = first[node], first[node] + count[node]
+            if e > s:
+                bbox_min[node] = tri_min[s:e].min(axis=0)
+                bbox_max[node] = tri_max[s:e].max(axis=0)
+        else:
+            l, r = left[node], right[node]
+            bbox_min[node] = np.minimum(bbox_min[l], bbox_min[r])
+            bbox_max[node] = np.maximum(bbox_max[l], bbox_max[r])
+    return tris[order].ravel(), BVH(bbox_min, bbox_max, first, count, left, right)
+
+
+def frustum_planes(modelview, projection):
+    # Matrices as returned by glGetDoublev (column-major, i.e. row-vector
+    # convention). Planes are expressed in the object space of modelview.
+    m = np.asarray(modelview, dtype=np.float64).reshape(4, 4) @ np.asarray(projection, dtype=np.float64).reshape(4, 4)
+    planes = np.array([
+        m[:, 3] + m[:, 0],
+        m[:, 3] - m[:, 0],
+        m[:, 3] + m[:, 1],
+        m[:, 3] - m[:, 1],
+        m[:, 3] + m[:, 2],
+        m[:, 3] - m[:, 2],
+    ])
+    length = np.linalg.norm(planes[:, :3], axis=1)
+    length[length == 0] = 1.0
+    return planes / length[:, np.newaxis]
+
+
+def classify(planes, bbox_min, bbox_max):
+    # 0 = outside, 1 = intersecting, 2 = fully inside
+    normals = planes[:, :3]
+    positive = normals >= 0
+    p_vertex = np.where(positive, bbox_max, bbox_min)
+    n_vertex = np.where(positive, bbox_min, bbox_max)
+    if np.any(np.einsum('ij,ij->i', normals, p_vertex) + planes[:, 3] < 0):
+        return 0
+    if np.all(np.einsum('ij,ij->i', normals, n_vertex) + planes[:, 3] >= 0):
+        return 2
+    return 1
+
+
+def cull(bvh, planes):
+    # Returns (first vertices, vertex counts, submitted triangles, culled triangles)
+    ranges = []
+    culled = 0
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        size = int(bvh.count[node])
+        if size == 0:
+            continue
+        state = classify(planes, bvh.bbox_min[node], bvh.bbox_max[node])
+        if state == 0:
+            culled += size
+        elif state == 2 or bvh.left[node] < 0:
+            ranges.append((int(bvh.first[node]), size))
+        else:
+            stack.append(int(bvh.right[node]))
+            stack.append(int(bvh.left[node]))
+    ranges.sort()
+    firsts, counts = [], []
+    for start, size in ranges:
+        if firsts and firsts[-1] + counts[-1] == start:
+            counts[-1] += size
+        else:
+            firsts.append(start)
+            counts.append(size)
+    submitted = sum(counts)
+    return (np.array(firsts, dtype=np.int32) * 3, np.array(counts, dtype=np.int32) * 3,
+            submitted, culled)
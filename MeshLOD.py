@@ -0,0 +1,254 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Import-time mesh simplification for ViewerOBJ.
+# Each material is welded, simplified with quadric error metrics (half-edge
+# collapses, applied in parallel rounds over an independent set of cheapest
+# edges) and the resulting LOD levels are cached next to the OBJ file.
+
+import os
+import json
+import time
+import numpy as np
+
+lod_ratios = (0.5, 0.25, 0.1, 0.03)
+boundary_weight = 100.0
+cache_version = 1
+
+
+def parse_vertex_format(vertex_format):
+    offsets = {}
+    stride = 0
+    for item in vertex_format.split('_'):
+        size = int(item[1])
+        offsets[item[0]] = (stride, size)
+        stride += size
+    return stride, offsets
+
+
+def weld(data, offsets):
+    vo = offsets['V'][0]
+    key = data[:, vo:vo + 3]
+    if 'T' in offsets:
+        to = offsets['T'][0]
+        key = np.hstack([key, data[:, to:to + 2]])
+    key = np.ascontiguousarray(key)
+    key = key.view(np.dtype((np.void, key.dtype.itemsize * key.shape[1]))).ravel()
+    _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    welded = data[first].copy()
+    if 'N' in offsets:
+        no = offsets['N'][0]
+        normals = np.zeros((len(first), 3), dtype=np.float64)
+        for k in range(3):
+            normals[:, k] = np.bincount(inverse, weights=data[:, no + k], minlength=len(first))
+        length = np.linalg.norm(normals, axis=1)
+        nonzero = length > 0
+        normals[nonzero] /= length[nonzero][:, np.newaxis]
+        welded[nonzero, no:no + 3] = normals[nonzero]
+    return welded, inverse.reshape(-1, 3)
+
+
+def face_normals(positions, faces):
+    p0 = positions[faces[:, 0]]
+    return np.cross(positions[faces[:, 1]] - p0, positions[faces[:, 2]] - p0)
+
+
+def plane_quadrics(normals, points, weights):
+    length = np.linalg.norm(normals, axis=1)
+    length[length == 0] = 1.0
+    n = normals / length[:, np.newaxis]
+    a, b, c = n[:, 0], n[:, 1], n[:, 2]
+    d = -np.einsum('ij,ij->i', n, points)
+    q = np.stack([a * a, a * b, a * c, a * d, b * b, b * c, b * d, c * c, c * d, d * d], axis=1)
+    return q * weights[:, np.newaxis]
+
+
+def accumulate(Q, vertex_ids, q):
+    for k in range(10):
+        Q[:, k] += np.bincount(vertex_ids, weights=q[:, k], minlength=len(Q))
+
+
+def quadric_error(Q, p):
+    x, y, z = p[:, 0], p[:, 1], p[:, 2]
+    return (Q[:, 0] * x * x + 2 * Q[:, 1] * x * y + 2 * Q[:, 2] * x * z + 2 * Q[:, 3] * x
+            + Q[:, 4] * y * y + 2 * Q[:, 5] * y * z + 2 * Q[:, 6] * y
+            + Q[:, 7] * z * z + 2 * Q[:, 8] * z + Q[:, 9])
+
+
+def unique_edges(faces, num_vertices):
+    e = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    e.sort(axis=1)
+    code = e[:, 0].astype(np.int64) * num_vertices + e[:, 1]
+    code, counts = np.unique(code, return_counts=True)
+    return np.stack([code // num_vertices, code % num_vertices], axis=1), counts
+
+
+def initial_quadrics(positions, faces):
+    nv = len(positions)
+    Q = np.zeros((nv, 10), dtype=np.float64)
+    normals = face_normals(positions, faces)
+    area = 0.5 * np.linalg.norm(normals, axis=1)
+    q = plane_quadrics(normals, positions[faces[:, 0]], area)
+    for k in range(3):
+        accumulate(Q, faces[:, k], q)
+
+    # Boundary edges (open borders and texture seams) get a perpendicular
+    # constraint plane so that they are not eroded by the collapses.
+    e = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    face_of_edge = np.tile(np.arange(len(faces)), 3)
+    s = np.sort(e, axis=1)
+    code = s[:, 0].astype(np.int64) * nv + s[:, 1]
+    _, inverse, counts = np.unique(code, return_inverse=True, return_counts=True)
+    border = counts[inverse] == 1
+    if np.any(border):
+        a, b = e[border, 0], e[border, 1]
+        edge = positions[b] - positions[a]
+        m = np.cross(edge, normals[face_of_edge[border]])
+        w = boundary_weight * np.einsum('ij,ij->i', edge, edge)
+        q = plane_quadrics(m, positions[a], w)
+        accumulate(Q, a, q)
+        accumulate(Q, b, q)
+    return Q
+
+
+def simplify(positions, faces, target_faces, Q=None):
+    positions = positions.astype(np.float64)
+    nv = len(positions)
+    if Q is None:
+        Q = initial_quadrics(positions, faces)
+    while len(faces) > target_faces:
+        edges, _ = unique_edges(faces, nv)
+        a, b = edges[:, 0], edges[:, 1]
+        Qab = Q[a] + Q[b]
+        ea = quadric_error(Qab, positions[a])
+        eb = quadric_error(Qab, positions[b])
+        keep_a = ea <= eb
+        keep = np.where(keep_a, a, b)
+        remove = np.where(keep_a, b, a)
+        cost = np.where(keep_a, ea, eb)
+
+        # Independent set: an edge collapses only if it is the cheapest edge
+        # of both of its end points, so no vertex takes part in two collapses.
+        rank = np.empty(len(edges), dtype=np.int64)
+        rank[np.argsort(cost, kind='stable')] = np.arange(len(edges))
+        best = np.full(nv, len(edges), dtype=np.int64)
+        np.minimum.at(best, a, rank)
+        np.minimum.at(best, b, rank)
+        selected = np.nonzero((best[a] == rank) & (best[b] == rank))[0]
+        need = (len(faces) - target_faces) // 2 + 1
+        selected = selected[np.argsort(rank[selected])][:need]
+        if len(selected) == 0:
+            break
+
+        remap = np.arange(nv)
+        remap[remove[selected]] = keep[selected]
+        new_faces = remap[faces]
+        alive = ((new_faces[:, 0] != new_faces[:, 1]) & (new_faces[:, 1] != new_faces[:, 2])
+                 & (new_faces[:, 0] != new_faces[:, 2]))
+        flipped = alive & (np.einsum('ij,ij->i', face_normals(positions, faces),
+                                     face_normals(positions, new_faces)) < 0)
+        if np.any(flipped):
+            moved = remap != np.arange(nv)
+            culprits = faces[flipped][moved[faces[flipped]]]
+            remap[culprits] = culprits
+            new_faces = remap[faces]
+            alive = ((new_faces[:, 0] != new_faces[:, 1]) & (new_faces[:, 1] != new_faces[:, 2])
+                     & (new_faces[:, 0] != new_faces[:, 2]))
+        removed = np.nonzero(remap != np.arange(nv))[0]
+        if len(removed) == 0:
+            break
+        Q[remap[removed]] += Q[removed]
+        faces = new_faces[alive]
+    return faces, Q
+
+
+def build_lods(vertices, vertex_format, ratios=lod_ratios):
+    stride, offsets = parse_vertex_format(vertex_format)
+    data = np.asarray(vertices, dtype=np.float32).reshape(-1, stride)
+    if 'V' not in offsets or len(data) < 3:
+        return []
+    data = data[:len(data) - len(data) % 3]
+    welded, faces = weld(data, offsets)
+    vo = offsets['V'][0]
+    positions = welded[:, vo:vo + 3]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    full_faces = len(faces)
+    levels = []
+    Q = None
+    for ratio in ratios:
+        target = int(full_faces * ratio)
+        if target < 4:
+            break
+        faces, Q = simplify(positions, faces, target, Q)
+        levels.append(welded[faces.ravel()].ravel())
+    return levels
+
+
+def cache_path(obj_path):
+    return obj_path + ".lod.npz"
+
+
+def load_cache(obj_path, material_names, ratios):
+    path = cache_path(obj_path)
+    if not os.path.exists(path):
+        return None
+    st = os.stat(obj_path)
+    try:
+        with np.load(path) as cache:
+            meta = json.loads(str(cache['meta']))
+            if (meta['version'] != cache_version or meta['mtime'] != st.st_mtime
+                    or meta['size'] != st.st_size or meta['ratios'] != list(ratios)
+                    or meta['materials'] != list(material_names)):
+                return None
+            lods = {}
+            for i, name in enumerate(material_names):
+                lods[name] = [cache[f"m{i}_l{j}"] for j in range(meta['levels'][i])]
+            return lods
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Ignoring LOD cache {path}: {e}")
+        return None
+
+
+def save_cache(obj_path, material_names, lods, ratios):
+    st = os.stat(obj_path)
+    meta = {
+        'version': cache_version,
+        'mtime': st.st_mtime,
+        'size': st.st_size,
+        'ratios': list(ratios),
+        'materials': list(material_names),
+        'levels': [len(lods[name]) for name in material_names],
+    }
+    arrays = {'meta': np.array(json.dumps(meta))}
+    for i, name in enumerate(material_names):
+        for j, level in enumerate(lods[name]):
+            arrays[f"m{i}_l{j}"] = level
+    try:
+        np.savez(cache_path(obj_path), **arrays)
+    except OSError as e:
+        print(f"Unable to write LOD cache {cache_path(obj_path)}: {e}")
+
+
+def load_or_build_lods(obj_path, materials, ratios=lod_ratios):
+    # materials: list of (name, vertices, vertex_format)
+    names = [name for name, _, _ in materials]
+    lods = load_cache(obj_path, names, ratios)
+    if lods is not None:
+        print(f"LOD levels loaded from {cache_path(obj_path)}")
+        return lods
+    t0 = time.perf_counter()
+    lods = {}
+    for name, vertices, vertex_format in materials:
+        lods[name] = build_lods(vertices, vertex_format, ratios)
+    print(f"LOD levels built in {time.perf_counter() - t0:.2f} s")
+    save_cache(obj_path, names, lods, ratios)
+    return lods
+
+
+def select_lod(level_triangles, pixels, triangles_per_pixel=1.0):
+    # Coarsest level that still has enough triangles for the screen area.
+    wanted = pixels * triangles_per_pixel
+    index = 0
+    for i, count in enumerate(level_triangles):
+        if count >= wanted:
+            index = i
+    return index
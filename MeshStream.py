@@ -0,0 +1,333 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Out-of-core preprocessing and progressive streaming for ViewerOBJ.
+# An OBJ file is converted once, with bounded memory, into a directory of
+# per-material binary vertex files (T2F_N3F_V3F, 32 bytes per vertex) plus a
+# small coarse level built by vertex clustering. The viewer then streams the
+# coarse level and the full resolution batches from disk in the background.
+
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import numpy as np
+
+stream_version = 1
+vertex_format = 'T2F_N3F_V3F'
+stride = 8
+batch_triangles = 65536
+coarse_grid = 100
+# Rows read at once from the memory-mapped attribute files.
+read_rows = 1 << 20
+# Pass 1 buffers rows in preallocated numpy chunks: they start at
+# min_chunk_bytes and double up to max_chunk_bytes while the appenders'
+# shared allowance, a fraction of the memory budget, allows it.
+min_chunk_bytes = 64 * 1024
+max_chunk_bytes = 4 * 1024 * 1024
+spill_fraction = 0.25
+
+
+def stream_dir(obj_path):
+    return obj_path + ".stream"
+
+
+def load_index(obj_path):
+    path = os.path.join(stream_dir(obj_path), "index.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        index = json.load(f)
+    st = os.stat(obj_path)
+    if (index.get('version') != stream_version or index.get('source_mtime') != st.st_mtime
+            or index.get('source_size') != st.st_size):
+        return None
+    return index
+
+
+def ensure_preprocessed(obj_path, memory_budget_mb=1024.0):
+    index = load_index(obj_path)
+    if index is None:
+        print(f"Preprocessing {obj_path} for streaming ...")
+        preprocess(obj_path, memory_budget_mb)
+        index = load_index(obj_path)
+    return index
+
+
+class Appender:
+    # Rows go into a preallocated chunk, written to disk when full. `pool`
+    # holds the bytes the appenders may still allocate, shared by all of them.
+    def __init__(self, path, dtype, width, pool):
+        self.path = path
+        self.dtype = dtype
+        self.width = width
+        self.pool = pool
+        row_bytes = np.dtype(dtype).itemsize * width
+        self.max_rows = max(1, max_chunk_bytes // row_bytes)
+        self.chunk = np.empty((max(1, min_chunk_bytes // row_bytes), width), dtype=dtype)
+        self.pool['free'] -= self.chunk.nbytes
+        self.used = 0
+        self.count = 0
+        open(path, 'wb').close()
+
+    def append(self, row):
+        if self.used == len(self.chunk):
+            self.grow_or_flush()
+        self.chunk[self.used] = row
+        self.used += 1
+        self.count += 1
+
+    def grow_or_flush(self):
+        rows = len(self.chunk)
+        if 2 * rows <= self.max_rows and self.pool['free'] >= self.chunk.nbytes:
+            self.pool['free'] -= self.chunk.nbytes
+            chunk = np.empty((2 * rows, self.width), dtype=self.dtype)
+            chunk[:rows] = self.chunk
+            self.chunk = chunk
+        else:
+            self.flush()
+
+    def flush(self):
+        if self.used:
+            with open(self.path, 'ab') as f:
+                self.chunk[:self.used].tofile(f)
+            self.used = 0
+
+    def close(self):
+        self.flush()
+        self.pool['free'] += self.chunk.nbytes
+        self.chunk = None
+
+
+def parse_mtl(mtl_path, textures):
+    name = None
+    try:
+        with open(mtl_path, errors='replace') as f:
+            for line in f:
+                parts = line.split()
+                if not parts:
+                    continue
+                if parts[0] == 'newmtl' and len(parts) > 1:
+                    name = ' '.join(parts[1:])
+                elif parts[0] == 'map_Kd' and len(parts) > 1 and name is not None:
+                    textures[name] = os.path.join(os.path.dirname(mtl_path), parts[-1])
+    except OSError as e:
+        print(f"Error Load Material {mtl_path}: {e}")
+
+
+def preprocess(obj_path, memory_budget_mb=1024.0):
+    t0 = time.perf_counter()
+    out = stream_dir(obj_path)
+    os.makedirs(out, exist_ok=True)
+    base = os.path.dirname(obj_path)
+
+    # Pass 1: stream the OBJ, spill attributes and triangulated faces to disk.
+    pool = {'free': spill_fraction * memory_budget_mb * 1024 * 1024}
+    v = Appender(os.path.join(out, "v.tmp"), np.float32, 3, pool)
+    vt = Appender(os.path.join(out, "vt.tmp"), np.float32, 2, pool)
+    vn = Appender(os.path.join(out, "vn.tmp"), np.float32, 3, pool)
+    faces = {}
+    order = []
+    textures = {}
+    current = "default"
+    with open(obj_path, errors='replace') as f:
+        for line in f:
+            if not line or line[0] == '#':
+                continue
+            parts = line.split()
+            if not parts:
+                continue
+            tag = parts[0]
+            if tag == 'v':
+                v.append([float(x) for x in parts[1:4]])
+            elif tag == 'vt':
+                vt.append([float(x) for x in parts[1:3]] + [0.0] * (3 - len(parts)))
+            elif tag == 'vn':
+                vn.append([float(x) for x in parts[1:4]])
+            elif tag == 'f':
+                corners = []
+                for token in parts[1:]:
+                    ids = token.split('/')
+                    vi = int(ids[0])
+                    ti = int(ids[1]) if len(ids) > 1 and ids[1] else 0
+                    ni = int(ids[2]) if len(ids) > 2 and ids[2] else 0
+                    vi = vi - 1 if vi > 0 else v.count + vi
+                    ti = ti - 1 if ti > 0 else (vt.count + ti if ti < 0 else -1)
+                    ni = ni - 1 if ni > 0 else (vn.count + ni if ni < 0 else -1)
+                    corners.append((vi, ti, ni))
+                if current not in faces:
+                    faces[current] = Appender(os.path.join(out, f"f{len(order)}.tmp"), np.int64, 9, pool)
+                    order.append(current)
+                for k in range(1, len(corners) - 1):
+                    faces[current].append(corners[0] + corners[k] + corners[k + 1])
+            elif tag == 'usemtl':
+                current = ' '.join(parts[1:]) if len(parts) > 1 else "default"
+            elif tag == 'mtllib':
+                for name in parts[1:]:
+                    parse_mtl(os.path.join(base, name), textures)
+    for appender in [v, vt, vn] + list(faces.values()):
+        appender.close()
+    print(f"Parsed {v.count} vertices in {time.perf_counter() - t0:.1f} s")
+
+    V = np.memmap(v.path, dtype=np.float32, mode='r', shape=(v.count, 3)) if v.count else None
+    T = np.memmap(vt.path, dtype=np.float32, mode='r', shape=(vt.count, 2)) if vt.count else None
+    N = np.memmap(vn.path, dtype=np.float32, mode='r', shape=(vn.count, 3)) if vn.count else None
+    bbox_min = np.full(3, np.inf)
+    bbox_max = np.full(3, -np.inf)
+    for start in range(0, v.count, read_rows):
+        chunk = np.asarray(V[start:start + read_rows])
+        bbox_min = np.minimum(bbox_min, chunk.min(axis=0))
+        bbox_max = np.maximum(bbox_max, chunk.max(axis=0))
+    if v.count == 0:
+        bbox_min = bbox_max = np.zeros(3)
+
+    # Pass 2: gather interleaved vertices per material in bounded batches and
+    # accumulate the vertex clustering used for the coarse level.
+    g = coarse_grid
+    cell_size = np.maximum((bbox_max - bbox_min) / g, 1e-12)
+    cell_sum = np.zeros((g ** 3, 3), dtype=np.float64)
+    cell_count = np.zeros(g ** 3, dtype=np.int64)
+    coarse_keys = {}
+    materials = []
+    for i, name in enumerate(order):
+        path = faces[name].path
+        count = faces[name].count
+        F = np.memmap(path, dtype=np.int64, mode='r', shape=(count, 3, 3)) if count else np.zeros((0, 3, 3), np.int64)
+        bin_path = os.path.join(out, f"m{i}.bin")
+        batches = []
+        keys = []
+        uvs = []
+        with open(bin_path, 'wb') as fout:
+            for start in range(0, count, batch_triangles):
+                fb = np.array(F[start:start + batch_triangles])
+                nb = len(fb)
+                pos = np.asarray(V[fb[:, :, 0].ravel()]).reshape(nb, 3, 3)
+                data = np.zeros((nb, 3, stride), dtype=np.float32)
+                data[:, :, 5:8] = pos
+                if T is not None:
+                    ti = fb[:, :, 1]
+                    ok = ti >= 0
+                    data[:, :, 0:2][ok] = T[ti[ok]]
+                ni = fb[:, :, 2]
+                flat = np.cross(pos[:, 1] - pos[:, 0], pos[:, 2] - pos[:, 0])
+                length = np.linalg.norm(flat, axis=1)
+                length[length == 0] = 1.0
+                flat = (flat / length[:, np.newaxis]).astype(np.float32)
+                data[:, :, 2:5] = flat[:, np.newaxis, :]
+                if N is not None:
+                    ok = ni >= 0
+                    data[:, :, 2:5][ok] = N[ni[ok]]
+                data.tofile(fout)
+                batches.append([start, nb, pos.reshape(-1, 3).min(axis=0).tolist(),
+                                pos.reshape(-1, 3).max(axis=0).tolist()])
+
+                q = np.clip(((pos - bbox_min) / cell_size).astype(np.int64), 0, g - 1)
+                cell = q[:, :, 0] + g * (q[:, :, 1] + g * q[:, :, 2])
+                flat_cell = cell.ravel()
+                cell_count += np.bincount(flat_cell, minlength=g ** 3)
+                for k in range(3):
+                    cell_sum[:, k] += np.bincount(flat_cell, weights=pos[:, :, k].ravel(), minlength=g ** 3)
+                keep = (cell[:, 0] != cell[:, 1]) & (cell[:, 1] != cell[:, 2]) & (cell[:, 0] != cell[:, 2])
+                cell = cell[keep]
+                uv = data[keep][:, :, 0:2]
+                rot = np.argmin(cell, axis=1)
+                idx = (rot[:, np.newaxis] + np.arange(3)) % 3
+                cell = np.take_along_axis(cell, idx, axis=1)
+                uv = np.take_along_axis(uv, idx[:, :, np.newaxis], axis=1)
+                cell, first = np.unique(cell, axis=0, return_index=True)
+                keys.append(cell)
+                uvs.append(uv[first])
+        if keys:
+            cell = np.concatenate(keys)
+            uv = np.concatenate(uvs)
+            cell, first = np.unique(cell, axis=0, return_index=True)
+            coarse_keys[i] = (cell, uv[first])
+        materials.append({
+            'name': name,
+            'texture': textures.get(name),
+            'triangles': int(count),
+            'file': os.path.basename(bin_path),
+            'batches': batches,
+        })
+        del F
+
+    rep = cell_sum / np.maximum(cell_count, 1)[:, np.newaxis]
+    for i, material in enumerate(materials):
+        coarse_path = os.path.join(out, f"m{i}_coarse.bin")
+        cell, uv = coarse_keys.get(i, (np.zeros((0, 3), np.int64), np.zeros((0, 3, 2), np.float32)))
+        pos = rep[cell].astype(np.float32)
+        data = np.zeros((len(cell), 3, stride), dtype=np.float32)
+        data[:, :, 0:2] = uv
+        flat = np.cross(pos[:, 1] - pos[:, 0], pos[:, 2] - pos[:, 0]) if len(cell) else np.zeros((0, 3))
+        length = np.linalg.norm(flat, axis=1)
+        length[length == 0] = 1.0
+        data[:, :, 2:5] = (flat / length[:, np.newaxis])[:, np.newaxis, :]
+        data[:, :, 5:8] = pos
+        data.tofile(coarse_path)
+        material['coarse_file'] = os.path.basename(coarse_path)
+        material['coarse_triangles'] = int(len(cell))
+
+    del V, T, N
+    for path in [v.path, vt.path, vn.path] + [faces[name].path for name in order]:
+        os.remove(path)
+
+    st = os.stat(obj_path)
+    index = {
+        'version': stream_version,
+        'source_mtime': st.st_mtime,
+        'source_size': st.st_size,
+        'vertex_format': vertex_format,
+        'bbox': [float(bbox_min[0]), float(bbox_max[0]), float(bbox_min[1]),
+                 float(bbox_max[1]), float(bbox_min[2]), float(bbox_max[2])],
+        'materials': materials,
+    }
+    with open(os.path.join(out, "index.json"), 'w') as f:
+        json.dump(index, f)
+    print(f"Stream data written to {out} in {time.perf_counter() - t0:.1f} s")
+    return index
+
+
+class StreamLoader(threading.Thread):
+    # Reads (material, level, first vertex, data) batches from disk into a
+    # bounded queue. jobs: list of (material index, level, file, first triangle, triangles)
+    def __init__(self, directory, jobs, max_queued_bytes):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.jobs = jobs
+        batch_bytes = max(1, batch_triangles * 3 * stride * 4)
+        self.queue = queue.Queue(maxsize=max(1, int(max_queued_bytes // batch_bytes)))
+        self.stopped = threading.Event()
+
+    def run(self):
+        for material, level, file, first, count in self.jobs:
+            if self.stopped.is_set():
+                return
+            path = os.path.join(self.directory, file)
+            for start in range(first, first + count, batch_triangles):
+                n = min(batch_triangles, first + count - start)
+                data = np.fromfile(path, dtype=np.float32, count=n * 3 * stride,
+                                   offset=start * 3 * stride * 4)
+                while not self.stopped.is_set():
+                    try:
+                        self.queue.put((material, level, start * 3, data), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+        self.queue.put(None)
+
+    def stop(self):
+        self.stopped.set()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--Path', type=str, default='.', help='Path.')
+    parser.add_argument('--Name', type=str, default='T.obj', help='Name Obj.')
+    parser.add_argument('--MemoryBudgetMB', type=float, default=1024.0, help='Memory budget of the preprocessing.')
+    args = parser.parse_args()
+    obj_path = args.Path + "/" + args.Name
+    if not os.path.exists(obj_path):
+        sys.exit(f"File not found {obj_path}")
+    preprocess(obj_path, args.MemoryBudgetMB)
@@ -0,0 +1,36 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Offscreen OpenGL context for benchmarks.
+# Uses a surfaceless EGL display (Mesa), so no window system is needed.
+# PYOPENGL_PLATFORM=egl has to be set before PyOpenGL is first imported.
+
+import ctypes
+
+
+def create_offscreen_context(width, height):
+    from OpenGL import EGL
+    EGL_PLATFORM_SURFACELESS_MESA = 0x31DD
+    display = EGL.eglGetPlatformDisplay(EGL_PLATFORM_SURFACELESS_MESA, EGL.EGL_DEFAULT_DISPLAY, None)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor)):
+        raise RuntimeError("EGL initialization failed")
+    attributes = (EGL.EGLint * 13)(
+        EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT, EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8,
+        EGL.EGL_BLUE_SIZE, 8, EGL.EGL_DEPTH_SIZE, 24, EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+        EGL.EGL_NONE)
+    config = EGL.EGLConfig()
+    num_configs = EGL.EGLint()
+    if not EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1, ctypes.pointer(num_configs)) or num_configs.value == 0:
+        raise RuntimeError("No EGL configuration for offscreen rendering")
+    surface = EGL.eglCreatePbufferSurface(display, config, (EGL.EGLint * 5)(EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT, height, EGL.EGL_NONE))
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    if not EGL.eglMakeCurrent(display, surface, surface, context):
+        raise RuntimeError("EGL make current failed")
+    return display, surface, context
+
+
+def destroy_offscreen_context(offscreen):
+    from OpenGL import EGL
+    EGL.eglMakeCurrent(offscreen[0], EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+    EGL.eglTerminate(offscreen[0])
@@ -7,6 +7,8 @@ from OpenGL.GLU import *
 from OpenGL.GLUT import *
 from PIL import Image
 import pyautogui
+from RenderScheduler import RenderScheduler
+import GLResources
 
 texture_path = "T.jpg"
 heightmap_path = "H.jpg"
@@ -34,6 +36,9 @@ heightmap_data = None
 texture_id = None
 
 QFullScreen = False
+max_fps = 60.0
+scheduler = None
+leak_check = GLResources.LeakCheck()
 
 def normalize(v):
     norm = np.linalg.norm(v)
@@ -56,7 +61,8 @@ def load_texture(path):
     im = Image.open(path).convert("RGB")
     ix, iy = im.size
     image_data = im.tobytes()
-    tid = glGenTextures(1)
+    tid = GLResources.gen_textures(1, 'map')
+    GLResources.set_bytes('texture', tid, ix * iy * 3)
     glBindTexture(GL_TEXTURE_2D, tid)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
@@ -148,6 +154,7 @@ def reshape(w, h):
     glLoadIdentity()
     gluPerspective(45.0, w / float(h), 0.1, 1000.0)
     glMatrixMode(GL_MODELVIEW)
+    scheduler.request_redraw()
 
 def draw_water_plane():
     glEnable(GL_BLEND)
@@ -165,6 +172,7 @@ def draw_water_plane():
     glDisable(GL_BLEND)
 
 def display():
+    scheduler.begin_frame()
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
     glLoadIdentity()
     camera_front, camera_right, camera_up = compute_camera_vectors()
@@ -188,6 +196,8 @@ def display():
     glBindTexture(GL_TEXTURE_2D, 0)
     draw_water_plane()
     glutSwapBuffers()
+    scheduler.end_frame()
+    leak_check.frame()
 
 def mouse(button, state, x, y):
     global mouse_left_down, mouse_x, mouse_y, cam_pos
@@ -198,10 +208,10 @@ def mouse(button, state, x, y):
         mouse_left_down = (state == GLUT_DOWN)
     elif button == 3 and state == GLUT_DOWN:
         cam_pos += move_speed * camera_front
-        glutPostRedisplay()
+        scheduler.request_redraw()
     elif button == 4 and state == GLUT_DOWN:
         cam_pos -= move_speed * camera_front
-        glutPostRedisplay()
+        scheduler.request_redraw()
 
 def motion(x, y):
     global angle_x, angle_y, mouse_x, mouse_y
@@ -212,13 +222,16 @@ def motion(x, y):
         angle_x += -dy * 0.3
         angle_x = np.clip(angle_x, -89, 89)
     mouse_x, mouse_y = x, y
-    glutPostRedisplay()
+    scheduler.request_redraw()
 
 def keyboard(key, x, y):
     global height_scale, water_level
     try:
         key = key.decode("utf-8")
         if key == '\x1b' or key == 'q':
+            print(scheduler.summary())
+            GLResources.delete_textures([texture_id])
+            print(GLResources.summary())
             try:
                 glutLeaveMainLoop()
             except NameError:
@@ -227,18 +240,18 @@ def keyboard(key, x, y):
             sys.exit(0)
         elif key == '8':
             water_level += 0.1
-            glutPostRedisplay()
+            scheduler.request_redraw()
         elif key == '2':
             water_level -= 0.1
-            glutPostRedisplay()
+            scheduler.request_redraw()
         elif key in ("+", "="):
             height_scale += 1
             generate_terrain()
-            glutPostRedisplay()
+            scheduler.request_redraw()
         elif key == "-":
             height_scale = max(0, height_scale - 1)
             generate_terrain()
-            glutPostRedisplay()
+            scheduler.request_redraw()
     except SystemExit:
         pass
 
@@ -248,18 +261,20 @@ def special_keys(key, x, y):
 
     if key == GLUT_KEY_UP:
         cam_pos += move_speed * camera_front
-        glutPostRedisplay()
+        scheduler.request_redraw()
     elif key == GLUT_KEY_DOWN:
         cam_pos -= move_speed * camera_front
-        glutPostRedisplay()
+        scheduler.request_redraw()
     elif key == GLUT_KEY_LEFT:
         cam_pos -= move_speed * camera_right
-        glutPostRedisplay()
+        scheduler.request_redraw()
     elif key == GLUT_KEY_RIGHT:
         cam_pos += move_speed * camera_right
-        glutPostRedisplay()
+        scheduler.request_redraw()
 
 def main():
+    global scheduler
+    scheduler = RenderScheduler(max_fps)
     glutInit()
     glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGBA | GLUT_DEPTH)
     
@@ -274,6 +289,7 @@ def main():
         glutInitWindowPosition(100, 100)
         glutCreateWindow(b"Planar Map 3D")
 
+    scheduler.attach_glut(glutPostRedisplay, glutTimerFunc)
     init()
     glutDisplayFunc(display)
     glutReshapeFunc(reshape)
@@ -293,6 +309,7 @@ if __name__ == "__main__":
     parser.add_argument('--tiles_y', type=int, default=200, help='tiles_y.')
     parser.add_argument('--height_scale', type=int, default=10, help='height_scale.')
     parser.add_argument('--Fullscreen', type=int, default=0, help='Enable fullscreen mode')
+    parser.add_argument('--MaxFPS', type=float, default=60.0, help='Frame rate cap (redraws only on input or animation)')
     args = parser.parse_args()
     texture_path = args.Path + "/" + args.Texture
     heightmap_path = args.Path + "/" + args.Heighmap
@@ -300,4 +317,5 @@ if __name__ == "__main__":
     tiles_y = args.tiles_y
     height_scale = args.height_scale
     QFullScreen=args.Fullscreen
+    max_fps = args.MaxFPS
     main()
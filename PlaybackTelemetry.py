@@ -0,0 +1,177 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Playback telemetry for ViewerMovieInVBO.
+# Records, for every presented frame, the decode, convert (scale / YUV) and
+# upload times and how late it went out, every dropped or skipped frame, and
+# the draw and swap times of every rendered frame. A rolling one second
+# summary can be shown on screen, and the trace is written as CSV or JSON
+# (by file extension) on exit to compare codecs and machines.
+
+import csv
+import json
+import time
+from collections import deque
+import cv2
+import numpy as np
+import OpenGL.GL as gl
+import GLResources
+
+# Oldest records are dropped beyond this (about 4.5 hours at 60 fps).
+max_records = 1000000
+trace_fields = ('t_ms', 'event', 'stream', 'frame', 'decode_ms', 'convert_ms', 'upload_ms', 'late_ms',
+                'draw_ms', 'swap_ms')
+
+
+class PlaybackTelemetry:
+    def __init__(self):
+        self.t_start = time.perf_counter()
+        self.records = deque(maxlen=max_records)
+        self.totals = {'present': 0, 'drop': 0, 'skip': 0, 'render': 0}
+
+    def record(self, event, **values):
+        values['t_ms'] = 1000.0 * (time.perf_counter() - self.t_start)
+        values['event'] = event
+        self.records.append(values)
+        self.totals[event] += 1
+
+    def present(self, stream, frame, decode_ms, convert_ms, upload_ms, late_ms):
+        self.record('present', stream=stream, frame=frame, decode_ms=decode_ms, convert_ms=convert_ms,
+                    upload_ms=upload_ms, late_ms=late_ms)
+
+    def drop(self, stream, frame):
+        self.record('drop', stream=stream, frame=frame)
+
+    def skip(self, stream, frame):
+        self.record('skip', stream=stream, frame=frame)
+
+    def render(self, draw_ms, swap_ms):
+        self.record('render', draw_ms=draw_ms, swap_ms=swap_ms)
+
+    def recent(self, seconds):
+        since = 1000.0 * (time.perf_counter() - self.t_start - seconds)
+        out = []
+        for r in reversed(self.records):
+            if r['t_ms'] < since:
+                break
+            out.append(r)
+        return out
+
+    def summary_lines(self, seconds=1.0):
+        # Per stream and render statistics over the last `seconds`.
+        records = self.recent(seconds)
+        lines = []
+        streams = sorted({r['stream'] for r in records if 'stream' in r})
+        for name in streams:
+            frames = [r for r in records if r.get('stream') == name and r['event'] == 'present']
+            drops = sum(1 for r in records if r.get('stream') == name and r['event'] == 'drop')
+            line = f"{name[:24]} : {len(frames) / seconds:.0f} fps, drop {drops}"
+            for key, label in (('decode_ms', 'dec'), ('convert_ms', 'cvt'), ('upload_ms', 'up'), ('late_ms', 'late')):
+                values = [r[key] for r in frames]
+                if values:
+                    line += f", {label} {np.mean(values):.1f}/{np.max(values):.1f}"
+            lines.append(line)
+        renders = [r for r in records if r['event'] == 'render']
+        if renders:
+            draw = [r['draw_ms'] for r in renders]
+            swap = [r['swap_ms'] for r in renders]
+            lines.append(f"render : {len(renders) / seconds:.0f} fps, draw {np.mean(draw):.1f}/{np.max(draw):.1f}, "
+                         f"swap {np.mean(swap):.1f}/{np.max(swap):.1f} ms (mean/max)")
+        return lines
+
+    def stats(self):
+        stats = dict(self.totals)
+        for key in ('decode_ms', 'convert_ms', 'upload_ms', 'late_ms', 'draw_ms', 'swap_ms'):
+            values = np.array([r[key] for r in self.records if key in r], dtype=np.float64)
+            if len(values):
+                stats[key] = {'mean': float(values.mean()), 'p95': float(np.percentile(values, 95)),
+                              'max': float(values.max())}
+        return stats
+
+    def summary(self):
+        s = self.stats()
+        text = f"Telemetry : {s['present']} presented, {s['drop']} dropped, {s['skip']} skips, {s['render']} renders"
+        for key in ('decode_ms', 'convert_ms', 'upload_ms', 'late_ms', 'draw_ms', 'swap_ms'):
+            if key in s:
+                text += f", {key[:-3]} {s[key]['mean']:.2f}/{s[key]['p95']:.2f}/{s[key]['max']:.2f}"
+        return text + " ms (mean/p95/max)"
+
+    def write(self, path):
+        try:
+            if path.lower().endswith('.json'):
+                with open(path, 'w') as f:
+                    json.dump({'summary': self.stats(), 'records': list(self.records)}, f)
+            else:
+                with open(path, 'w', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=trace_fields)
+                    writer.writeheader()
+                    writer.writerows(self.records)
+        except OSError as e:
+            print(f"Unable to write playback trace {path}: {e}")
+            return
+        print(f"Playback trace written to {path} ({len(self.records)} records)")
+
+
+class TelemetryOverlay:
+    # Text drawn with OpenCV into a texture, shown in the top left corner.
+    def __init__(self):
+        self.texture = GLResources.gen_textures(1, 'overlay')
+        self.width = self.height = 0
+
+    def update(self, lines):
+        if not lines:
+            self.width = self.height = 0
+            return
+        scale, line_h = 0.45, 18
+        width = max(cv2.getTextSize(line, cv2.FONT_HERSHEY_SIMPLEX, scale, 1)[0][0] for line in lines) + 12
+        image = np.zeros((line_h * len(lines) + 8, width, 4), dtype=np.uint8)
+        image[..., 3] = 160
+        for i, line in enumerate(lines):
+            cv2.putText(image, line, (6, line_h * (i + 1)), cv2.FONT_HERSHEY_SIMPLEX, scale, (255, 255, 255, 255), 1,
+                        cv2.LINE_AA)
+        self.height, self.width = image.shape[:2]
+        GLResources.set_bytes('texture', self.texture, image.nbytes)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA8, self.width, self.height, 0, gl.GL_BGRA,
+                        gl.GL_UNSIGNED_BYTE, image)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+    def draw(self, window_w, window_h):
+        if self.width == 0:
+            return
+        gl.glPushAttrib(gl.GL_ENABLE_BIT)
+        gl.glDisable(gl.GL_DEPTH_TEST)
+        gl.glDisable(gl.GL_LIGHTING)
+        gl.glEnable(gl.GL_BLEND)
+        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        gl.glEnable(gl.GL_TEXTURE_2D)
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
+        gl.glOrtho(0, window_w, 0, window_h, -1, 1)
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        top, right = window_h - 8, 8 + self.width
+        gl.glBegin(gl.GL_QUADS)
+        gl.glTexCoord2f(0, 1)
+        gl.glVertex2f(8, top - self.height)
+        gl.glTexCoord2f(1, 1)
+        gl.glVertex2f(right, top - self.height)
+        gl.glTexCoord2f(1, 0)
+        gl.glVertex2f(right, top)
+        gl.glTexCoord2f(0, 0)
+        gl.glVertex2f(8, top)
+        gl.glEnd()
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        gl.glPopMatrix()
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPopMatrix()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glPopAttrib()
+
+    def release(self):
+        GLResources.delete_textures([self.texture])
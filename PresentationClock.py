@@ -0,0 +1,94 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Presentation clock for ViewerMovieInVBO.
+# Maps the monotonic clock to a source frame index: frame i is due at
+# anchor_time + (i - anchor_frame) / fps. Changing the speed, pausing or
+# seeking re-anchors the clock at the current position, so playback never
+# jumps and never accumulates the time spent decoding, uploading or swapping.
+
+import time
+
+spin_margin = 0.002
+
+
+class PresentationClock:
+    def __init__(self, fps):
+        self.fps = fps
+        self.anchor_time = time.perf_counter()
+        self.anchor_frame = 0.0
+        self.paused_at = None
+        self.presented = 0
+        self.dropped = 0
+        self.skips = 0
+        self.late_time = 0.0
+        self.max_late = 0.0
+
+    def position(self, now=None):
+        # Current media position in (fractional) source frames.
+        if self.paused_at is not None:
+            return self.paused_at
+        if now is None:
+            now = time.perf_counter()
+        return self.anchor_frame + (now - self.anchor_time) * self.fps
+
+    def due_index(self, now=None):
+        return int(self.position(now))
+
+    def time_of(self, index):
+        return self.anchor_time + (index - self.anchor_frame) / self.fps
+
+    def start(self, index, now=None):
+        self.anchor_time = time.perf_counter() if now is None else now
+        self.anchor_frame = float(index)
+        if self.paused_at is not None:
+            self.paused_at = float(index)
+
+    def set_fps(self, fps):
+        now = time.perf_counter()
+        position = self.position(now)
+        self.fps = fps
+        self.start(position, now)
+
+    def pause(self):
+        if self.paused_at is None:
+            self.paused_at = self.position()
+
+    def resume(self):
+        if self.paused_at is not None:
+            position = self.paused_at
+            self.paused_at = None
+            self.start(position)
+
+    @property
+    def paused(self):
+        return self.paused_at is not None
+
+    def presented_frame(self, index, now):
+        late = max(0.0, now - self.time_of(index))
+        self.presented += 1
+        self.late_time += late
+        self.max_late = max(self.max_late, late)
+        return late
+
+    def sleep_until(self, t):
+        # Event waits are coarse; the last couple of milliseconds are spent
+        # in short sleeps so the frame goes out on time.
+        while True:
+            remaining = t - time.perf_counter()
+            if remaining <= 0.0:
+                return
+            time.sleep(remaining / 2 if remaining > 0.0005 else 0)
+
+    def stats(self):
+        return {
+            'presented': self.presented,
+            'dropped': self.dropped,
+            'skips': self.skips,
+            'mean_late_ms': 1000.0 * self.late_time / max(1, self.presented),
+            'max_late_ms': 1000.0 * self.max_late,
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"Presented : {s['presented']}, Dropped : {s['dropped']}, Skips : {s['skips']}, "
+                f"Late : {s['mean_late_ms']:.1f} ms mean, {s['max_late_ms']:.1f} ms max")
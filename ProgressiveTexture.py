@@ -0,0 +1,88 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Progressive image open for ViewerPictureInVBO.
+# The image is first decoded at 1/8 scale (JPEG DCT scaling, a plain resize
+# for other formats) and shown at once. A background thread then decodes it
+# at full resolution and builds the mip chain; the render loop uploads that
+# through an UploadQueue, within a per-frame time budget, and swaps it in
+# when it is complete, so neither the decode nor the upload stalls a frame.
+
+import time
+import threading
+import cv2
+import OpenGL.GL as gl
+import GLResources
+from UploadQueue import UploadQueue, mip_chain
+
+
+def create_texture(levels):
+    texture_id = GLResources.gen_textures(1, 'picture')
+    GLResources.set_bytes('texture', texture_id, sum(image.nbytes for image in levels))
+    gl.glBindTexture(gl.GL_TEXTURE_2D, texture_id)
+    gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+    for level, image in enumerate(levels):
+        h, w = image.shape[:2]
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, level, gl.GL_RGB8, w, h, 0, gl.GL_BGR, gl.GL_UNSIGNED_BYTE, image)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR_MIPMAP_LINEAR)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+    gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+    return texture_id
+
+
+class ProgressiveTexture:
+    def __init__(self, image_path, on_ready=None, upload_budget_ms=4.0):
+        self.path = image_path
+        self.on_ready = on_ready
+        t0 = time.perf_counter()
+        preview = cv2.imread(image_path, cv2.IMREAD_REDUCED_COLOR_8)
+        if preview is None:
+            raise RuntimeError("Unable to load image")
+        self.texture = create_texture(mip_chain(preview))
+        self.preview_time = time.perf_counter() - t0
+        self.preview_size = (preview.shape[1], preview.shape[0])
+        self.size = None
+        self.error = None
+        self.uploads = UploadQueue(upload_budget_ms)
+        self.refine_time = None
+        self.t_start = t0
+        self.thread = threading.Thread(target=self.decode, daemon=True)
+        self.thread.start()
+
+    @property
+    def uploading(self):
+        return self.path in self.uploads
+
+    def decode(self):
+        image = cv2.imread(self.path, cv2.IMREAD_COLOR)
+        if image is None:
+            self.error = "Unable to load image"
+            print(f"Full resolution unavailable for {self.path}")
+        else:
+            self.uploads.submit(self.path, mip_chain(image), 'picture')
+        if self.on_ready is not None:
+            self.on_ready()
+
+    def step(self):
+        # Render thread: uploads the next slabs of the full resolution
+        # texture once it is decoded. Returns True while slabs remain.
+        more = self.uploads.step()
+        job = self.uploads.take(self.path)
+        if job is not None:
+            GLResources.delete_textures([self.texture])
+            self.texture = job.texture
+            self.size = job.size
+            self.refine_time = time.perf_counter() - self.t_start
+        return more
+
+    def release(self):
+        GLResources.delete_textures([self.texture])
+        self.uploads.release()
+
+    def summary(self):
+        text = f"Progressive open : preview {self.preview_size[0]}x{self.preview_size[1]} in {1000.0 * self.preview_time:.0f} ms"
+        if self.refine_time is not None:
+            text += f", full {self.size[0]}x{self.size[1]} swapped in after {self.refine_time:.2f} s"
+        return text
@@ -0,0 +1,180 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Memory-mapped raw image input for ViewerPictureInVBO.
+# .npy arrays, binary PPM/PGM and headerless raw dumps are mapped instead of
+# decoded: the pixels go from the page cache straight into glTexImage2D with
+# the GL format matching their channel order, so opening a multi-GB image
+# costs disk reads, not codec time or extra copies.
+# Raw dumps need a sidecar header next to them, <file>.json:
+#   {"width": 8000, "height": 6000, "channels": 3, "order": "RGB",
+#    "dtype": "uint8", "offset": 0, "row_bytes": 24000}
+# (offset and row_bytes are optional). A sidecar next to a .npy or PPM file
+# only overrides its channel order.
+
+import os
+import json
+import mmap
+import ctypes
+import numpy as np
+import OpenGL.GL as gl
+
+mapped_extensions = ('.npy', '.ppm', '.pgm', '.pnm', '.raw', '.rgb', '.bgr', '.rgba', '.bgra')
+channel_orders = {'GRAY': 1, 'RGB': 3, 'BGR': 3, 'RGBA': 4, 'BGRA': 4}
+gl_formats = {'GRAY': gl.GL_LUMINANCE, 'RGB': gl.GL_RGB, 'BGR': gl.GL_BGR, 'RGBA': gl.GL_RGBA, 'BGRA': gl.GL_BGRA}
+gl_internal = {'GRAY': gl.GL_LUMINANCE8, 'RGB': gl.GL_RGB8, 'BGR': gl.GL_RGB8, 'RGBA': gl.GL_RGBA8, 'BGRA': gl.GL_RGBA8}
+
+
+class MappedImage:
+    def __init__(self, pixels, order, buffer=None):
+        # pixels: (height, width, channels) view on the mapping; buffer: the
+        # mapped rows as they are in the file, padding included.
+        self.pixels = pixels
+        self.buffer = pixels if buffer is None else buffer
+        self.order = order
+        self.height, self.width = pixels.shape[:2]
+        self.dtype = pixels.dtype
+        self.row_bytes = pixels.strides[0]
+
+    @property
+    def nbytes(self):
+        return self.height * self.row_bytes
+
+    def release(self):
+        # Drops the pages read so far from the process; they stay in the OS
+        # page cache. Reading a large image band by band keeps RSS flat.
+        base = self.pixels
+        while base is not None and not isinstance(base, mmap.mmap):
+            base = getattr(base, 'base', None)
+        if base is not None and hasattr(mmap, 'MADV_DONTNEED'):
+            base.madvise(mmap.MADV_DONTNEED)
+
+    def bgr8(self, rows=slice(None), cols=slice(None)):
+        # 8-bit BGR (or gray) copy of a region, for OpenCV.
+        region = np.asarray(self.pixels[rows, cols])
+        if region.dtype.itemsize == 2:
+            region = (region.astype(np.uint16) >> 8).astype(np.uint8)
+        if self.order in ('RGB', 'RGBA'):
+            region = region[..., [2, 1, 0]]
+        elif self.order == 'BGRA':
+            region = region[..., :3]
+        elif self.order == 'GRAY':
+            region = region[..., 0]
+        return np.ascontiguousarray(region)
+
+
+def is_mapped(path):
+    return path.lower().endswith(mapped_extensions)
+
+
+def read_sidecar(path):
+    sidecar = path + ".json"
+    if not os.path.exists(sidecar):
+        return {}
+    with open(sidecar) as f:
+        return json.load(f)
+
+
+def check_order(order, channels):
+    order = order.upper()
+    if channel_orders.get(order) != channels:
+        raise RuntimeError(f"Channel order {order} does not match {channels} channels")
+    return order
+
+
+def open_npy(path, header):
+    array = np.load(path, mmap_mode='r')
+    if array.dtype not in (np.uint8, np.uint16) or array.ndim not in (2, 3) or not array.flags.c_contiguous:
+        raise RuntimeError(f"Unsupported array {array.shape} {array.dtype} (uint8/uint16 HxW or HxWxC expected)")
+    if array.ndim == 2:
+        array = array[:, :, np.newaxis]
+    channels = array.shape[2]
+    default = {1: 'GRAY', 3: 'RGB', 4: 'RGBA'}.get(channels, '')
+    return MappedImage(array, check_order(header.get('order', default), channels))
+
+
+def open_pnm(path, header):
+    # Binary P5 (gray) / P6 (RGB) header, then the pixels; 16-bit samples
+    # are big endian.
+    with open(path, 'rb') as f:
+        data = f.read(1024)
+    fields = []
+    pos = 0
+    while len(fields) < 4:
+        while pos < len(data) and data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b'#':
+            pos = data.index(b'\n', pos) + 1
+            continue
+        end = pos
+        while end < len(data) and not data[end:end + 1].isspace():
+            end += 1
+        fields.append(data[pos:end])
+        pos = end
+    magic, width, height, maxval = fields[0], int(fields[1]), int(fields[2]), int(fields[3])
+    if magic not in (b'P5', b'P6'):
+        raise RuntimeError(f"Only binary PPM/PGM (P5/P6) can be mapped, not {magic.decode(errors='replace')}")
+    channels = 3 if magic == b'P6' else 1
+    dtype = np.dtype('>u2') if maxval > 255 else np.dtype(np.uint8)
+    pixels = np.memmap(path, dtype=dtype, mode='r', offset=pos + 1, shape=(height, width, channels))
+    default = 'RGB' if channels == 3 else 'GRAY'
+    return MappedImage(pixels, check_order(header.get('order', default), channels))
+
+
+def open_raw(path, header):
+    if not header:
+        raise RuntimeError(f"Raw image {path} needs a sidecar header {path}.json")
+    width, height = int(header['width']), int(header['height'])
+    order = header.get('order', {'.rgb': 'RGB', '.bgr': 'BGR', '.rgba': 'RGBA', '.bgra': 'BGRA'}.get(
+        os.path.splitext(path)[1].lower(), 'RGB'))
+    channels = int(header.get('channels', channel_orders.get(order.upper(), 3)))
+    dtype = np.dtype(header.get('dtype', 'uint8'))
+    if dtype not in (np.uint8, np.uint16):
+        raise RuntimeError(f"Unsupported raw sample type {dtype}")
+    row_bytes = int(header.get('row_bytes', width * channels * dtype.itemsize))
+    offset = int(header.get('offset', 0))
+    rows = np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(height, row_bytes))
+    pixels = rows[:, :width * channels * dtype.itemsize].view(dtype).reshape(height, width, channels)
+    return MappedImage(pixels, check_order(order, channels), rows)
+
+
+def open_mapped(path):
+    header = read_sidecar(path)
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == '.npy':
+            return open_npy(path, header)
+        if ext in ('.ppm', '.pgm', '.pnm'):
+            return open_pnm(path, header)
+        return open_raw(path, header)
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        raise RuntimeError(f"Unable to map image {path}: {e}")
+
+
+def upload_mapped(image, level=0):
+    # glTexImage2D straight from the mapping: format from the channel order,
+    # row padding through the unpack state, byte swapping for big endian
+    # 16-bit samples. Bare pointers, so PyOpenGL neither copies nor converts.
+    pixel_bytes = image.dtype.itemsize * channel_orders[image.order]
+    pixel_type = gl.GL_UNSIGNED_SHORT if image.dtype.itemsize == 2 else gl.GL_UNSIGNED_BYTE
+    fmt = gl_formats[image.order]
+    address = image.buffer.ctypes.data
+    padding = image.row_bytes - image.width * pixel_bytes
+    gl.glPixelStorei(gl.GL_UNPACK_SWAP_BYTES, image.dtype.byteorder == '>')
+    gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+    if image.row_bytes % pixel_bytes == 0:
+        gl.glPixelStorei(gl.GL_UNPACK_ROW_LENGTH, image.row_bytes // pixel_bytes)
+    elif padding < 8 and image.row_bytes % 8 == 0:
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 8)
+    if image.row_bytes % pixel_bytes == 0 or (padding < 8 and image.row_bytes % 8 == 0):
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, level, gl_internal[image.order], image.width, image.height, 0,
+                        fmt, pixel_type, ctypes.c_void_p(address))
+    else:
+        # Padding GL cannot describe: one row at a time.
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, level, gl_internal[image.order], image.width, image.height, 0,
+                        fmt, pixel_type, None)
+        for row in range(image.height):
+            gl.glTexSubImage2D(gl.GL_TEXTURE_2D, level, 0, row, image.width, 1, fmt, pixel_type,
+                               ctypes.c_void_p(address + row * image.row_bytes))
+    gl.glPixelStorei(gl.GL_UNPACK_ROW_LENGTH, 0)
+    gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 4)
+    gl.glPixelStorei(gl.GL_UNPACK_SWAP_BYTES, gl.GL_FALSE)
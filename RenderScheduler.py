@@ -0,0 +1,126 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Demand-driven redraw scheduler shared by the viewers.
+# A frame is drawn only when something asked for it (input, animation or new
+# data due at a given time), never faster than max_fps. Between frames the
+# viewer blocks on its event queue instead of spinning.
+
+import time
+
+
+class RenderScheduler:
+    def __init__(self, max_fps=60.0):
+        self.max_fps = max_fps
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.dirty = True
+        self.animating = False
+        self.deadline = None
+        self.t_start = time.perf_counter()
+        self.t_last_end = self.t_start
+        self.t_frame_start = None
+        self.last_frame = self.t_start - self.min_interval
+        self.busy_time = 0.0
+        self.idle_time = 0.0
+        self.frames = 0
+        self.glut_post = None
+        self.glut_timer = None
+        self.glut_timer_pending = False
+
+    def request_redraw(self):
+        self.dirty = True
+        if self.glut_post is not None:
+            self.glut_schedule()
+
+    def set_animating(self, animating):
+        self.animating = bool(animating)
+        if self.animating and self.glut_post is not None:
+            self.glut_schedule()
+
+    def schedule_at(self, t):
+        # Ask for a frame at perf_counter time t (e.g. next video frame due).
+        if self.deadline is None or t < self.deadline:
+            self.deadline = t
+        if self.glut_post is not None:
+            self.glut_schedule()
+
+    def timeout(self):
+        # Seconds the caller may block waiting for events, None = forever.
+        now = time.perf_counter()
+        earliest = self.last_frame + self.min_interval
+        if self.dirty or self.animating:
+            return max(0.0, earliest - now)
+        if self.deadline is not None:
+            return max(0.0, max(self.deadline, earliest) - now)
+        return None
+
+    def frame_due(self):
+        now = time.perf_counter()
+        if now < self.last_frame + self.min_interval:
+            return False
+        if self.dirty or self.animating:
+            return True
+        return self.deadline is not None and now >= self.deadline
+
+    def begin_frame(self):
+        now = time.perf_counter()
+        self.idle_time += now - self.t_last_end
+        self.last_frame = now
+        self.t_frame_start = now
+        self.dirty = False
+        if self.deadline is not None and now >= self.deadline:
+            self.deadline = None
+
+    def end_frame(self):
+        now = time.perf_counter()
+        if self.t_frame_start is not None:
+            self.busy_time += now - self.t_frame_start
+        self.t_frame_start = None
+        self.t_last_end = now
+        self.frames += 1
+        if self.glut_post is not None and (self.animating or self.deadline is not None):
+            self.glut_schedule()
+
+    def wait_events(self, glfw):
+        timeout = self.timeout()
+        if timeout is None:
+            glfw.wait_events()
+        elif timeout > 0.0:
+            glfw.wait_events_timeout(timeout)
+        else:
+            glfw.poll_events()
+
+    def attach_glut(self, post_redisplay, timer_func):
+        self.glut_post = post_redisplay
+        self.glut_timer = timer_func
+
+    def glut_schedule(self):
+        if self.glut_timer_pending:
+            return
+        timeout = self.timeout()
+        if timeout is None:
+            return
+        if timeout <= 0.0:
+            self.glut_post()
+        else:
+            self.glut_timer_pending = True
+            self.glut_timer(int(timeout * 1000.0) + 1, self.glut_timer_callback, 0)
+
+    def glut_timer_callback(self, value):
+        self.glut_timer_pending = False
+        self.glut_schedule()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.t_start
+        return {
+            "frames": self.frames,
+            "elapsed_s": elapsed,
+            "busy_s": self.busy_time,
+            "idle_s": self.idle_time,
+            "busy_ratio": self.busy_time / elapsed if elapsed > 0 else 0.0,
+            "avg_fps": self.frames / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def summary(self):
+        s = self.stats()
+        return (f"Frames : {s['frames']}, Busy : {s['busy_s']:.2f} s, Idle : {s['idle_s']:.2f} s, "
+                f"Busy ratio : {100.0 * s['busy_ratio']:.1f} %, Avg FPS : {s['avg_fps']:.1f}")
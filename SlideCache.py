@@ -0,0 +1,159 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Lazy slide residency for ViewerSlidePictures.
+# Only the current slide and a window of neighbours are kept as textures.
+# Background threads decode the neighbours ahead in the direction of travel
+# (and one behind) and build their mip chains, the render loop uploads them
+# through an UploadQueue within a per-frame time budget, current slide first,
+# and slides that left the window are evicted, least recently shown first,
+# when the VRAM budget is reached. A slide is shown only once completely
+# uploaded; until then the previous one stays on screen.
+
+import queue
+import threading
+import cv2
+import GLResources
+from UploadQueue import UploadQueue, mip_chain
+
+
+class SlideCache:
+    def __init__(self, files, window=2, budget_mb=512.0, loaders=2, on_ready=None, upload_budget_ms=4.0):
+        self.files = files
+        self.window = max(0, window)
+        self.budget = budget_mb * 1024 * 1024
+        self.on_ready = on_ready
+        self.slides = {}
+        self.resident_bytes = 0
+        self.frame = 0
+        self.shown = None
+        self.wanted = set()
+        self.pending = set()
+        self.failed = set()
+        self.ready = []
+        self.lock = threading.Lock()
+        self.requests = queue.LifoQueue()
+        self.queue = UploadQueue(upload_budget_ms)
+        self.loaded = 0
+        self.uploads = 0
+        self.evictions = 0
+        self.threads = [threading.Thread(target=self.loader, daemon=True) for _ in range(max(1, loaders))]
+        for thread in self.threads:
+            thread.start()
+
+    def loader(self):
+        while True:
+            index = self.requests.get()
+            if index is None:
+                return
+            with self.lock:
+                # Skip slides the viewer moved away from while queued.
+                stale = index not in self.wanted
+                if stale:
+                    self.pending.discard(index)
+            if stale:
+                continue
+            image = cv2.imread(self.files[index], cv2.IMREAD_COLOR)
+            levels = mip_chain(image) if image is not None else None
+            with self.lock:
+                self.ready.append((index, levels))
+                self.loaded += 1
+            if self.on_ready is not None:
+                self.on_ready()
+
+    def neighbours(self, current, direction):
+        # Current slide first, then the window ahead, then one behind.
+        count = len(self.files)
+        order = [current]
+        order += [(current + direction * k) % count for k in range(1, self.window + 1)]
+        if self.window > 0:
+            order.append((current - direction) % count)
+        seen = []
+        for index in order:
+            if index not in seen:
+                seen.append(index)
+        return seen
+
+    def upload_ready(self, current):
+        # Decoded slides go to the upload queue; those the viewer moved away
+        # from are dropped, queued or not. Uploads completed this frame become
+        # resident. Returns True while uploads remain.
+        with self.lock:
+            ready, self.ready = self.ready, []
+        settled = []
+        for index, levels in ready:
+            if levels is None:
+                print(f"Error loading image {self.files[index]}: Unable to load image")
+                self.failed.add(index)
+                settled.append(index)
+            elif index in self.wanted and index not in self.slides:
+                self.queue.submit(index, levels, 'slide')
+            else:
+                settled.append(index)
+        for index in self.queue.keys():
+            if index not in self.wanted:
+                self.queue.cancel(index)
+                settled.append(index)
+        more = self.queue.step(current)
+        for job in self.queue.take_all():
+            settled.append(job.key)
+            self.install(job)
+        with self.lock:
+            self.pending.difference_update(settled)
+        return more
+
+    def install(self, job):
+        self.evict_until(self.budget - job.bytes)
+        self.slides[job.key] = {'texture': job.texture, 'size': job.size, 'bytes': job.bytes, 'last_used': self.frame}
+        self.resident_bytes += job.bytes
+        self.uploads += 1
+
+    def evict_until(self, target):
+        # The prefetch window and the slide on screen stay: the budget is
+        # exceeded rather than evicting what is about to be shown.
+        candidates = sorted((s['last_used'], index) for index, s in self.slides.items()
+                            if index not in self.wanted and index != self.shown)
+        for _, index in candidates:
+            if self.resident_bytes <= target:
+                break
+            slide = self.slides.pop(index)
+            GLResources.delete_textures([slide['texture']])
+            self.resident_bytes -= slide['bytes']
+            self.evictions += 1
+
+    def update(self, current, direction=1):
+        # Returns the slide to draw (the current one, or the last shown while
+        # it loads; None before the first upload) and whether work is pending.
+        self.frame += 1
+        order = self.neighbours(current, direction)
+        with self.lock:
+            self.wanted = set(order)
+            for index in reversed(order):
+                if index not in self.slides and index not in self.pending and index not in self.failed:
+                    self.pending.add(index)
+                    self.requests.put(index)
+        more = self.upload_ready(current)
+        if current in self.slides:
+            self.shown = current
+        if self.shown is not None and self.shown in self.slides:
+            self.slides[self.shown]['last_used'] = self.frame
+        if self.resident_bytes > self.budget:
+            self.evict_until(self.budget)
+        slide = self.slides.get(self.shown) if self.shown is not None else None
+        return slide, more
+
+    def stop(self):
+        for _ in self.threads:
+            self.requests.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def release(self):
+        self.queue.release()
+        GLResources.delete_textures([slide['texture'] for slide in self.slides.values()])
+        self.slides = {}
+        self.resident_bytes = 0
+
+    def summary(self):
+        return (f"Slide cache : {len(self.files)} slides, {len(self.slides)} resident, VRAM : "
+                f"{self.resident_bytes / 1024 / 1024:.1f}/{self.budget / 1024 / 1024:.0f} MB, Loaded : {self.loaded}, "
+                f"Uploads : {self.uploads}, Evictions : {self.evictions}, Failed : {len(self.failed)}")
@@ -8,6 +8,9 @@ from OpenGL.GLU import *
 from OpenGL.GLUT import *
 from PIL import Image
 import pyautogui
+import time
+from RenderScheduler import RenderScheduler
+import GLResources
 
 texture_path = "T.jpg"
 heightmap_path = "H.jpg"
@@ -40,9 +43,14 @@ texture_id = None
 water_level = -0.1  
 
 light_angle = 0.0
+light_speed = 33.0  # degrees per second
+light_time = None
 animate_light = True
 
 QFullScreen = False
+max_fps = 60.0
+scheduler = None
+leak_check = GLResources.LeakCheck()
 
 def load_texture(path):
     im = Image.open(path)
@@ -50,7 +58,8 @@ def load_texture(path):
     ix, iy = im.size
     image_data = im.tobytes()
 
-    tid = glGenTextures(1)
+    tid = GLResources.gen_textures(1, 'map')
+    GLResources.set_bytes('texture', tid, ix * iy * 3)
     glBindTexture(GL_TEXTURE_2D, tid)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
@@ -183,8 +192,11 @@ def reshape(w, h):
     glLoadIdentity()
     gluPerspective(45.0, w / float(h), 0.1, 1000.0)
     glMatrixMode(GL_MODELVIEW)
+    scheduler.request_redraw()
 
 def display():
+    scheduler.begin_frame()
+    update_light()
     glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
     glLoadIdentity()
 
@@ -222,6 +234,8 @@ def display():
 
     draw_water_sphere()
     glutSwapBuffers()
+    scheduler.end_frame()
+    leak_check.frame()
 
 def mouse(button, state, x, y):
     global mouse_left_down, mouse_x, mouse_y, zoom
@@ -231,10 +245,10 @@ def mouse(button, state, x, y):
         mouse_left_down = (state == GLUT_DOWN)
     elif button == 3 and state == GLUT_DOWN:
         zoom = max(10, zoom - 5)
-        glutPostRedisplay()
+        scheduler.request_redraw()
     elif button == 4 and state == GLUT_DOWN:
         zoom = min(500, zoom + 5)
-        glutPostRedisplay()
+        scheduler.request_redraw()
 
 def motion(x, y):
     global angle_x, angle_y, mouse_x, mouse_y
@@ -247,14 +261,17 @@ def motion(x, y):
         angle_x = max(-89, min(89, angle_x))
 
     mouse_x, mouse_y = x, y
-    glutPostRedisplay()
+    scheduler.request_redraw()
 
 def keyboard(key, x, y):
-    global height_scale, animate_light, water_level
+    global height_scale, animate_light, water_level, light_time
     try:
         key = key.decode("utf-8")
         if key == "q" or key == "\x1b":
             print("Close Esc or Q")
+            print(scheduler.summary())
+            GLResources.delete_textures([texture_id])
+            print(GLResources.summary())
             try:
                 glutLeaveMainLoop()
             except NameError:
@@ -263,33 +280,37 @@ def keyboard(key, x, y):
             sys.exit(0)
         elif key == "8":
             water_level += 0.1
-            glutPostRedisplay()
+            scheduler.request_redraw()
         elif key == "2":
             water_level -= 0.1
-            glutPostRedisplay()
+            scheduler.request_redraw()
         elif key == "+" or key == "=":
             height_scale += 1
             generate_sphere()
-            glutPostRedisplay()
+            scheduler.request_redraw()
         elif key == "-":
             height_scale = max(0, height_scale - 1)
             generate_sphere()
-            glutPostRedisplay()
+            scheduler.request_redraw()
         elif key == "l":
             animate_light = not animate_light
+            # Restart the clock so the light resumes where it stopped.
+            light_time = None
+            scheduler.set_animating(animate_light)
     except SystemExit:
         pass
 
-def update(value):
-    global light_angle
-    if animate_light:
-        light_angle += 1.0
-        if light_angle >= 360.0:
-            light_angle -= 360.0
-        glutPostRedisplay()
-    glutTimerFunc(30, update, 0)
+def update_light():
+    global light_angle, light_time
+    now = time.perf_counter()
+    if animate_light and light_time is not None:
+        light_angle += light_speed * (now - light_time)
+        light_angle %= 360.0
+    light_time = now
 
 def main():
+    global scheduler
+    scheduler = RenderScheduler(max_fps)
     glutInit()
     glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGBA | GLUT_DEPTH)
     
@@ -304,6 +325,7 @@ def main():
         glutInitWindowPosition(100, 100)
         glutCreateWindow(b"Spherical Map 3D")
         
+    scheduler.attach_glut(glutPostRedisplay, glutTimerFunc)
     init()
 
     glutDisplayFunc(display)
@@ -312,7 +334,7 @@ def main():
     glutMotionFunc(motion)
     glutKeyboardFunc(keyboard)
 
-    glutTimerFunc(30, update, 0)
+    scheduler.set_animating(animate_light)
 
     glutMainLoop()
 
@@ -328,6 +350,7 @@ if __name__ == "__main__":
     parser.add_argument('--sphere_latitude_samples', type=int, default=100, help='sphere_latitude_samples.')
     parser.add_argument('--sphere_longitude_samples', type=int, default=100, help='sphere_longitude_samples.')
     parser.add_argument('--Fullscreen', type=int, default=0, help='Enable fullscreen mode')
+    parser.add_argument('--MaxFPS', type=float, default=60.0, help='Frame rate cap (redraws only on input or animation)')
     
     
     args = parser.parse_args()
@@ -339,5 +362,6 @@ if __name__ == "__main__":
     sphere_latitude_samples = args.sphere_latitude_samples
     sphere_longitude_samples = args.sphere_longitude_samples
     QFullScreen=args.Fullscreen
+    max_fps = args.MaxFPS
     
     main()
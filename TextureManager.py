@@ -0,0 +1,134 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Texture residency manager for ViewerOBJ.
+# Textures are registered by key and uploaded on first use. Each upload picks
+# RGB or RGBA from the actual alpha content, is downscaled to fit
+# GL_MAX_TEXTURE_SIZE and its share of the VRAM budget, and gets mipmaps.
+# Textures not used during recent frames are evicted (LRU) when the budget
+# is exceeded and reloaded when their material becomes visible again.
+
+import OpenGL.GL as gl
+import GLResources
+from PIL import Image
+
+Image.MAX_IMAGE_PIXELS = None
+
+
+def has_alpha(im):
+    if im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info):
+        alpha = im.convert('RGBA').getchannel('A')
+        return alpha.getextrema()[0] < 255
+    return False
+
+
+class TextureManager:
+    def __init__(self, budget_mb=512.0):
+        self.budget = budget_mb * 1024 * 1024
+        self.max_size = None
+        self.entries = {}
+        self.resident_bytes = 0
+        self.frame = 0
+        self.uploads = 0
+        self.evictions = 0
+        self.warned = False
+
+    def register(self, key, path):
+        if key not in self.entries:
+            self.entries[key] = {'path': path, 'tid': None, 'bytes': 0, 'last_used': -1,
+                                 'size': None, 'alpha': None, 'failed': False}
+
+    def begin_frame(self):
+        self.frame += 1
+
+    def end_frame(self):
+        if self.resident_bytes > self.budget:
+            self.evict_until(self.budget)
+
+    def bind(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry['failed']:
+            return False
+        if entry['tid'] is None and not self.load(entry):
+            return False
+        entry['last_used'] = self.frame
+        gl.glBindTexture(gl.GL_TEXTURE_2D, entry['tid'])
+        return True
+
+    def preload(self):
+        for entry in self.entries.values():
+            if entry['tid'] is None and not entry['failed']:
+                self.load(entry)
+
+    def share(self):
+        return self.budget / max(1, len(self.entries))
+
+    def load(self, entry):
+        if self.max_size is None:
+            self.max_size = int(gl.glGetIntegerv(gl.GL_MAX_TEXTURE_SIZE))
+        try:
+            im = Image.open(entry['path'])
+            alpha = has_alpha(im) if entry['alpha'] is None else entry['alpha']
+            mode, bpp = ('RGBA', 4) if alpha else ('RGB', 3)
+            w, h = im.size
+            share = self.share()
+            while (w > self.max_size or h > self.max_size or w * h * bpp * 4 / 3 > share) and max(w, h) > 1:
+                w, h = max(1, w // 2), max(1, h // 2)
+            # JPEG decoders can scale by 1/2..1/8 while decoding.
+            im.draft(mode, (w, h))
+            im = im.convert(mode)
+            if im.size != (w, h):
+                im = im.resize((w, h), Image.LANCZOS)
+        except Exception as e:
+            print(f"Error Load Texture {entry['path']}: {e}")
+            entry['failed'] = True
+            return False
+
+        nbytes = int(w * h * bpp * 4 / 3)
+        self.evict_until(self.budget - nbytes)
+        if self.resident_bytes + nbytes > self.budget and not self.warned:
+            print("Texture budget exceeded by visible materials")
+            self.warned = True
+
+        tid = GLResources.gen_textures(1, 'material')
+        GLResources.set_bytes('texture', tid, nbytes)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, tid)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        fmt = gl.GL_RGBA if alpha else gl.GL_RGB
+        internal = gl.GL_RGBA8 if alpha else gl.GL_RGB8
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, internal, w, h, 0, fmt, gl.GL_UNSIGNED_BYTE,
+                        im.tobytes("raw", mode, 0, -1))
+        gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR_MIPMAP_LINEAR)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        entry.update({'tid': tid, 'bytes': nbytes, 'size': (w, h), 'alpha': alpha})
+        self.resident_bytes += nbytes
+        self.uploads += 1
+        return True
+
+    def evict_until(self, target):
+        candidates = [e for e in self.entries.values()
+                      if e['tid'] is not None and e['last_used'] < self.frame]
+        candidates.sort(key=lambda e: e['last_used'])
+        for entry in candidates:
+            if self.resident_bytes <= target:
+                break
+            self.unload(entry)
+            self.evictions += 1
+
+    def unload(self, entry):
+        GLResources.delete_textures([entry['tid']])
+        self.resident_bytes -= entry['bytes']
+        entry['tid'] = None
+        entry['bytes'] = 0
+
+    def release(self):
+        for entry in self.entries.values():
+            if entry['tid'] is not None:
+                self.unload(entry)
+
+    def summary(self):
+        resident = sum(1 for e in self.entries.values() if e['tid'] is not None)
+        return (f"Textures resident : {resident}/{len(self.entries)}, "
+                f"VRAM : {self.resident_bytes / 1024 / 1024:.1f}/{self.budget / 1024 / 1024:.0f} MB, "
+                f"Uploads : {self.uploads}, Evictions : {self.evictions}")
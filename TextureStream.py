@@ -0,0 +1,228 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Streaming texture uploads for ViewerMovieInVBO.
+# Frames are copied into a ring of pixel unpack buffers and uploaded from
+# there with glTexSubImage2D, so the driver transfers frame n while frame n+1
+# is being copied. Decoded BGR frames are uploaded as GL_BGR (no cvtColor).
+# With GL 4.4 / ARB_buffer_storage the buffers are mapped once, persistently,
+# and fences keep the CPU from overwriting a buffer still being read;
+# otherwise each upload orphans and maps the next buffer.
+
+import os
+import time
+import ctypes
+import numpy as np
+
+# The upload measurement runs offscreen through EGL, which has to be selected
+# before PyOpenGL is imported.
+if __name__ == "__main__":
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
+import OpenGL.GL as gl
+import GLResources
+
+channels_of = {gl.GL_BGR: 3, gl.GL_RGB: 3, gl.GL_BGRA: 4, gl.GL_RGBA: 4, gl.GL_RED: 1, gl.GL_RG: 2}
+internal_of = {gl.GL_BGR: gl.GL_RGB8, gl.GL_RGB: gl.GL_RGB8, gl.GL_BGRA: gl.GL_RGBA8,
+               gl.GL_RGBA: gl.GL_RGBA8, gl.GL_RED: gl.GL_R8, gl.GL_RG: gl.GL_RG8}
+
+
+def supports_persistent_mapping():
+    try:
+        major, minor = [int(x) for x in gl.glGetString(gl.GL_VERSION).decode().split()[0].split('.')[:2]]
+    except (AttributeError, ValueError):
+        return False
+    return (major, minor) >= (4, 4) and bool(gl.glBufferStorage)
+
+
+class TextureStream:
+    def __init__(self, width, height, pixel_format=gl.GL_BGR, buffers=3, persistent=None):
+        self.pixel_format = pixel_format
+        self.channels = channels_of[pixel_format]
+        self.count = max(1, buffers)
+        self.persistent = supports_persistent_mapping() if persistent is None else persistent
+        self.texture = GLResources.gen_textures(1, 'video')
+        self.pbos = []
+        self.pointers = []
+        self.fences = []
+        self.width = self.height = 0
+        self.next = 0
+        self.uploads = 0
+        self.upload_time = 0.0
+        self.max_upload = 0.0
+        self.fence_waits = 0
+        self.allocate(width, height)
+
+    @property
+    def frame_bytes(self):
+        return self.width * self.height * self.channels
+
+    def allocate(self, width, height):
+        # (Re)creates the texture storage and the buffer ring for a frame size.
+        self.release_buffers()
+        self.width, self.height = width, height
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, internal_of[self.pixel_format], width, height, 0,
+                        self.pixel_format, gl.GL_UNSIGNED_BYTE, None)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        GLResources.set_bytes('texture', self.texture, self.frame_bytes)
+
+        size = self.frame_bytes
+        self.pbos = [GLResources.gen_buffers(1, 'pbo') for _ in range(self.count)]
+        self.fences = [None] * self.count
+        self.pointers = []
+        flags = gl.GL_MAP_WRITE_BIT | gl.GL_MAP_PERSISTENT_BIT | gl.GL_MAP_COHERENT_BIT
+        for pbo in self.pbos:
+            gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, pbo)
+            if self.persistent:
+                gl.glBufferStorage(gl.GL_PIXEL_UNPACK_BUFFER, size, None, flags)
+                self.pointers.append(gl.glMapBufferRange(gl.GL_PIXEL_UNPACK_BUFFER, 0, size, flags))
+            else:
+                gl.glBufferData(gl.GL_PIXEL_UNPACK_BUFFER, size, None, gl.GL_STREAM_DRAW)
+            GLResources.set_bytes('buffer', pbo, size)
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+
+    def upload(self, image):
+        t0 = time.perf_counter()
+        h, w = image.shape[:2]
+        if (w, h) != (self.width, self.height):
+            self.allocate(w, h)
+        image = np.ascontiguousarray(image)
+        size = self.frame_bytes
+        i = self.next
+        self.next = (self.next + 1) % self.count
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, self.pbos[i])
+        if self.persistent:
+            if self.fences[i] is not None:
+                # Only blocks if the GPU is still reading this buffer.
+                status = gl.glClientWaitSync(self.fences[i], 0, 0)
+                if status == gl.GL_TIMEOUT_EXPIRED:
+                    self.fence_waits += 1
+                    gl.glClientWaitSync(self.fences[i], gl.GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000)
+                gl.glDeleteSync(self.fences[i])
+                self.fences[i] = None
+            ctypes.memmove(self.pointers[i], image.ctypes.data, size)
+        else:
+            gl.glBufferData(gl.GL_PIXEL_UNPACK_BUFFER, size, None, gl.GL_STREAM_DRAW)
+            pointer = gl.glMapBufferRange(gl.GL_PIXEL_UNPACK_BUFFER, 0, size,
+                                          gl.GL_MAP_WRITE_BIT | gl.GL_MAP_INVALIDATE_BUFFER_BIT)
+            ctypes.memmove(pointer, image.ctypes.data, size)
+            gl.glUnmapBuffer(gl.GL_PIXEL_UNPACK_BUFFER)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, w, h, self.pixel_format, gl.GL_UNSIGNED_BYTE, None)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+        if self.persistent:
+            self.fences[i] = gl.glFenceSync(gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        elapsed = time.perf_counter() - t0
+        self.uploads += 1
+        self.upload_time += elapsed
+        self.max_upload = max(self.max_upload, elapsed)
+
+    def bind(self):
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+
+    def unbind(self):
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+    def release_buffers(self):
+        for fence in self.fences:
+            if fence is not None:
+                gl.glDeleteSync(fence)
+        for pbo in self.pbos:
+            if self.persistent:
+                gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, pbo)
+                gl.glUnmapBuffer(gl.GL_PIXEL_UNPACK_BUFFER)
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+        GLResources.delete_buffers(self.pbos)
+        self.pbos, self.pointers, self.fences = [], [], []
+
+    def release(self):
+        self.release_buffers()
+        GLResources.delete_textures([self.texture])
+
+    def stats(self):
+        return {
+            'persistent': self.persistent,
+            'buffers': self.count,
+            'uploads': self.uploads,
+            'upload_ms': 1000.0 * self.upload_time / max(1, self.uploads),
+            'max_upload_ms': 1000.0 * self.max_upload,
+            'fence_waits': self.fence_waits,
+        }
+
+    def summary(self):
+        s = self.stats()
+        mapping = "persistent" if s['persistent'] else "orphaned"
+        return (f"Texture stream : {s['buffers']} {mapping} PBOs, {s['uploads']} uploads, "
+                f"{s['upload_ms']:.2f} ms mean, {s['max_upload_ms']:.2f} ms max, fence waits {s['fence_waits']}")
+
+
+def upload_rgb_sync(texture, image):
+    # Previous ViewerMovieInVBO path, kept for comparison.
+    import cv2
+    frame_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    h, w, _ = frame_rgb.shape
+    gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+    gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, w, h, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, frame_rgb)
+    gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+
+def measure(width, height, frames):
+    # Mean CPU time per upload call, and per upload + glFinish.
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(4)]
+    results = {}
+    paths = [('sync_rgb', None), ('pbo_orphan', False)]
+    if supports_persistent_mapping():
+        paths.append(('pbo_persistent', True))
+    for name, persistent in paths:
+        stream = TextureStream(width, height, gl.GL_BGR, 3, bool(persistent))
+        call_time = finish_time = 0.0
+        for i in range(frames):
+            t0 = time.perf_counter()
+            if persistent is None:
+                upload_rgb_sync(stream.texture, images[i % len(images)])
+            else:
+                stream.upload(images[i % len(images)])
+            t1 = time.perf_counter()
+            gl.glFinish()
+            call_time += t1 - t0
+            finish_time += time.perf_counter() - t0
+        results[name] = {'call_ms': 1000.0 * call_time / frames, 'frame_ms': 1000.0 * finish_time / frames}
+        stream.release()
+    # Same frames as I420 planes (converted beforehand, as the decoder does).
+    from YUVFrame import bgr_to_yuv
+    from YUVTexture import YUVTextureStream
+    frames_yuv = [bgr_to_yuv(image) for image in images]
+    stream = YUVTextureStream(width, height, 'I420', 3)
+    call_time = finish_time = 0.0
+    for i in range(frames):
+        t0 = time.perf_counter()
+        stream.upload(frames_yuv[i % len(frames_yuv)])
+        t1 = time.perf_counter()
+        gl.glFinish()
+        call_time += t1 - t0
+        finish_time += time.perf_counter() - t0
+    results['pbo_yuv420'] = {'call_ms': 1000.0 * call_time / frames, 'frame_ms': 1000.0 * finish_time / frames}
+    stream.release()
+    return results
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--Frames', type=int, default=60, help='Uploads measured per size and path.')
+    args = parser.parse_args()
+    from OffscreenGL import create_offscreen_context, destroy_offscreen_context
+    offscreen = create_offscreen_context(64, 64)
+    report = {'renderer': gl.glGetString(gl.GL_RENDERER).decode(errors='replace')}
+    for label, (w, h) in (('1080p', (1920, 1080)), ('4K', (3840, 2160))):
+        report[label] = measure(w, h, args.Frames)
+    destroy_offscreen_context(offscreen)
+    print(json.dumps(report, indent=2))
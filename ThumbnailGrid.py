@@ -0,0 +1,340 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Contact-sheet mode for ViewerSlidePictures.
+# Thumbnails are packed into a few large atlas textures (thumb_size cells,
+# slot i of the folder in cell i of the atlas pages) instead of one texture
+# per image. Background threads decode them at reduced scale and the render
+# loop copies them in with glTexSubImage2D within a per-frame time budget.
+# The visible cells are drawn from one streamed vertex buffer with one draw
+# call per atlas page, so the cost of a frame depends on the window, not on
+# the folder: pages that are not in view are evicted beyond a VRAM budget
+# and their thumbnails decoded again when scrolled back to. With a
+# DirectoryIndex, thumbnails are read from and saved to the index, and
+# placeholders take the image's aspect before it is loaded.
+
+import time
+import ctypes
+import queue
+import threading
+import numpy as np
+import OpenGL.GL as gl
+from PIL import Image
+import GLResources
+
+thumb_size = 128
+max_atlas_size = 4096
+# Thumbnails fill this fraction of their cell.
+thumb_fill = 0.9
+# Scroll easing, per second: the view covers this fraction of the distance
+# to the scroll target in 1/scroll_rate s.
+scroll_rate = 12.0
+
+
+def load_thumbnail(path):
+    # JPEG draft mode decodes directly at a reduced scale.
+    with Image.open(path) as im:
+        im.draft('RGB', (thumb_size, thumb_size))
+        im = im.convert('RGB')
+        im.thumbnail((thumb_size, thumb_size))
+        return np.asarray(im)
+
+
+class ThumbnailGrid:
+    def __init__(self, files, columns=8, budget_mb=256.0, loaders=2, on_ready=None, upload_budget_ms=4.0,
+                 index=None):
+        self.files = files
+        self.index = index
+        self.columns = max(1, columns)
+        self.atlas_size = min(max_atlas_size, int(gl.glGetIntegerv(gl.GL_MAX_TEXTURE_SIZE)))
+        self.per_row = self.atlas_size // thumb_size
+        self.per_page = self.per_row * self.per_row
+        self.page_bytes = self.atlas_size * self.atlas_size * 3
+        self.budget = budget_mb * 1024 * 1024
+        self.upload_budget = upload_budget_ms / 1000.0
+        self.on_ready = on_ready
+        self.pages = {}
+        self.thumbs = {}
+        self.frame = 0
+        self.wanted = set()
+        self.pending = set()
+        self.failed = set()
+        self.ready = []
+        self.lock = threading.Lock()
+        self.requests = queue.LifoQueue()
+        self.scroll = 0.0
+        self.target = 0.0
+        self.direction = 1
+        self.t_last = None
+        self.window = (1, 1)
+        self.vbo = GLResources.gen_buffers(1, 'grid')
+        self.loaded = 0
+        self.evictions = 0
+        self.threads = [threading.Thread(target=self.loader, daemon=True) for _ in range(max(1, loaders))]
+        for thread in self.threads:
+            thread.start()
+
+    def loader(self):
+        while True:
+            index = self.requests.get()
+            if index is None:
+                return
+            with self.lock:
+                stale = index not in self.wanted
+                if stale:
+                    self.pending.discard(index)
+            if stale:
+                continue
+            image = self.index.get_thumbnail(self.files[index]) if self.index is not None else None
+            if image is None:
+                try:
+                    image = load_thumbnail(self.files[index])
+                except (OSError, ValueError) as e:
+                    print(f"Error loading thumbnail {self.files[index]}: {e}")
+                else:
+                    if self.index is not None:
+                        self.index.put_thumbnail(self.files[index], image)
+            with self.lock:
+                self.ready.append((index, image))
+                self.loaded += 1
+            if self.on_ready is not None:
+                self.on_ready()
+
+    @property
+    def rows(self):
+        return (len(self.files) + self.columns - 1) // self.columns
+
+    def cell(self):
+        return self.window[0] / self.columns
+
+    def visible_rows(self):
+        return self.window[1] / self.cell()
+
+    def max_scroll(self):
+        return max(0.0, self.rows - self.visible_rows())
+
+    def scroll_by(self, rows):
+        self.target = min(max(0.0, self.target + rows), self.max_scroll())
+        self.direction = 1 if rows >= 0 else -1
+
+    def show(self, index):
+        # Scrolls just enough for the cell of `index` to be in view.
+        row = index // self.columns
+        if row < self.target:
+            self.scroll_by(row - self.target)
+        elif row + 1 > self.target + self.visible_rows():
+            self.scroll_by(row + 1 - self.visible_rows() - self.target)
+
+    def index_at(self, x, y, window_w, window_h):
+        # Slide under a point in window coordinates (y down), or None.
+        cell = window_w / self.columns
+        col, row = int(x // cell), int((y + self.scroll * cell) // cell)
+        index = row * self.columns + col
+        return index if 0 <= col < self.columns and 0 <= index < len(self.files) else None
+
+    def visible_range(self, scroll):
+        first = max(0, int(scroll) * self.columns)
+        last = min(len(self.files), int(np.ceil(scroll + self.visible_rows())) * self.columns)
+        return first, last
+
+    def slot(self, index):
+        # Atlas page and texel origin of a slide's cell.
+        page, cell = divmod(index, self.per_page)
+        row, col = divmod(cell, self.per_row)
+        return page, col * thumb_size, row * thumb_size
+
+    def request(self, first, last):
+        with self.lock:
+            self.wanted = set(range(first, last))
+            for index in reversed(range(first, last)):
+                if index not in self.thumbs and index not in self.pending and index not in self.failed:
+                    self.pending.add(index)
+                    self.requests.put(index)
+
+    def upload_ready(self, t0):
+        # Copies decoded thumbnails into their atlas cells until the frame's
+        # upload budget is spent. Returns True while some are waiting.
+        with self.lock:
+            ready, self.ready = self.ready, []
+        done = 0
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        for index, image in ready:
+            if time.perf_counter() - t0 >= self.upload_budget:
+                break
+            done += 1
+            if image is None:
+                self.failed.add(index)
+                continue
+            if index not in self.wanted:
+                continue
+            page, x, y = self.slot(index)
+            if page not in self.pages:
+                self.evict_until(self.budget - self.page_bytes)
+                self.pages[page] = {'texture': self.create_page(), 'last_used': self.frame, 'thumbs': set()}
+            h, w = image.shape[:2]
+            gl.glBindTexture(gl.GL_TEXTURE_2D, self.pages[page]['texture'])
+            gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, x, y, w, h, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, image)
+            self.thumbs[index] = (w, h)
+            self.pages[page]['thumbs'].add(index)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        with self.lock:
+            self.pending.difference_update(index for index, _ in ready[:done])
+            self.ready = ready[done:] + self.ready
+            return len(self.ready) > 0
+
+    def create_page(self):
+        texture_id = GLResources.gen_textures(1, 'atlas')
+        GLResources.set_bytes('texture', texture_id, self.page_bytes)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, texture_id)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB8, self.atlas_size, self.atlas_size, 0, gl.GL_RGB,
+                        gl.GL_UNSIGNED_BYTE, None)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+        return texture_id
+
+    def evict_until(self, target):
+        # Pages drawn in the last two frames stay.
+        candidates = sorted((p['last_used'], page) for page, p in self.pages.items()
+                            if p['last_used'] < self.frame - 1)
+        for _, page in candidates:
+            if len(self.pages) * self.page_bytes <= target:
+                break
+            entry = self.pages.pop(page)
+            GLResources.delete_textures([entry['texture']])
+            for index in entry['thumbs']:
+                self.thumbs.pop(index, None)
+            self.evictions += 1
+
+    def update(self, window_w, window_h, current=None):
+        # Eases the scroll, requests the visible thumbnails (plus one screen
+        # ahead in the scroll direction) and uploads decoded ones. Returns
+        # True while the view is moving or thumbnails are arriving.
+        t0 = time.perf_counter()
+        self.frame += 1
+        self.window = (max(1, window_w), max(1, window_h))
+        self.target = min(self.target, self.max_scroll())
+        dt = 0.0 if self.t_last is None else min(0.1, t0 - self.t_last)
+        self.t_last = t0
+        moving = abs(self.target - self.scroll) > 1e-3
+        if moving:
+            self.scroll += (self.target - self.scroll) * min(1.0, dt * scroll_rate)
+        else:
+            self.scroll = self.target
+            self.t_last = None
+        first, last = self.visible_range(self.scroll)
+        ahead = int(np.ceil(self.visible_rows())) * self.columns
+        if self.direction > 0:
+            self.request(first, min(len(self.files), last + ahead))
+        else:
+            self.request(max(0, first - ahead), last)
+        for index in range(first, last):
+            page = index // self.per_page
+            if page in self.pages:
+                self.pages[page]['last_used'] = self.frame
+        more = self.upload_ready(t0)
+        return moving or more
+
+    def draw(self, window_w, window_h, current=None):
+        cell = self.cell()
+        first, last = self.visible_range(self.scroll)
+        top = -self.scroll * cell
+        quads = {}
+        for index in range(first, last):
+            row, col = divmod(index, self.columns)
+            cx, cy = (col + 0.5) * cell, top + (row + 0.5) * cell
+            size = self.thumbs.get(index)
+            if size is None:
+                # Placeholder while the thumbnail loads, with the image's
+                # aspect when the index knows it.
+                w, h = self.index.size(self.files[index]) if self.index is not None else (None, None)
+                half_w = half_h = 0.5 * thumb_fill * cell
+                if w and h:
+                    half_w, half_h = half_w * min(1.0, w / h), half_h * min(1.0, h / w)
+                quads.setdefault(None, []).append((cx - half_w, cy - half_h, cx + half_w, cy + half_h, 0, 0, 0, 0))
+                continue
+            w, h = size
+            scale = thumb_fill * cell / thumb_size
+            page, x, y = self.slot(index)
+            s0, t0 = x / self.atlas_size, y / self.atlas_size
+            s1, t1 = (x + w) / self.atlas_size, (y + h) / self.atlas_size
+            quads.setdefault(page, []).append((cx - 0.5 * w * scale, cy - 0.5 * h * scale,
+                                               cx + 0.5 * w * scale, cy + 0.5 * h * scale, s0, t0, s1, t1))
+        batches = []
+        rects = []
+        for page, items in quads.items():
+            batches.append((page, len(rects), len(items)))
+            rects.extend(items)
+        if rects:
+            r = np.array(rects, dtype=np.float32)
+            x0, y0, x1, y1, s0, t0, s1, t1 = r.T
+            vertices = np.stack([
+                np.stack([x0, y0, s0, t0], axis=1), np.stack([x1, y0, s1, t0], axis=1),
+                np.stack([x1, y1, s1, t1], axis=1), np.stack([x0, y1, s0, t1], axis=1)], axis=1)
+            vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+
+        gl.glPushAttrib(gl.GL_ENABLE_BIT)
+        gl.glDisable(gl.GL_DEPTH_TEST)
+        gl.glDisable(gl.GL_LIGHTING)
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
+        gl.glOrtho(0, window_w, window_h, 0, -1, 1)
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glPushMatrix()
+        gl.glLoadIdentity()
+        if rects:
+            gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vbo)
+            GLResources.buffer_data(gl.GL_ARRAY_BUFFER, self.vbo, vertices.nbytes, vertices, gl.GL_STREAM_DRAW)
+            gl.glEnableClientState(gl.GL_VERTEX_ARRAY)
+            gl.glEnableClientState(gl.GL_TEXTURE_COORD_ARRAY)
+            gl.glVertexPointer(2, gl.GL_FLOAT, 16, None)
+            gl.glTexCoordPointer(2, gl.GL_FLOAT, 16, ctypes.c_void_p(8))
+            for page, start, count in batches:
+                if page is None:
+                    gl.glDisable(gl.GL_TEXTURE_2D)
+                    gl.glColor3f(0.25, 0.25, 0.25)
+                else:
+                    gl.glEnable(gl.GL_TEXTURE_2D)
+                    gl.glColor3f(1.0, 1.0, 1.0)
+                    gl.glBindTexture(gl.GL_TEXTURE_2D, self.pages[page]['texture'])
+                gl.glDrawArrays(gl.GL_QUADS, 4 * start, 4 * count)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+            gl.glDisableClientState(gl.GL_VERTEX_ARRAY)
+            gl.glDisableClientState(gl.GL_TEXTURE_COORD_ARRAY)
+            gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+        if current is not None and first <= current < last:
+            row, col = divmod(current, self.columns)
+            x0, y0 = col * cell + 2, top + row * cell + 2
+            gl.glDisable(gl.GL_TEXTURE_2D)
+            gl.glColor3f(1.0, 0.8, 0.2)
+            gl.glBegin(gl.GL_LINE_LOOP)
+            gl.glVertex2f(x0, y0)
+            gl.glVertex2f(x0 + cell - 4, y0)
+            gl.glVertex2f(x0 + cell - 4, y0 + cell - 4)
+            gl.glVertex2f(x0, y0 + cell - 4)
+            gl.glEnd()
+        gl.glColor3f(1.0, 1.0, 1.0)
+        gl.glPopMatrix()
+        gl.glMatrixMode(gl.GL_PROJECTION)
+        gl.glPopMatrix()
+        gl.glMatrixMode(gl.GL_MODELVIEW)
+        gl.glPopAttrib()
+        return len(batches)
+
+    def stop(self):
+        for _ in self.threads:
+            self.requests.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def release(self):
+        GLResources.delete_textures([p['texture'] for p in self.pages.values()])
+        GLResources.delete_buffers([self.vbo])
+        self.pages = {}
+        self.thumbs = {}
+
+    def summary(self):
+        return (f"Thumbnail grid : {len(self.files)} slides, {len(self.thumbs)} thumbnails in {len(self.pages)} "
+                f"{self.atlas_size}x{self.atlas_size} atlas pages ({len(self.pages) * self.page_bytes / 2 ** 20:.0f}/"
+                f"{self.budget / 2 ** 20:.0f} MB), Loaded : {self.loaded}, Evictions : {self.evictions}")
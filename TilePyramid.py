@@ -0,0 +1,410 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Deep-zoom tile pyramid for ViewerPictureInVBO.
+# A large image is cut once into a pyramid of JPEG tiles stored next to it
+# (level 0 is full resolution, each level halves the previous one, the last
+# fits in one tile). The viewer then draws only the tiles in view, at the
+# level matching the zoom: background threads read the missing tiles, the
+# render loop uploads a few of them per frame into a bounded GPU cache (LRU)
+# and draws the nearest coarser resident tile while a fine one is loading.
+
+import os
+import json
+import math
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from PIL import Image
+import OpenGL.GL as gl
+import RawImage
+import GLResources
+
+pyramid_version = 1
+tile_size = 512
+tile_quality = 92
+max_uploads_per_frame = 8
+
+
+def pyramid_dir(image_path):
+    return image_path + ".tiles"
+
+
+def tile_path(directory, level, col, row):
+    return os.path.join(directory, str(level), f"{col}_{row}.jpg")
+
+
+def load_meta(image_path):
+    path = os.path.join(pyramid_dir(image_path), "pyramid.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        meta = json.load(f)
+    st = os.stat(image_path)
+    if (meta.get('version') != pyramid_version or meta.get('source_mtime') != st.st_mtime
+            or meta.get('source_size') != st.st_size or meta.get('tile_size') != tile_size):
+        return None
+    return meta
+
+
+# Uncompressed PIL layouts that can be mapped: raw mode -> (order, channels).
+raw_layouts = {'RGB': ('RGB', 3), 'BGR': ('BGR', 3), 'RGBA': ('RGBA', 4), 'RGBX': ('RGBA', 4),
+               'BGRA': ('BGRA', 4), 'BGRX': ('BGRA', 4), 'L': ('GRAY', 1)}
+
+
+def map_uncompressed(path, im):
+    # Uncompressed BMP/TIFF (one raw block, or raw strips one after the
+    # other) as a MappedImage over the file, None for other layouts.
+    tiles = sorted(im.tile, key=lambda t: t.extents[1])
+    first = tiles[0]
+    args = first.args if isinstance(first.args, tuple) else (first.args,)
+    rawmode, stride, orientation = (args + (0, 1))[:3]
+    if rawmode not in raw_layouts or orientation not in (1, -1) or (orientation == -1 and len(tiles) > 1):
+        return None
+    order, channels = raw_layouts[rawmode]
+    w, h = im.size
+    stride = stride or w * channels
+    y = 0
+    for tile in tiles:
+        if (tile.codec_name != 'raw' or tile.args != first.args or tile.extents != (0, y, w, tile.extents[3])
+                or tile.offset != first.offset + y * stride):
+            return None
+        y = tile.extents[3]
+    if y != h:
+        return None
+    try:
+        rows = np.memmap(path, dtype=np.uint8, mode='r', offset=first.offset, shape=(h, stride))
+    except ValueError:
+        return None
+    pixels = np.ndarray((h, w, channels), dtype=np.uint8, buffer=rows, strides=(stride, channels, 1))
+    return RawImage.MappedImage(pixels[::-1] if orientation == -1 else pixels, order)
+
+
+def pil_bgr(band):
+    # 8-bit BGR (or gray) array of a PIL image, for OpenCV.
+    if band.mode.startswith('I;16'):
+        return (np.asarray(band).astype(np.uint16) >> 8).astype(np.uint8)
+    if band.mode == 'L':
+        return np.asarray(band)
+    return np.ascontiguousarray(np.asarray(band.convert('RGB'))[..., ::-1])
+
+
+def mapped_rows(image):
+    def read(y0, y1):
+        # The previous band is written by now: its pages can go.
+        image.release()
+        return image.bgr8(slice(y0, y1))
+    return read
+
+
+def open_source(image_path):
+    # (width, height, read(y0, y1)) returning 8-bit BGR rows y0..y1 of the
+    # source. Mapped and uncompressed files are read band by band; other
+    # formats are decoded once by PIL (no OpenCV 2^30 pixel limit) and cut
+    # into bands without further full-size copies.
+    if RawImage.is_mapped(image_path):
+        image = RawImage.open_mapped(image_path)
+        return image.width, image.height, mapped_rows(image)
+    limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+    try:
+        im = Image.open(image_path)
+    except OSError:
+        im = None
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+    if im is None:
+        image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise RuntimeError("Unable to load image")
+        return image.shape[1], image.shape[0], lambda y0, y1: image[y0:y1]
+    image = map_uncompressed(image_path, im)
+    if image is not None:
+        return image.width, image.height, mapped_rows(image)
+    return im.width, im.height, lambda y0, y1: pil_bgr(im.crop((0, y0, im.width, y1)))
+
+
+def halve(band):
+    # 2x2 box filter; an odd last row or column is repeated.
+    h, w = band.shape[:2]
+    if h % 2 or w % 2:
+        band = cv2.copyMakeBorder(band, 0, h % 2, 0, w % 2, cv2.BORDER_REPLICATE)
+    return cv2.resize(band, (band.shape[1] // 2, band.shape[0] // 2), interpolation=cv2.INTER_AREA)
+
+
+class PyramidWriter:
+    # Cuts bands of tile_size rows into tiles. A band written at one level is
+    # halved into the next, which writes its own band once it has two, so
+    # every coarser tile comes from the 2x2 tiles under it and at most one
+    # band per level is held in memory.
+    def __init__(self, out, levels, pool):
+        self.out = out
+        self.levels = levels
+        self.pool = pool
+        self.pending = [[] for _ in levels]
+        self.next_row = [0] * len(levels)
+        self.jobs = []
+
+    def feed(self, level, rows):
+        self.pending[level].append(rows)
+        while sum(len(r) for r in self.pending[level]) >= tile_size:
+            band = np.concatenate(self.pending[level]) if len(self.pending[level]) > 1 else self.pending[level][0]
+            self.pending[level] = [band[tile_size:]] if len(band) > tile_size else []
+            self.emit(level, band[:tile_size])
+
+    def emit(self, level, band):
+        row = self.next_row[level]
+        self.next_row[level] += 1
+        self.jobs += [self.pool.submit(cv2.imwrite, tile_path(self.out, level, c, row),
+                                       band[:, c * tile_size:(c + 1) * tile_size],
+                                       [cv2.IMWRITE_JPEG_QUALITY, tile_quality])
+                      for c in range(self.levels[level]['cols'])]
+        if level + 1 < len(self.levels):
+            self.feed(level + 1, halve(band))
+
+    def finish(self):
+        # Last, shorter bands, finest level first.
+        for level in range(len(self.levels)):
+            if self.pending[level]:
+                band = np.concatenate(self.pending[level])
+                self.pending[level] = []
+                self.emit(level, band)
+        self.wait()
+
+    def wait(self):
+        jobs, self.jobs = self.jobs, []
+        for job in jobs:
+            if not job.result():
+                raise RuntimeError(f"Unable to write tiles in {self.out}")
+
+
+def build_pyramid(image_path):
+    # The source is read by bands of tile_size rows; each band is written
+    # before the next is read, so memory is a few bands, not the image.
+    t0 = time.perf_counter()
+    width, height, read_rows = open_source(image_path)
+    sizes = [(width, height)]
+    while sizes[-1][0] > tile_size or sizes[-1][1] > tile_size:
+        w, h = sizes[-1]
+        sizes.append((max(1, (w + 1) // 2), max(1, (h + 1) // 2)))
+    levels = [{'width': w, 'height': h, 'cols': math.ceil(w / tile_size), 'rows': math.ceil(h / tile_size)}
+              for w, h in sizes]
+    out = pyramid_dir(image_path)
+    for level in range(len(levels)):
+        os.makedirs(os.path.join(out, str(level)), exist_ok=True)
+    with ThreadPoolExecutor() as pool:
+        writer = PyramidWriter(out, levels, pool)
+        for y in range(0, height, tile_size):
+            writer.feed(0, read_rows(y, min(y + tile_size, height)))
+            writer.wait()
+        writer.finish()
+    st = os.stat(image_path)
+    meta = {'version': pyramid_version, 'source_mtime': st.st_mtime, 'source_size': st.st_size,
+            'tile_size': tile_size, 'width': width, 'height': height, 'levels': levels}
+    with open(os.path.join(out, "pyramid.json"), 'w') as f:
+        json.dump(meta, f)
+    print(f"Tile pyramid built in {time.perf_counter() - t0:.1f} s : {len(levels)} levels, "
+          f"{sum(l['cols'] * l['rows'] for l in levels)} tiles")
+    return meta
+
+
+def ensure_pyramid(image_path):
+    meta = load_meta(image_path)
+    if meta is None:
+        print(f"Building tile pyramid for {image_path} ...")
+        meta = build_pyramid(image_path)
+    return meta
+
+
+class TilePyramid:
+    def __init__(self, image_path, budget_mb=256.0, loaders=4, on_ready=None):
+        self.meta = ensure_pyramid(image_path)
+        self.directory = pyramid_dir(image_path)
+        self.levels = self.meta['levels']
+        self.width, self.height = self.meta['width'], self.meta['height']
+        self.max_dim = max(self.width, self.height)
+        self.budget = budget_mb * 1024 * 1024
+        self.on_ready = on_ready
+        self.tiles = {}
+        self.resident_bytes = 0
+        self.frame = 0
+        self.wanted = {}
+        self.pending = set()
+        self.failed = set()
+        self.ready = []
+        self.lock = threading.Lock()
+        self.requests = queue.LifoQueue()
+        self.loaded = 0
+        self.uploads = 0
+        self.evictions = 0
+        self.level = len(self.levels) - 1
+        self.threads = [threading.Thread(target=self.loader, daemon=True) for _ in range(max(1, loaders))]
+        for thread in self.threads:
+            thread.start()
+        # The top level is one tile: loaded now and never evicted.
+        top = (len(self.levels) - 1, 0, 0)
+        self.upload(top, cv2.imread(tile_path(self.directory, *top), cv2.IMREAD_COLOR))
+        self.tiles[top]['pinned'] = True
+
+    def loader(self):
+        while True:
+            key = self.requests.get()
+            if key is None:
+                return
+            with self.lock:
+                # Skip tiles that went out of view while queued.
+                stale = self.wanted.get(key, -1) < self.frame - 2
+                if stale:
+                    self.pending.discard(key)
+            if stale:
+                continue
+            image = cv2.imread(tile_path(self.directory, *key), cv2.IMREAD_COLOR)
+            with self.lock:
+                self.ready.append((key, image))
+                self.loaded += 1
+            if self.on_ready is not None:
+                self.on_ready()
+
+    def choose_level(self, distance, window_h, fov_y=45.0):
+        # Level whose pixels are closest to (not smaller than) screen pixels
+        # for the quad seen from `distance`.
+        pixels_per_unit = window_h / (2.0 * distance * math.tan(math.radians(fov_y) / 2.0))
+        ratio = self.max_dim / max(pixels_per_unit, 1e-9)
+        level = int(math.floor(math.log2(ratio))) if ratio > 1.0 else 0
+        return min(max(0, level), len(self.levels) - 1)
+
+    def tile_rect(self, key):
+        # Quad coordinates (x0, y0, x1, y1) of a tile; y up, as create_vbos.
+        level, col, row = key
+        info = self.levels[level]
+        sx, sy = self.width / info['width'], self.height / info['height']
+        x0, x1 = col * tile_size, min((col + 1) * tile_size, info['width'])
+        y0, y1 = row * tile_size, min((row + 1) * tile_size, info['height'])
+        half_w, half_h = self.width / self.max_dim / 2, self.height / self.max_dim / 2
+        return (x0 * sx / self.max_dim - half_w, half_h - y1 * sy / self.max_dim,
+                x1 * sx / self.max_dim - half_w, half_h - y0 * sy / self.max_dim)
+
+    def visible_tiles(self, level, modelview, projection, viewport):
+        info = self.levels[level]
+        cols, rows = info['cols'], info['rows']
+        xs = [self.tile_rect((level, c, 0))[0] for c in range(cols)] + [self.tile_rect((level, cols - 1, 0))[2]]
+        ys = [self.tile_rect((level, 0, r))[3] for r in range(rows)] + [self.tile_rect((level, 0, rows - 1))[1]]
+        gx, gy = np.meshgrid(np.array(xs), np.array(ys))
+        points = np.stack([gx, gy, np.zeros_like(gx), np.ones_like(gx)], axis=-1).reshape(-1, 4)
+        clip = points @ np.asarray(modelview, dtype=np.float64).reshape(4, 4) \
+            @ np.asarray(projection, dtype=np.float64).reshape(4, 4)
+        w = clip[:, 3].reshape(rows + 1, cols + 1)
+        safe = np.where(np.abs(clip[:, 3]) > 1e-9, clip[:, 3], 1e-9)[:, None]
+        screen = (clip[:, :2] / safe).reshape(rows + 1, cols + 1, 2)
+        corners = np.stack([screen[:-1, :-1], screen[:-1, 1:], screen[1:, :-1], screen[1:, 1:]])
+        behind = np.stack([w[:-1, :-1], w[:-1, 1:], w[1:, :-1], w[1:, 1:]]) <= 1e-9
+        lo, hi = corners.min(axis=0), corners.max(axis=0)
+        inside = (lo[..., 0] <= 1) & (hi[..., 0] >= -1) & (lo[..., 1] <= 1) & (hi[..., 1] >= -1)
+        # Tiles crossing the camera plane are kept (conservative).
+        visible = inside | behind.any(axis=0)
+        return [(level, int(c), int(r)) for r, c in zip(*np.nonzero(visible))]
+
+    def request(self, key):
+        self.wanted[key] = self.frame
+        if key not in self.tiles and key not in self.pending and key not in self.failed:
+            self.pending.add(key)
+            self.requests.put(key)
+
+    def upload_ready(self):
+        with self.lock:
+            ready, self.ready = self.ready[:max_uploads_per_frame], self.ready[max_uploads_per_frame:]
+        for key, image in ready:
+            self.pending.discard(key)
+            if image is None:
+                print(f"Unable to read tile {tile_path(self.directory, *key)}")
+                self.failed.add(key)
+            elif key not in self.tiles:
+                self.upload(key, image)
+        return len(self.ready) > 0
+
+    def upload(self, key, image):
+        h, w = image.shape[:2]
+        nbytes = w * h * 3
+        self.evict_until(self.budget - nbytes)
+        tid = GLResources.gen_textures(1, 'tile')
+        GLResources.set_bytes('texture', tid, nbytes)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, tid)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB8, w, h, 0, gl.GL_BGR, gl.GL_UNSIGNED_BYTE, image)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        self.tiles[key] = {'tid': tid, 'bytes': nbytes, 'last_used': self.frame, 'pinned': False}
+        self.resident_bytes += nbytes
+        self.uploads += 1
+
+    def evict_until(self, target):
+        # Tiles drawn in the previous frame stay: when the view needs more
+        # than the budget, it is exceeded rather than thrashed.
+        candidates = [(t['last_used'], key) for key, t in self.tiles.items()
+                      if not t['pinned'] and t['last_used'] < self.frame - 1]
+        candidates.sort()
+        for _, key in candidates:
+            if self.resident_bytes <= target:
+                break
+            tile = self.tiles.pop(key)
+            GLResources.delete_textures([tile['tid']])
+            self.resident_bytes -= tile['bytes']
+            self.evictions += 1
+
+    def update(self, distance, modelview, projection, viewport):
+        # Returns the tiles to draw, coarsest first, and whether more work
+        # (uploads) is pending so the caller keeps redrawing.
+        self.frame += 1
+        more = self.upload_ready()
+        self.level = self.choose_level(distance, viewport[3])
+        draw = set()
+        with self.lock:
+            for key in self.visible_tiles(self.level, modelview, projection, viewport):
+                self.request(key)
+                level, col, row = key
+                while key not in self.tiles:
+                    # Stand-in: nearest coarser resident ancestor.
+                    level, col, row = level + 1, col // 2, row // 2
+                    key = (level, col, row)
+                draw.add(key)
+        for key in draw:
+            self.tiles[key]['last_used'] = self.frame
+        if self.resident_bytes > self.budget:
+            self.evict_until(self.budget)
+        return sorted(draw, key=lambda k: -k[0]), more
+
+    def draw(self, keys):
+        gl.glEnableClientState(gl.GL_VERTEX_ARRAY)
+        gl.glEnableClientState(gl.GL_TEXTURE_COORD_ARRAY)
+        texcoords = np.array([[0, 1], [1, 1], [1, 0], [0, 0]], dtype=np.float32)
+        gl.glTexCoordPointer(2, gl.GL_FLOAT, 0, texcoords)
+        for key in keys:
+            x0, y0, x1, y1 = self.tile_rect(key)
+            vertices = np.array([[x0, y0, 0], [x1, y0, 0], [x1, y1, 0], [x0, y1, 0]], dtype=np.float32)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, self.tiles[key]['tid'])
+            gl.glVertexPointer(3, gl.GL_FLOAT, 0, vertices)
+            gl.glDrawArrays(gl.GL_QUADS, 0, 4)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        gl.glDisableClientState(gl.GL_VERTEX_ARRAY)
+        gl.glDisableClientState(gl.GL_TEXTURE_COORD_ARRAY)
+
+    def stop(self):
+        for _ in self.threads:
+            self.requests.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def release(self):
+        GLResources.delete_textures([tile['tid'] for tile in self.tiles.values()])
+        self.tiles = {}
+        self.resident_bytes = 0
+
+    def summary(self):
+        return (f"Tile pyramid : {self.width}x{self.height}, {len(self.levels)} levels, level {self.level} shown, "
+                f"{len(self.tiles)} tiles resident, VRAM : {self.resident_bytes / 1024 / 1024:.1f}/"
+                f"{self.budget / 1024 / 1024:.0f} MB, Loaded : {self.loaded}, Uploads : {self.uploads}, "
+                f"Evictions : {self.evictions}")
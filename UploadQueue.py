@@ -0,0 +1,166 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Time-budgeted texture uploads for the picture viewers.
+# Worker threads decode an image and build its mip chain, then submit it
+# here. The render thread calls step() once per frame: it uploads slabs of
+# rows, level after level, into textures that are not shown yet, and stops
+# when the frame's millisecond budget is spent. A texture is handed back
+# only once every level is in, so nothing is drawn half uploaded and no
+# single load stalls a frame.
+
+import time
+import threading
+import cv2
+import numpy as np
+import OpenGL.GL as gl
+import GLResources
+
+# Rows are uploaded by slabs of about this size; the budget is checked
+# between slabs.
+slab_bytes = 1024 * 1024
+gl_formats = {1: gl.GL_LUMINANCE, 3: gl.GL_BGR, 4: gl.GL_BGRA}
+gl_internal = {1: gl.GL_LUMINANCE8, 3: gl.GL_RGB8, 4: gl.GL_RGBA8}
+
+
+def mip_chain(image):
+    levels = [image]
+    while max(levels[-1].shape[:2]) > 1:
+        h, w = levels[-1].shape[:2]
+        levels.append(cv2.resize(levels[-1], (max(1, w // 2), max(1, h // 2)), interpolation=cv2.INTER_AREA))
+    return levels
+
+
+class UploadJob:
+    def __init__(self, key, levels, owner):
+        self.key = key
+        self.levels = levels
+        self.count = len(levels)
+        self.owner = owner
+        self.size = (levels[0].shape[1], levels[0].shape[0])
+        self.bytes = sum(image.nbytes for image in levels)
+        self.texture = None
+        self.level = 0
+        self.row = 0
+
+    @property
+    def complete(self):
+        return self.level >= self.count
+
+
+class UploadQueue:
+    def __init__(self, budget_ms=4.0):
+        self.budget = budget_ms / 1000.0
+        self.jobs = {}
+        self.done = {}
+        self.dropped = []
+        self.lock = threading.Lock()
+        self.uploaded_bytes = 0
+        self.completed = 0
+        self.steps = 0
+        self.max_step = 0.0
+
+    @property
+    def busy(self):
+        return len(self.jobs) > 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.jobs or key in self.done
+
+    def submit(self, key, levels, owner=''):
+        # Any thread. `levels` is the mip chain, full resolution first.
+        with self.lock:
+            if key in self.jobs:
+                # Resubmitted: the partial texture is freed on the next step.
+                self.dropped.append(self.jobs[key])
+            self.jobs[key] = UploadJob(key, levels, owner)
+
+    def cancel(self, key):
+        # Render thread: drops a queued or finished but unclaimed upload.
+        with self.lock:
+            job = self.jobs.pop(key, None) or self.done.pop(key, None)
+        if job is not None and job.texture is not None:
+            GLResources.delete_textures([job.texture])
+
+    def keys(self):
+        with self.lock:
+            return list(self.jobs) + list(self.done)
+
+    def step(self, first=None):
+        # Render thread, once per frame: uploads slabs until the budget is
+        # spent (at least one slab, so every job progresses). `first` is
+        # served before the others. Returns True while uploads remain.
+        t0 = time.perf_counter()
+        with self.lock:
+            order = sorted(self.jobs.values(), key=lambda job: job.key != first)
+            dropped, self.dropped = self.dropped, []
+        GLResources.delete_textures([job.texture for job in dropped if job.texture is not None])
+        if not order:
+            return False
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        for job in order:
+            while not job.complete:
+                self.upload_slab(job)
+                if time.perf_counter() - t0 >= self.budget:
+                    break
+            if job.complete:
+                with self.lock:
+                    if self.jobs.get(job.key) is job:
+                        del self.jobs[job.key]
+                        self.done[job.key] = job
+                        self.completed += 1
+            if time.perf_counter() - t0 >= self.budget:
+                break
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        elapsed = time.perf_counter() - t0
+        self.steps += 1
+        self.max_step = max(self.max_step, elapsed)
+        return self.busy
+
+    def upload_slab(self, job):
+        if job.texture is None:
+            job.texture = GLResources.gen_textures(1, job.owner)
+            GLResources.set_bytes('texture', job.texture, job.bytes)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, job.texture)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAX_LEVEL, job.count - 1)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR_MIPMAP_LINEAR)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, job.texture)
+        image = job.levels[job.level]
+        h, w = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        fmt = gl_formats[channels]
+        if job.row == 0:
+            # Storage is allocated level by level, as the upload gets there.
+            gl.glTexImage2D(gl.GL_TEXTURE_2D, job.level, gl_internal[channels], w, h, 0, fmt, gl.GL_UNSIGNED_BYTE,
+                            None)
+        rows = min(h - job.row, max(1, slab_bytes // (w * channels)))
+        gl.glTexSubImage2D(gl.GL_TEXTURE_2D, job.level, 0, job.row, w, rows, fmt, gl.GL_UNSIGNED_BYTE,
+                           np.ascontiguousarray(image[job.row:job.row + rows]))
+        self.uploaded_bytes += rows * w * channels
+        job.row += rows
+        if job.row >= h:
+            job.level += 1
+            job.row = 0
+            if job.complete:
+                job.levels = None
+
+    def take(self, key):
+        # Finished upload for `key` (the caller now owns the texture) or None.
+        with self.lock:
+            return self.done.pop(key, None)
+
+    def take_all(self):
+        with self.lock:
+            done, self.done = list(self.done.values()), {}
+        return done
+
+    def release(self):
+        for key in self.keys():
+            self.cancel(key)
+
+    def summary(self):
+        return (f"Upload queue : {self.completed} textures, {self.uploaded_bytes / 2 ** 20:.0f} MB in {self.steps} "
+                f"frames, budget {1000.0 * self.budget:.1f} ms, longest frame {1000.0 * self.max_step:.1f} ms")
@@ -0,0 +1,108 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Compact vertex layout for ViewerOBJ.
+# Positions are stored as int16 relative to the model bounding box (decoded
+# in the draw path by a translate/scale on the modelview), normals as signed
+# bytes and texcoords as half floats: 16 bytes per vertex instead of 32.
+
+import numpy as np
+
+
+def compact_dtype(has_texcoords, has_normals):
+    fields = [('position', np.int16, 4)]
+    if has_normals:
+        fields.append(('normal', np.uint32))
+    if has_texcoords:
+        fields.append(('texcoord', np.float16, 2))
+    return np.dtype(fields)
+
+
+def position_transform(bbox):
+    min_x, max_x, min_y, max_y, min_z, max_z = bbox
+    center = np.array([(min_x + max_x) / 2, (min_y + max_y) / 2, (min_z + max_z) / 2], dtype=np.float64)
+    half = max(max_x - min_x, max_y - min_y, max_z - min_z) / 2
+    scale = half / 32767.0 if half > 0 else 1.0
+    return center, scale
+
+
+# Fixed-function glNormalPointer has no packed 10 bit type (Mesa rejects
+# GL_INT_2_10_10_10_REV there): three signed bytes and one padding byte.
+def pack_normals(normals):
+    length = np.linalg.norm(normals, axis=1)
+    length[length == 0] = 1.0
+    q = np.clip(np.round(normals / length[:, np.newaxis] * 127.0), -127, 127).astype(np.int32)
+    q &= 0xFF
+    return (q[:, 0] | (q[:, 1] << 8) | (q[:, 2] << 16)).astype(np.uint32)
+
+
+def unpack_normals(packed):
+    packed = packed.astype(np.int64)
+    q = np.stack([(packed >> shift) & 0xFF for shift in (0, 8, 16)], axis=1)
+    q[q >= 128] -= 256
+    return np.maximum(q / 127.0, -1.0)
+
+
+def quantize(data, stride, has_texcoords, has_normals, center, scale):
+    # data: flat float array in T2F_N3F_V3F order (missing parts omitted).
+    data = np.asarray(data, dtype=np.float32).reshape(-1, stride)
+    offset = 0
+    texcoords = normals = None
+    if has_texcoords:
+        texcoords = data[:, offset:offset + 2]
+        offset += 2
+    if has_normals:
+        normals = data[:, offset:offset + 3]
+        offset += 3
+    positions = data[:, offset:offset + 3].astype(np.float64)
+    out = np.zeros(len(data), dtype=compact_dtype(has_texcoords, has_normals))
+    out['position'][:, :3] = np.clip(np.round((positions - center) / scale), -32767, 32767)
+    if has_normals:
+        out['normal'] = pack_normals(normals)
+    if has_texcoords:
+        out['texcoord'] = texcoords
+    return out
+
+
+def dequantize(compact, center, scale):
+    positions = compact['position'][:, :3].astype(np.float64) * scale + center
+    names = compact.dtype.names
+    normals = unpack_normals(compact['normal']) if 'normal' in names else None
+    texcoords = compact['texcoord'].astype(np.float32) if 'texcoord' in names else None
+    return positions, normals, texcoords
+
+
+def quality_report(data, stride, has_texcoords, has_normals, compact, center, scale):
+    data = np.asarray(data, dtype=np.float32).reshape(-1, stride)
+    positions, normals, texcoords = dequantize(compact, center, scale)
+    offset = 0
+    report = {'float_bytes': int(data.nbytes), 'compact_bytes': int(compact.nbytes)}
+    if has_texcoords:
+        report['texcoord_max_error'] = float(np.abs(texcoords - data[:, offset:offset + 2]).max(initial=0.0))
+        offset += 2
+    if has_normals:
+        reference = data[:, offset:offset + 3].astype(np.float64)
+        length = np.linalg.norm(reference, axis=1)
+        valid = length > 0
+        reference = reference[valid] / length[valid][:, np.newaxis]
+        decoded = normals[valid] / np.maximum(np.linalg.norm(normals[valid], axis=1), 1e-12)[:, np.newaxis]
+        cos = np.clip(np.einsum('ij,ij->i', reference, decoded), -1.0, 1.0)
+        report['normal_max_error_deg'] = float(np.degrees(np.arccos(cos)).max(initial=0.0))
+        offset += 3
+    report['position_max_error'] = float(np.abs(positions - data[:, offset:offset + 3]).max(initial=0.0))
+    return report
+
+
+def image_diff(reference, test):
+    # Visual difference between two RGB frames (uint8 arrays of equal shape).
+    # PSNR is None (null in the JSON report) when the frames are identical.
+    a = reference.astype(np.float64)
+    b = test.astype(np.float64)
+    diff = np.abs(a - b)
+    mse = float((diff ** 2).mean())
+    return {
+        'mean_abs_diff': float(diff.mean()),
+        'max_abs_diff': float(diff.max(initial=0.0)),
+        'pixels_over_8': float((diff.max(axis=-1) > 8).mean()),
+        'identical': mse == 0,
+        'psnr_db': None if mse == 0 else float(10.0 * np.log10(255.0 ** 2 / mse)),
+    }
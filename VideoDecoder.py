@@ -0,0 +1,449 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Background video decoding for ViewerMovieInVBO.
+# A producer thread reads frames with OpenCV into a bounded ring of
+# preallocated images. The render loop takes the oldest decoded frame when it
+# is due and gives the slot back once it has been uploaded, so decode hiccups
+# are absorbed by the ring instead of stalling the display.
+# When looping, a second capture waits at frame 0 so that restarting the
+# clip does not pay for a seek. Frames can be downscaled on the decoder
+# thread to a target size (the on-screen footprint of the video), and handed
+# out as planar YUV 4:2:0 instead of BGR for shader-side conversion.
+# A looping clip that fits in the frame cache budget is decoded once and
+# then served from memory. For fast playback only every stride-th frame is
+# decoded: the frames in between are grabbed (no conversion), or whole GOPs
+# are skipped by jumping from keyframe to keyframe.
+
+import os
+import time
+import threading
+import cv2
+import numpy as np
+from YUVFrame import open_native_yuv, bgr_to_yuv, resize_yuv, even_size
+from FrameCache import FrameCache
+
+
+# Above this fraction of a GOP per shown frame, only keyframes are decoded.
+keyframe_stride_ratio = 0.5
+
+
+class Frame:
+    def __init__(self, image):
+        self.raw = image
+        self.scaled = None
+        self.converted = None
+        self.image = image
+        self.index = -1
+        self.generation = 0
+        self.decode_time = 0.0
+        self.convert_time = 0.0
+
+
+class VideoDecoder(threading.Thread):
+    # Runs its own producer thread, or is driven by a DecoderPool when one is
+    # given (then start() is not called). With yuv=True frames are I420 or
+    # NV12 (self.layout): the decoder's own planes when the backend hands
+    # them out, otherwise converted from BGR on the decoder thread.
+    # cache_bytes > 0 enables the decoded-clip cache (looping only).
+    def __init__(self, path, capacity=8, loop=True, pool=None, yuv=False, cache_bytes=0, cache_compression='none'):
+        super().__init__(daemon=True)
+        self.path = path
+        self.loop = loop
+        self.pool = pool
+        self.layout = None
+        self.native = False
+        self.cap = None
+        if yuv:
+            self.cap, self.layout = open_native_yuv(path)
+            self.native = self.cap is not None
+            self.layout = self.layout or 'I420'
+        if self.cap is None:
+            self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise RuntimeError("Unable to open video file")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        ret, first = self.cap.read()
+        if not ret or first is None:
+            self.cap.release()
+            raise RuntimeError("Unable to read first frame")
+        self.height, self.width = first.shape[:2]
+        if self.native:
+            self.height = self.height * 2 // 3
+        elif self.layout is not None and (self.width % 2 or self.height % 2):
+            print(f"{os.path.basename(path)} : odd frame size, playing as BGR")
+            self.layout = None
+        self.spare = self.open_capture() if loop else None
+        self.spare_rewind = False
+        self.target_size = None
+        self.cache = FrameCache(cache_bytes, cache_compression) if loop and cache_bytes > 0 else None
+        self.cap_pos = 1
+        self.stride = 1
+        self.index = None
+        self.keyframe_only = False
+        if self.cache is not None:
+            self.cache.add(0, first)
+
+        self.slots = [Frame(np.empty_like(first)) for _ in range(max(2, capacity))]
+        self.slots[0].raw[...] = first
+        self.slots[0].image = self.convert(self.slots[0], self.slots[0].raw)
+        self.slots[0].index = 0
+        self.read_pos = 0
+        self.write_pos = 1
+        self.next_index = 1
+        self.generation = 0
+        self.seek_to = None
+        self.seek_keyframe = None
+        self.eof = False
+        self.lock = threading.Condition()
+        self.stopped = False
+        self.busy = False
+
+        self.decoded = 0
+        self.decode_time = 0.0
+        self.convert_time = 0.0
+        self.grabbed = 0
+        self.keyframe_jumps = 0
+        self.underruns = 0
+        self.acquired = 0
+        self.occupancy_sum = 0
+        self.max_occupancy = 1
+        self.full_waits = 0
+
+    @property
+    def capacity(self):
+        return len(self.slots)
+
+    def occupancy(self):
+        return self.write_pos - self.read_pos
+
+    def claim(self):
+        # Caller holds self.lock. Returns the next decode job, or None while
+        # the ring is full, at EOF or another worker is decoding this stream.
+        if self.stopped or self.busy:
+            return None
+        if self.seek_to is None and (self.eof or self.occupancy() >= self.capacity):
+            if not self.eof:
+                self.full_waits += 1
+            return None
+        seek_to, keyframe = self.seek_to, self.seek_keyframe
+        if seek_to is not None:
+            self.next_index = seek_to
+            self.seek_to = None
+            self.eof = False
+        self.busy = True
+        return self.slots[self.write_pos % self.capacity], self.generation, self.next_index, seek_to, keyframe
+
+    def decode(self, job):
+        # Seeks and decodes outside the lock into the claimed free slot.
+        slot, generation, index, seek_to, keyframe = job
+        if self.spare_rewind:
+            # Done after frame 0 of the new pass has been published.
+            self.spare.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self.spare_rewind = False
+        t0 = time.perf_counter()
+        if self.cache is not None and self.cache.complete:
+            index, ret, image = self.cached_frame(index)
+        else:
+            if seek_to is not None:
+                self.position(seek_to, keyframe)
+            elif index > self.cap_pos:
+                self.skip_to(index)
+            ret, image = self.cap.read(slot.raw)
+            self.cap_pos += 1
+            if ret and image is not None:
+                if self.cache is not None:
+                    self.cache.add(index, image)
+            elif self.loop:
+                if self.cache is not None and self.cache.finish(index):
+                    index, ret, image = self.cached_frame(0)
+                else:
+                    self.rewind()
+                    index = 0
+                    ret, image = self.cap.read(slot.raw)
+                    self.cap_pos = 1
+        t1 = time.perf_counter()
+        if ret and image is not None:
+            output = self.convert(slot, image)
+        t2 = time.perf_counter()
+
+        with self.lock:
+            self.busy = False
+            if not ret or image is None:
+                self.eof = True
+            else:
+                self.decoded += 1
+                self.decode_time += t1 - t0
+                self.convert_time += t2 - t1
+                if generation == self.generation:
+                    slot.raw = image
+                    slot.image = output
+                    slot.decode_time = t1 - t0
+                    slot.convert_time = t2 - t1
+                    slot.index = index
+                    slot.generation = generation
+                    self.next_index = self.advance(index)
+                    self.write_pos += 1
+                    self.max_occupancy = max(self.max_occupancy, self.occupancy())
+            self.lock.notify_all()
+        self.notify_pool()
+
+    def convert(self, slot, image):
+        # Decoder thread: the frame as handed out, scaled to target_size and
+        # converted to the output layout, reusing the slot's buffers.
+        target = self.target_size
+        if target is not None and target == (self.width, self.height):
+            target = None
+        if self.native:
+            if target is None:
+                return image
+            slot.scaled = resize_yuv(image, self.layout, self.width, self.height, target, slot.scaled)
+            return slot.scaled
+        if target is not None:
+            dst = slot.scaled if slot.scaled is not None and slot.scaled.shape[:2] == (target[1], target[0]) else None
+            slot.scaled = cv2.resize(image, target, dst=dst, interpolation=cv2.INTER_AREA)
+            image = slot.scaled
+        if self.layout is None:
+            return image
+        h, w = image.shape[:2]
+        dst = slot.converted if slot.converted is not None and slot.converted.shape == (h * 3 // 2, w) else None
+        slot.converted = bgr_to_yuv(image, self.layout, dst)
+        return slot.converted
+
+    def cached_frame(self, index):
+        # Decoder thread, complete cache: the captures are no longer needed.
+        if self.cap is not None:
+            self.close()
+            self.cap = self.spare = None
+            self.spare_rewind = False
+            print(f"{os.path.basename(self.path)} : {self.cache.summary()}")
+        if index >= self.cache.count:
+            index = 0
+        return index, True, self.cache.get(index)
+
+    def open_capture(self):
+        if self.native:
+            cap, _ = open_native_yuv(self.path)
+            if cap is not None:
+                return cap
+        return cv2.VideoCapture(self.path)
+
+    def run(self):
+        while True:
+            with self.lock:
+                job = self.claim()
+                while job is None and not self.stopped:
+                    self.lock.wait()
+                    job = self.claim()
+                if self.stopped:
+                    break
+            self.decode(job)
+        self.close()
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+        if self.spare is not None:
+            self.spare.release()
+
+    def notify_pool(self):
+        # Never called with self.lock held (the pool locks streams while
+        # holding its own condition).
+        if self.pool is not None:
+            self.pool.notify()
+
+    def position(self, frame_id, keyframe):
+        # Decoder thread. From a known keyframe, frames are grabbed (decoded
+        # without conversion) up to frame_id; a newer seek aborts the walk.
+        if keyframe is None or keyframe > frame_id:
+            keyframe = frame_id
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        self.cap_pos = keyframe
+        self.walk_to(frame_id)
+
+    def walk_to(self, frame_id):
+        while self.cap_pos < frame_id:
+            if self.seek_to is not None or self.stopped:
+                return
+            if not self.cap.grab():
+                return
+            self.cap_pos += 1
+            self.grabbed += 1
+
+    def skip_to(self, frame_id):
+        # Decoder thread, fast playback: moves the capture forward to
+        # frame_id, through the last keyframe before it when that saves
+        # grabbing frames.
+        if self.index is not None:
+            keyframe = self.index.keyframe_before(frame_id)
+            if keyframe is not None and keyframe > self.cap_pos + 1:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+                self.cap_pos = keyframe
+                self.keyframe_jumps += 1
+        self.walk_to(frame_id)
+
+    def advance(self, index):
+        # Caller holds self.lock. Next frame to decode after index.
+        if self.stride <= 1:
+            return index + 1
+        if self.keyframe_only:
+            keyframe = self.index.keyframe_after(index + self.stride)
+            if keyframe is not None:
+                return keyframe
+        return index + self.stride
+
+    def set_stride(self, stride, index=None):
+        # Only every stride-th frame will be shown (fast playback). With the
+        # keyframe index, strides of half a GOP or more decode keyframes only.
+        with self.lock:
+            self.stride = max(1, int(stride))
+            if index is not None and len(index.keyframes) > 0:
+                self.index = index
+            self.keyframe_only = (self.index is not None and self.stride > 1
+                                  and self.stride >= keyframe_stride_ratio * self.index.mean_gop())
+
+    def rewind(self):
+        # Decoder thread: continue from the spare capture already at frame 0.
+        if self.spare is None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            return
+        self.cap, self.spare = self.spare, self.cap
+        self.spare_rewind = True
+        self.cap_pos = 0
+
+    def acquire(self):
+        # Oldest decoded frame, or None (underrun). The frame stays valid
+        # until release() is called.
+        with self.lock:
+            occupancy = self.occupancy()
+            self.occupancy_sum += occupancy
+            self.acquired += 1
+            if occupancy == 0:
+                if not self.eof:
+                    self.underruns += 1
+                return None
+            return self.slots[self.read_pos % self.capacity]
+
+    def peek(self, offset=1):
+        # Frame `offset` positions after the oldest one, if already decoded.
+        with self.lock:
+            if self.occupancy() <= offset:
+                return None
+            return self.slots[(self.read_pos + offset) % self.capacity]
+
+    def release(self):
+        with self.lock:
+            if self.occupancy() > 0:
+                self.read_pos += 1
+                self.lock.notify_all()
+        self.notify_pool()
+
+    def set_target_size(self, size):
+        # (width, height) of the frames handed out from now on, None = native.
+        if size is not None and self.layout is not None:
+            size = even_size(size)
+        self.target_size = size
+
+    def seek(self, frame_id, keyframe=None):
+        # Drops the buffered frames; decoding restarts at frame_id, from
+        # keyframe if the caller knows the one preceding it.
+        with self.lock:
+            self.generation += 1
+            self.read_pos = self.write_pos
+            self.seek_to = max(0, int(frame_id))
+            self.seek_keyframe = keyframe
+            self.lock.notify_all()
+        self.notify_pool()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+        if self.is_alive():
+            self.join()
+        elif self.pool is None:
+            self.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'capacity': self.capacity,
+                'occupancy': self.occupancy(),
+                'mean_occupancy': self.occupancy_sum / max(1, self.acquired),
+                'max_occupancy': self.max_occupancy,
+                'underruns': self.underruns,
+                'decoded': self.decoded,
+                'decode_ms': 1000.0 * self.decode_time / max(1, self.decoded),
+                'convert_ms': 1000.0 * self.convert_time / max(1, self.decoded),
+                'full_waits': self.full_waits,
+                'stride': self.stride,
+                'grabbed': self.grabbed,
+                'keyframe_jumps': self.keyframe_jumps,
+            }
+
+    def summary(self):
+        s = self.stats()
+        if self.layout is None:
+            output = "BGR"
+        else:
+            output = f"{self.layout} ({'native' if self.native else 'converted'})"
+        return (f"Decoder ring : {s['capacity']} {output} frames, mean occupancy {s['mean_occupancy']:.1f}, "
+                f"max {s['max_occupancy']}, underruns {s['underruns']}, "
+                f"decoded {s['decoded']} frames at {s['decode_ms']:.1f} ms/frame + {s['convert_ms']:.1f} ms convert, "
+                f"grabbed {s['grabbed']}, keyframe jumps {s['keyframe_jumps']}"
+                + (f"\n{self.cache.summary()}" if self.cache is not None else ""))
+
+
+class DecoderPool:
+    # Worker threads shared by several VideoDecoders (video wall). Each free
+    # worker decodes one frame for the stream whose ring is the emptiest.
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.decoders = []
+        self.threads = []
+        self.work = threading.Condition()
+        self.stopped = False
+
+    def add(self, path, capacity=8, loop=True, yuv=False, cache_bytes=0, cache_compression='none'):
+        decoder = VideoDecoder(path, capacity, loop, self, yuv, cache_bytes, cache_compression)
+        self.decoders.append(decoder)
+        return decoder
+
+    def start(self):
+        for _ in range(min(self.workers, len(self.decoders))):
+            thread = threading.Thread(target=self.worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def claim(self):
+        for decoder in sorted(self.decoders, key=lambda d: d.occupancy() / d.capacity):
+            with decoder.lock:
+                job = decoder.claim()
+            if job is not None:
+                return decoder, job
+        return None
+
+    def worker(self):
+        while True:
+            with self.work:
+                job = self.claim()
+                while job is None and not self.stopped:
+                    self.work.wait(0.05)
+                    job = self.claim()
+                if self.stopped:
+                    return
+            decoder, job = job
+            decoder.decode(job)
+
+    def notify(self):
+        with self.work:
+            self.work.notify()
+
+    def stop(self):
+        with self.work:
+            self.stopped = True
+            self.work.notify_all()
+        for thread in self.threads:
+            thread.join()
+        for decoder in self.decoders:
+            decoder.close()
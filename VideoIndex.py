@@ -0,0 +1,169 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Keyframe index and thumbnail strip for ViewerMovieInVBO.
+# A one-time scan records which frames are keyframes (from the demuxed
+# packets, without decoding), the timestamp of every frame and a strip of
+# low resolution thumbnails. The index is cached next to the video so that a
+# seek can show the nearest thumbnail at once and decode from the right
+# keyframe in the background.
+
+import os
+import json
+import time
+import threading
+import cv2
+import numpy as np
+
+index_version = 2
+thumbnail_width = 160
+max_thumbnails = 200
+
+
+class VideoIndex:
+    def __init__(self, fps, frame_count, keyframes, timestamps, thumbnail_frames, thumbnails):
+        self.fps = fps
+        self.frame_count = frame_count
+        self.keyframes = keyframes
+        self.timestamps = timestamps
+        self.thumbnail_frames = thumbnail_frames
+        self.thumbnails = thumbnails
+
+    def keyframe_before(self, frame_id):
+        # Last keyframe at or before frame_id, None if unknown.
+        if len(self.keyframes) == 0:
+            return None
+        i = int(np.searchsorted(self.keyframes, frame_id, side='right')) - 1
+        return int(self.keyframes[max(0, i)])
+
+    def keyframe_after(self, frame_id):
+        # First keyframe at or after frame_id, None if there is none.
+        i = int(np.searchsorted(self.keyframes, frame_id, side='left'))
+        return int(self.keyframes[i]) if i < len(self.keyframes) else None
+
+    def mean_gop(self):
+        # Mean number of frames between keyframes.
+        return self.frame_count / max(1, len(self.keyframes))
+
+    def nearest_thumbnail(self, frame_id):
+        if len(self.thumbnail_frames) == 0:
+            return None
+        i = int(np.argmin(np.abs(self.thumbnail_frames - frame_id)))
+        return self.thumbnails[i]
+
+    def timestamp(self, frame_id):
+        if 0 <= frame_id < len(self.timestamps):
+            return float(self.timestamps[frame_id])
+        return 1000.0 * frame_id / self.fps
+
+
+def index_path(video_path):
+    return video_path + ".index.npz"
+
+
+def scan_keyframes(video_path):
+    # Reads packets without decoding them (FFmpeg backend, raw stream mode).
+    if not hasattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME'):
+        return np.zeros(0, dtype=np.int64)
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    keyframes = []
+    if cap.isOpened():
+        i = 0
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) > 0:
+                keyframes.append(i)
+            i += 1
+    cap.release()
+    return np.array(keyframes, dtype=np.int64)
+
+
+def scan(video_path):
+    t0 = time.perf_counter()
+    keyframes = scan_keyframes(video_path)
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError("Unable to open video file")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    expected = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    step = max(1, -(-expected // max_thumbnails))
+    timestamps = []
+    thumbnail_frames = []
+    thumbnails = []
+    i = 0
+    while cap.grab():
+        timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+        if i % step == 0:
+            ret, frame = cap.retrieve()
+            if ret:
+                h, w = frame.shape[:2]
+                size = (thumbnail_width, max(1, round(h * thumbnail_width / w)))
+                thumbnails.append(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+                thumbnail_frames.append(i)
+        i += 1
+    cap.release()
+    if thumbnails:
+        thumbnails = np.stack(thumbnails)
+    else:
+        thumbnails = np.zeros((0, 1, thumbnail_width, 3), dtype=np.uint8)
+    print(f"Video index built in {time.perf_counter() - t0:.1f} s : {i} frames, "
+          f"{len(keyframes)} keyframes, {len(thumbnail_frames)} thumbnails")
+    return VideoIndex(fps, i, keyframes, np.array(timestamps, dtype=np.float64),
+                      np.array(thumbnail_frames, dtype=np.int64), thumbnails)
+
+
+def load(video_path):
+    path = index_path(video_path)
+    if not os.path.exists(path):
+        return None
+    st = os.stat(video_path)
+    try:
+        with np.load(path) as cache:
+            meta = json.loads(str(cache['meta']))
+            if (meta['version'] != index_version or meta['mtime'] != st.st_mtime
+                    or meta['size'] != st.st_size or meta['thumbnail_width'] != thumbnail_width):
+                return None
+            return VideoIndex(meta['fps'], meta['frame_count'], cache['keyframes'], cache['timestamps'],
+                              cache['thumbnail_frames'], cache['thumbnails'])
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Ignoring video index {path}: {e}")
+        return None
+
+
+def save(video_path, index):
+    st = os.stat(video_path)
+    meta = {
+        'version': index_version,
+        'mtime': st.st_mtime,
+        'size': st.st_size,
+        'thumbnail_width': thumbnail_width,
+        'fps': index.fps,
+        'frame_count': index.frame_count,
+    }
+    try:
+        np.savez(index_path(video_path), meta=np.array(json.dumps(meta)), keyframes=index.keyframes,
+                 timestamps=index.timestamps, thumbnail_frames=index.thumbnail_frames,
+                 thumbnails=index.thumbnails)
+    except OSError as e:
+        print(f"Unable to write video index {index_path(video_path)}: {e}")
+
+
+def load_or_build(video_path):
+    index = load(video_path)
+    if index is None:
+        index = scan(video_path)
+        save(video_path, index)
+    return index
+
+
+class IndexBuilder(threading.Thread):
+    # Builds (or loads) the index without holding up playback; .index is
+    # set once it is ready.
+    def __init__(self, video_path):
+        super().__init__(daemon=True)
+        self.video_path = video_path
+        self.index = None
+
+    def run(self):
+        try:
+            self.index = load_or_build(self.video_path)
+        except RuntimeError as e:
+            print(f"Video index unavailable: {e}")
@@ -0,0 +1,207 @@
+# Author(s): Dr. Patrick Lemoine
+
+# One playing video for ViewerMovieInVBO: decoder ring, presentation clock,
+# streaming texture and keyframe index, paced independently of the other
+# streams of a video wall. Frames are decoded at the power of two level
+# that matches the on-screen size of the quad, so a video seen small is not
+# uploaded at full resolution. With yuv=True frames are uploaded as planar
+# YUV 4:2:0 and converted to RGB by a fragment shader.
+
+import os
+import sys
+import time
+import math
+import cv2
+import numpy as np
+import OpenGL.GL as gl
+from VideoDecoder import VideoDecoder
+from PresentationClock import PresentationClock, spin_margin
+from TextureStream import TextureStream
+from YUVTexture import YUVTextureStream
+from YUVFrame import bgr_to_yuv, even_size
+import VideoIndex
+
+skip_seconds = 0.5
+# A coarser level is only taken once the footprint is 20% below it, so a
+# quad hovering at a level boundary does not reallocate back and forth.
+level_hysteresis = 0.8
+min_level_size = 64
+
+
+class VideoStream:
+    def __init__(self, path, buffer_frames=8, upload_buffers=3, pool=None, index=True, adaptive=True, yuv=False,
+                 cache_bytes=0, cache_compression='none'):
+        self.path = path
+        self.name = os.path.basename(path)
+        if pool is not None:
+            self.decoder = pool.add(path, buffer_frames, True, yuv, cache_bytes, cache_compression)
+        else:
+            self.decoder = VideoDecoder(path, buffer_frames, True, None, yuv, cache_bytes, cache_compression)
+        self.width = self.decoder.width
+        self.height = self.decoder.height
+        self.fps_ori = self.decoder.fps
+        self.clock = PresentationClock(self.decoder.fps)
+        self.layout = self.decoder.layout
+        if self.layout is not None:
+            self.texture = YUVTextureStream(self.width, self.height, self.layout, upload_buffers)
+        else:
+            self.texture = TextureStream(self.width, self.height, gl.GL_BGR, upload_buffers)
+        self.index_builder = VideoIndex.IndexBuilder(path) if index else None
+        self.last_presented = -1
+        self.next_time = time.perf_counter()
+        self.paused = False
+        self.quad = None
+        self.adaptive = adaptive
+        self.level = 0
+        self.level_changes = 0
+        self.telemetry = None
+        self.display_fps = 60.0
+
+    def start(self):
+        if self.decoder.pool is None:
+            self.decoder.start()
+        if self.index_builder is not None:
+            self.index_builder.start()
+        self.clock.start(0)
+        self.next_time = time.perf_counter()
+
+    @property
+    def index(self):
+        return self.index_builder.index if self.index_builder is not None else None
+
+    def set_paused(self, paused):
+        self.paused = paused
+        if paused:
+            self.clock.pause()
+        else:
+            self.clock.resume()
+
+    def set_fps(self, fps):
+        # Above the display rate, frames that cannot be shown are not
+        # decoded (see VideoDecoder.set_stride).
+        self.clock.set_fps(fps)
+        stride = int(fps / self.display_fps) if self.display_fps > 0 else 1
+        self.decoder.set_stride(stride, self.index)
+
+    def seek(self, frame_id, show_thumbnail=True):
+        # Shows the nearest thumbnail at once; the exact frame follows from
+        # the decoder, starting at the preceding keyframe when it is known.
+        index = self.index
+        keyframe = index.keyframe_before(frame_id) if index is not None else None
+        self.decoder.seek(frame_id, keyframe)
+        if index is not None and show_thumbnail:
+            thumbnail = index.nearest_thumbnail(frame_id)
+            if thumbnail is not None:
+                image = cv2.resize(thumbnail, self.level_size(self.level), interpolation=cv2.INTER_LINEAR)
+                self.texture.upload(image if self.layout is None else bgr_to_yuv(image, self.layout))
+        # The clock restarts when the first exact frame arrives.
+        self.last_presented = sys.maxsize
+        self.clock.start(frame_id)
+        self.set_paused(False)
+        self.next_time = time.perf_counter()
+
+    def level_size(self, level):
+        size = max(1, round(self.width / 2 ** level)), max(1, round(self.height / 2 ** level))
+        return size if self.layout is None else even_size(size)
+
+    def footprint(self, modelview, projection, viewport):
+        # On-screen size in pixels of the quad drawn with these matrices
+        # (longest top/bottom and left/right edges), None if it crosses the
+        # camera plane.
+        max_dim = max(self.width, self.height)
+        w, h = self.width / max_dim / 2, self.height / max_dim / 2
+        corners = np.array([[-w, -h, 0, 1], [w, -h, 0, 1], [w, h, 0, 1], [-w, h, 0, 1]], dtype=np.float64)
+        clip = corners @ np.asarray(modelview, dtype=np.float64).reshape(4, 4) \
+            @ np.asarray(projection, dtype=np.float64).reshape(4, 4)
+        if np.any(clip[:, 3] <= 1e-6):
+            return None
+        screen = (clip[:, :2] / clip[:, 3:4] + 1.0) / 2.0 * np.array([viewport[2], viewport[3]], dtype=np.float64)
+        edges = np.linalg.norm(screen - np.roll(screen, -1, axis=0), axis=1)
+        return max(edges[0], edges[2]), max(edges[1], edges[3])
+
+    def update_footprint(self, modelview, projection, viewport):
+        # Picks the decode level for the current view. Going finer is
+        # immediate; going coarser waits for the hysteresis margin.
+        if not self.adaptive:
+            return
+        size = self.footprint(modelview, projection, viewport)
+        need = 1.0 if size is None else min(1.0, max(size[0] / self.width, size[1] / self.height))
+        max_level = max(0, int(math.log2(max(1, min(self.width, self.height) / min_level_size))))
+        level = self.level
+        if need > 2.0 ** -level:
+            level = int(math.floor(-math.log2(max(need, 1e-9))))
+        elif need / level_hysteresis <= 2.0 ** -(level + 1):
+            level = int(math.floor(-math.log2(max(need / level_hysteresis, 1e-9))))
+        level = min(max(0, level), max_level)
+        if level != self.level:
+            self.level = level
+            self.level_changes += 1
+            self.decoder.set_target_size(self.level_size(level) if level > 0 else None)
+
+    def due(self, now):
+        return not self.paused and now >= self.next_time - spin_margin
+
+    def present_due_frame(self, now):
+        # Uploads the frame due on the presentation clock, dropping decoded
+        # frames that are already superseded. Returns True if a new frame was
+        # uploaded; next_time is when to come back.
+        decoder, clock = self.decoder, self.clock
+        frame = decoder.acquire()
+        if frame is None:
+            self.next_time = now + spin_margin
+            return False
+        if frame.index <= self.last_presented:
+            # Looped back to the start or first frame after a seek: restart the clock.
+            clock.start(frame.index, now)
+        due = clock.due_index(now)
+        if due - frame.index > skip_seconds * clock.fps and due < decoder.frame_count:
+            # Too far behind to catch up by dropping: jump to the due frame.
+            self.seek(due, False)
+            clock.skips += 1
+            if self.telemetry is not None:
+                self.telemetry.skip(self.name, due)
+            self.next_time = now + spin_margin
+            return False
+        while clock.time_of(frame.index) <= now:
+            following = decoder.peek(1)
+            if following is None or following.index <= frame.index or clock.time_of(following.index) > now:
+                break
+            decoder.release()
+            clock.dropped += 1
+            if self.telemetry is not None:
+                self.telemetry.drop(self.name, frame.index)
+            frame = decoder.acquire()
+        t = clock.time_of(frame.index)
+        if t > now + spin_margin:
+            self.next_time = t
+            return False
+        clock.sleep_until(t)
+        t0 = time.perf_counter()
+        self.texture.upload(frame.image)
+        upload_time = time.perf_counter() - t0
+        index, decode_time, convert_time = frame.index, frame.decode_time, frame.convert_time
+        decoder.release()
+        self.last_presented = index
+        late = clock.presented_frame(index, time.perf_counter())
+        if self.telemetry is not None:
+            self.telemetry.present(self.name, index, 1000.0 * decode_time, 1000.0 * convert_time,
+                                   1000.0 * upload_time, 1000.0 * late)
+        self.next_time = clock.time_of(index + 1)
+        return True
+
+    def stop(self):
+        self.decoder.stop()
+
+    def release(self):
+        # The quad is shared (GLResources.quad) and released by the viewer.
+        self.texture.release()
+        self.quad = None
+
+    def summary(self, elapsed):
+        c = self.clock.stats()
+        d = self.decoder.stats()
+        u = self.texture.stats()
+        return (f"{self.name} : {c['presented'] / max(elapsed, 1e-9):.1f} fps presented, "
+                f"dropped {c['dropped']}, skips {c['skips']}, underruns {d['underruns']}, "
+                f"decode {d['decode_ms']:.1f} ms, upload {u['upload_ms']:.2f} ms, stride {d['stride']}, "
+                f"level {self.level} ({self.texture.width}x{self.texture.height}), {self.level_changes} level changes")
@@ -1,11 +1,19 @@
 # Author(s): Dr. Patrick Lemoine with play movie
 
-import cv2
-import numpy as np
+import os
 import OpenGL.GL as gl
 import glfw
 import math
+import time
 from OpenGL.GLU import gluPerspective, gluLookAt, gluProject
+from RenderScheduler import RenderScheduler
+from VideoDecoder import DecoderPool
+from PresentationClock import spin_margin
+from VideoPlayback import VideoStream
+from YUVTexture import release_programs
+from PlaybackTelemetry import PlaybackTelemetry, TelemetryOverlay
+from FrameCache import cache_compressions
+import GLResources
 
 yaw, pitch = 0.0, 0.0
 last_x, last_y = None, None
@@ -14,42 +22,30 @@ distance = 3.0
 vbo_vertices = None
 vbo_texcoords = None
 paused = False
-cap = None
-texture_id = None
-fps = 30
-fps_ori = 30
+streams = []
+pool = None
 obj_pos_x, obj_pos_y, obj_pos_z = 0.0, 0.0, 0.0
 obj_rot_angle_x, obj_rot_angle_y, obj_rot_angle_z = 0.0, 0.0, 0.0
 obj_scale_x, obj_scale_y, obj_scale_z = 1.0, 1.0, 1.0
-frame_width = None
-frame_height = None
+scheduler = None
+video_extensions = ('.mp4', '.avi', '.mkv', '.mov', '.webm', '.m4v', '.mpg', '.wmv')
+wall_spacing = 1.05
+telemetry = None
+overlay = None
+show_telemetry = False
+overlay_interval = 0.5
+
+def create_quad_vbo(width, height):
+    return GLResources.quad(width, height)[0]
 
 def create_vbos(width, height):
+    # Shared per aspect ratio: calling this again allocates nothing.
     global vbo_vertices, vbo_texcoords
-    vertices = np.array([
-        [-width / 2, -height / 2, 0.0],
-        [width / 2, -height / 2, 0.0],
-        [width / 2, height / 2, 0.0],
-        [-width / 2, height / 2, 0.0]
-    ], dtype=np.float32)
-    texcoords = np.array([
-        [0.0, 1.0],
-        [1.0, 1.0],
-        [1.0, 0.0],
-        [0.0, 0.0]
-    ], dtype=np.float32)
-    vbo_vertices = gl.glGenBuffers(1)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vbo_vertices)
-    gl.glBufferData(gl.GL_ARRAY_BUFFER, vertices.nbytes, vertices, gl.GL_STATIC_DRAW)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
-    vbo_texcoords = gl.glGenBuffers(1)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vbo_texcoords)
-    gl.glBufferData(gl.GL_ARRAY_BUFFER, texcoords.nbytes, texcoords, gl.GL_STATIC_DRAW)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+    vbo_vertices, vbo_texcoords = GLResources.quad(width, height)
 
-def draw_quad():
+def draw_quad(vertices=None):
     gl.glEnableClientState(gl.GL_VERTEX_ARRAY)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vbo_vertices)
+    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vertices if vertices is not None else vbo_vertices)
     gl.glVertexPointer(3, gl.GL_FLOAT, 0, None)
     gl.glEnableClientState(gl.GL_TEXTURE_COORD_ARRAY)
     gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vbo_texcoords)
@@ -61,7 +57,7 @@ def draw_quad():
 
 
 def mouse_button_callback(window, button, action, mods):
-    global left_button_pressed, last_x, last_y, cap, paused
+    global left_button_pressed, last_x, last_y, paused
     if button == glfw.MOUSE_BUTTON_LEFT:
         if action == glfw.PRESS:
             left_button_pressed = True
@@ -69,15 +65,17 @@ def mouse_button_callback(window, button, action, mods):
             result = check_video_click(window, last_x, last_y)
             if result is not None:
                 video_x, video_y = result
-                frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+                stream = streams[0]
+                frame_count = stream.decoder.frame_count
+                width = stream.width
                 if frame_count > 0 and width > 0:
                     frame_id = int((video_x / width) * (frame_count - 1))
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_id)
+                    stream.seek(frame_id)
                     paused = False 
                     #print(f"Clic movie : coord=({int(video_x)}, {int(video_y)}) -- Go to frame {frame_id+1}/{frame_count}")
         elif action == glfw.RELEASE:
             left_button_pressed = False
+        scheduler.request_redraw()
 
 def cursor_pos_callback(window, xpos, ypos):
     global yaw, pitch, last_x, last_y
@@ -88,22 +86,27 @@ def cursor_pos_callback(window, xpos, ypos):
         yaw -= xoffset * sensitivity
         pitch += yoffset * sensitivity
         pitch = max(-80, min(80, pitch))
+        scheduler.request_redraw()
     last_x, last_y = xpos, ypos
 
 def scroll_callback(window, xoffset, yoffset):
     global distance
     distance -= yoffset * 0.1
     distance = max(0.1, min(10.0, distance))
+    scheduler.request_redraw()
 
 def key_callback(window, key, scancode, action, mods):
-    global paused, yaw, pitch
+    global paused, yaw, pitch, show_telemetry
     global obj_pos_x, obj_pos_y, obj_pos_z
-    global fps
 
     if key == glfw.KEY_ESCAPE and action == glfw.PRESS:
         glfw.set_window_should_close(window, True)
     elif key == glfw.KEY_SPACE and action == glfw.PRESS:
         paused = not paused
+        for stream in streams:
+            stream.set_paused(paused)
+    elif key == glfw.KEY_T and action == glfw.PRESS and telemetry is not None:
+        show_telemetry = not show_telemetry
     if action == glfw.PRESS or action == glfw.REPEAT:
         delta_pos = 0.01
         delta_fps = 1
@@ -116,12 +119,18 @@ def key_callback(window, key, scancode, action, mods):
         elif key == glfw.KEY_KP_2:
             obj_pos_y -= delta_pos
         elif key == glfw.KEY_KP_9:
-            fps += delta_fps*10.0
+            for stream in streams:
+                stream.set_fps(stream.clock.fps + delta_fps*10.0)
         elif key == glfw.KEY_KP_7:
-            fps -= delta_fps
-            fps = max(1.0,fps)
+            for stream in streams:
+                stream.set_fps(max(1.0, stream.clock.fps - delta_fps))
         elif key == glfw.KEY_KP_0:
-            fps = fps_ori
+            for stream in streams:
+                stream.set_fps(stream.fps_ori)
+    scheduler.request_redraw()
+
+def refresh_callback(window, *args):
+    scheduler.request_redraw()
 
 def setup_projection(window_width, window_height):
     gl.glMatrixMode(gl.GL_PROJECTION)
@@ -143,19 +152,11 @@ def setup_spotlight():
     gl.glLightfv(gl.GL_LIGHT0, gl.GL_DIFFUSE, [1.0, 1.0, 1.0, 1.0])
     gl.glLightfv(gl.GL_LIGHT0, gl.GL_SPECULAR, [1.0, 1.0, 1.0, 1.0])
 
-def update_texture(frame):
-    global texture_id
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    h, w, _ = frame_rgb.shape
-    gl.glBindTexture(gl.GL_TEXTURE_2D, texture_id)
-    gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, 0, 0, w, h, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, frame_rgb)
-    gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
-
 def check_video_click(window, mouse_x, mouse_y):
-    global frame_width, frame_height
-
-    if frame_width is None or frame_height is None:
+    # Single video only: the wall has no click-to-seek.
+    if len(streams) != 1:
         return None
+    frame_width, frame_height = streams[0].width, streams[0].height
 
     quad_width = frame_width / max(frame_width, frame_height)
     quad_height = frame_height / max(frame_width, frame_height)
@@ -194,9 +195,27 @@ def check_video_click(window, mouse_x, mouse_y):
         return (video_x, video_y)
     return None
 
-def main(video_path, enable_spotlight=False, enable_fullscreen=False):
-    global paused, cap, texture_id, vbo_vertices, vbo_texcoords, distance
-    global fps, fps_ori, frame_width, frame_height
+def wall_layout(count):
+    cols = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / cols)
+    positions = []
+    for i in range(count):
+        row, col = divmod(i, cols)
+        positions.append(((col - (cols - 1) / 2) * wall_spacing, ((rows - 1) / 2 - row) * wall_spacing))
+    return positions, max(cols, rows)
+
+def find_videos(folder):
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if name.lower().endswith(video_extensions))
+
+def main(video_paths, enable_spotlight=False, enable_fullscreen=False, max_fps=60.0, buffer_frames=8, upload_buffers=3, workers=0, adaptive_upload=True, yuv=False,
+         enable_telemetry=False, trace_path='', cache_mb=0, cache_compression='none'):
+    # One path plays a single video; several paths play them as a video
+    # wall decoded by a shared worker pool.
+    global paused, streams, pool, vbo_vertices, vbo_texcoords, distance
+    global scheduler, telemetry, overlay, show_telemetry
+
+    scheduler = RenderScheduler(max_fps)
 
     if not glfw.init():
         raise RuntimeError("Failed to initialize GLFW")
@@ -212,33 +231,32 @@ def main(video_path, enable_spotlight=False, enable_fullscreen=False):
     glfw.set_cursor_pos_callback(window, cursor_pos_callback)
     glfw.set_scroll_callback(window, scroll_callback)
     glfw.set_key_callback(window, key_callback)
-
-    cap = cv2.VideoCapture(video_path)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    fps_ori = cap.get(cv2.CAP_PROP_FPS)
-    if not cap.isOpened():
-        glfw.terminate()
-        raise RuntimeError("Unable to open video file")
-
-    ret, frame = cap.read()
-    if not ret or frame is None:
+    glfw.set_window_refresh_callback(window, refresh_callback)
+    glfw.set_framebuffer_size_callback(window, refresh_callback)
+
+    wall = len(video_paths) > 1
+    if wall:
+        pool = DecoderPool(workers or None)
+    try:
+        for path in video_paths:
+            streams.append(VideoStream(path, buffer_frames, upload_buffers, pool, not wall, adaptive_upload, yuv,
+                                       int(cache_mb * 2 ** 20), cache_compression))
+    except RuntimeError:
         glfw.terminate()
-        raise RuntimeError("Unable to read first frame")
-    frame_height, frame_width = frame.shape[:2]
-
-    texture_id = gl.glGenTextures(1)
-    gl.glBindTexture(gl.GL_TEXTURE_2D, texture_id)
-    gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB, frame_width, frame_height, 0, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, None)
-    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
-    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
-    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
-    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
-    gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
-
-    max_dim = max(frame_width, frame_height)
-    width_norm = frame_width / max_dim
-    height_norm = frame_height / max_dim
-    create_vbos(width_norm, height_norm)
+        raise
+
+    positions, grid = wall_layout(len(streams))
+    for i, stream in enumerate(streams):
+        max_dim = max(stream.width, stream.height)
+        width_norm = stream.width / max_dim
+        height_norm = stream.height / max_dim
+        if i == 0:
+            create_vbos(width_norm, height_norm)
+            stream.quad = vbo_vertices
+        else:
+            stream.quad = create_quad_vbo(width_norm, height_norm)
+    if wall:
+        distance = min(10.0, 1.2 * grid + 0.5)
     gl.glEnable(gl.GL_TEXTURE_2D)
     gl.glEnable(gl.GL_DEPTH_TEST)
     gl.glDepthFunc(gl.GL_LEQUAL)
@@ -249,17 +267,36 @@ def main(video_path, enable_spotlight=False, enable_fullscreen=False):
         gl.glDisable(gl.GL_LIGHTING)
         gl.glDisable(gl.GL_LIGHT0)
 
+    for stream in streams:
+        stream.display_fps = max_fps
+    if enable_telemetry or trace_path:
+        telemetry = PlaybackTelemetry()
+        overlay = TelemetryOverlay()
+        show_telemetry = bool(enable_telemetry)
+        for stream in streams:
+            stream.telemetry = telemetry
+    overlay_time = 0.0
+
+    for stream in streams:
+        stream.start()
+    if pool is not None:
+        pool.start()
+    t_start = time.perf_counter()
+    leak_check = GLResources.LeakCheck()
     while not glfw.window_should_close(window):
-        glfw.poll_events()
         if not paused:
-            ret, frame = cap.read()
-            cv2.waitKey(int(1000.0/fps))
-            if not ret or frame is None:
-                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                ret, frame = cap.read()
-            if ret and frame is not None:
-                frame_height, frame_width = frame.shape[:2]
-                update_texture(frame)
+            scheduler.schedule_at(min(stream.next_time for stream in streams) - spin_margin)
+        scheduler.wait_events(glfw)
+        now = time.perf_counter()
+        for stream in streams:
+            if stream.due(now) and stream.present_due_frame(now):
+                scheduler.request_redraw()
+        if show_telemetry and now >= overlay_time + overlay_interval:
+            scheduler.request_redraw()
+        if not scheduler.frame_due():
+            continue
+        scheduler.begin_frame()
+        t_draw = time.perf_counter()
         gl.glViewport(0, 0, window_w, window_h)
         gl.glClearColor(0.1, 0.1, 0.1, 1.0)
         gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
@@ -276,15 +313,55 @@ def main(video_path, enable_spotlight=False, enable_fullscreen=False):
         gl.glRotatef(obj_rot_angle_z, 0, 0, 1)
         gl.glScalef(obj_scale_x, obj_scale_y, obj_scale_z)
 
-        gl.glBindTexture(gl.GL_TEXTURE_2D, texture_id)
-        draw_quad()
-        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        for stream, (x, y) in zip(streams, positions):
+            gl.glPushMatrix()
+            gl.glTranslatef(x, y, 0.0)
+            if adaptive_upload:
+                stream.update_footprint(gl.glGetDoublev(gl.GL_MODELVIEW_MATRIX), gl.glGetDoublev(gl.GL_PROJECTION_MATRIX),
+                                        (0, 0, window_w, window_h))
+            stream.texture.bind()
+            draw_quad(stream.quad)
+            stream.texture.unbind()
+            gl.glPopMatrix()
+        if show_telemetry:
+            if now >= overlay_time + overlay_interval:
+                overlay.update(telemetry.summary_lines())
+                overlay_time = now
+            overlay.draw(window_w, window_h)
+        t_swap = time.perf_counter()
         glfw.swap_buffers(window)
-
-    cap.release()
-    gl.glDeleteBuffers(1, [vbo_vertices])
-    gl.glDeleteBuffers(1, [vbo_texcoords])
-    gl.glDeleteTextures([texture_id])
+        if telemetry is not None:
+            t_end = time.perf_counter()
+            telemetry.render(1000.0 * (t_swap - t_draw), 1000.0 * (t_end - t_swap))
+        scheduler.end_frame()
+        leak_check.frame()
+
+    elapsed = time.perf_counter() - t_start
+    print(scheduler.summary())
+    if wall:
+        for stream in streams:
+            print(stream.summary(elapsed))
+        presented = sum(stream.clock.presented for stream in streams)
+        dropped = sum(stream.clock.dropped for stream in streams)
+        print(f"Video wall : {len(streams)} streams, {pool.workers} decoder workers, "
+              f"{presented / max(elapsed, 1e-9):.1f} frames/s presented in total, dropped {dropped}")
+        pool.stop()
+    else:
+        print(streams[0].summary(elapsed))
+        print(streams[0].decoder.summary())
+        print(streams[0].clock.summary())
+        print(streams[0].texture.summary())
+    if telemetry is not None:
+        print(telemetry.summary())
+        if trace_path:
+            telemetry.write(trace_path)
+        overlay.release()
+    for stream in streams:
+        stream.stop()
+        stream.release()
+    release_programs()
+    GLResources.release_quads()
+    print(GLResources.summary())
     glfw.terminate()
 
 if __name__ == "__main__":
@@ -294,5 +371,27 @@ if __name__ == "__main__":
     parser.add_argument('--Name', type=str, default='video.mp4', help='Video file name')
     parser.add_argument('--Spotlight', type=int, default=0, help='Enable spotlight effect (1 or 0)')
     parser.add_argument('--Fullscreen', type=int, default=0, help='Enable fullscreen mode (1 or 0)')
+    parser.add_argument('--MaxFPS', type=float, default=60.0, help='Display frame rate cap (redraws only on input or new frames)')
+    parser.add_argument('--BufferFrames', type=int, default=8, help='Decoded frames buffered ahead by the decoder thread')
+    parser.add_argument('--UploadBuffers', type=int, default=3, help='Pixel buffer objects in the texture upload ring (2 or 3)')
+    parser.add_argument('--Wall', type=int, default=0, help='Video wall: play several videos in one window (1 or 0)')
+    parser.add_argument('--Names', type=str, default='', help='Video wall file names, comma separated (default: all videos in --Path)')
+    parser.add_argument('--Workers', type=int, default=0, help='Video wall decoder threads (0 = number of cores)')
+    parser.add_argument('--YUV', type=int, default=0, help='Upload frames as planar YUV 4:2:0 and convert them in a shader (1 or 0)')
+    parser.add_argument('--Telemetry', type=int, default=0, help='Show per-frame timing statistics on screen, T toggles (1 or 0)')
+    parser.add_argument('--Trace', type=str, default='', help='Write the per-frame timing trace on exit (.csv or .json)')
+    parser.add_argument('--CacheMB', type=float, default=0, help='Per video RAM budget to loop short clips from memory (0 = off)')
+    parser.add_argument('--CacheCompress', type=str, default='none', choices=cache_compressions, help='Cached frame compression: none, zlib (lossless) or jpeg')
+    parser.add_argument('--AdaptiveUpload', type=int, default=1, help='Decode and upload frames at the on-screen size of the video (1 or 0)')
     args = parser.parse_args()
-    main(args.Path + "/" + args.Name, args.Spotlight, args.Fullscreen)
+    if args.Wall:
+        if args.Names:
+            video_paths = [args.Path + "/" + name.strip() for name in args.Names.split(',') if name.strip()]
+        else:
+            video_paths = find_videos(args.Path)
+        if not video_paths:
+            raise SystemExit(f"No video found in {args.Path}")
+    else:
+        video_paths = [args.Path + "/" + args.Name]
+    main(video_paths, args.Spotlight, args.Fullscreen, args.MaxFPS, args.BufferFrames, args.UploadBuffers, args.Workers, args.AdaptiveUpload, args.YUV,
+         args.Telemetry, args.Trace, args.CacheMB, args.CacheCompress)
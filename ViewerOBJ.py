@@ -2,15 +2,37 @@
 
 import sys
 import os
+import time
+import json
+import ctypes
+import queue
 import numpy as np
+
+# The benchmark renders offscreen on Mesa's software rasterizer through a
+# surfaceless EGL display, which has to be selected before PyOpenGL is imported.
+if __name__ == "__main__":
+    import argparse
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument('--Benchmark', type=int, default=0)
+    pre_args, _ = pre_parser.parse_known_args()
+    if pre_args.Benchmark:
+        os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+        os.environ.setdefault("LIBGL_ALWAYS_SOFTWARE", "1")
+
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from OpenGL.GLUT import *
-from PIL import Image
 import pywavefront
 import OpenGL.arrays.vbo as glvbo
-
-Image.MAX_IMAGE_PIXELS = None
+import OpenGL.raw.GL.VERSION.GL_1_1 as rawGL
+from RenderScheduler import RenderScheduler
+import GLResources
+import MeshLOD
+import MeshChunks
+import MeshStream
+from TextureManager import TextureManager
+from OffscreenGL import create_offscreen_context, destroy_offscreen_context
+import VertexQuant
 
 angle_x = 30.0
 angle_y = -45.0
@@ -30,57 +52,105 @@ scale_z = 0.1
 Qwireframe = False
 
 scene = None
-texture_ids = {}
+texture_manager = None
+texture_budget_mb = 512.0
 vbo_dict = {}
 
 QFullScreen = False
-
-def load_texture_image(image_path):
-    im = Image.open(image_path)
-    im = im.convert('RGBA')
-    ix, iy = im.size
-    image_data = im.tobytes("raw", "RGBA", 0, -1)
-    tid = glGenTextures(1)
-    glBindTexture(GL_TEXTURE_2D, tid)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, ix, iy, 0, GL_RGBA,
-                 GL_UNSIGNED_BYTE, image_data)
-    glBindTexture(GL_TEXTURE_2D, 0)
-    return tid
+max_fps = 60.0
+scheduler = None
+leak_check = GLResources.LeakCheck()
+
+fov_y = 45.0
+model_bbox = None
+model_sphere = None
+lod_enabled = True
+lod_triangles_per_pixel = 1.0
+lod_data = {}
+lod_triangles = []
+lod_index = 0
+
+culling_enabled = True
+cluster_triangles = MeshChunks.leaf_triangles
+frustum = None
+cull_stats = (0, 0)
+window_title = "Load OBJ multitexture optimise VBO"
+
+stream_enabled = False
+stream_budget_mb = 1024.0
+stream_index = None
+stream_loader = None
+stream_entries = []
+stream_start = None
+
+QBenchmark = False
+benchmark_frames = 120
+benchmark_size = (1280, 720)
+benchmark_report = None
+
+vertex_compact = False
+compact_report = None
+visual_diff = False
 
 def init_textures():
-    global texture_ids, scene
-    texture_ids.clear()
+    global texture_manager, scene
+    if texture_manager is not None:
+        texture_manager.release()
+    texture_manager = TextureManager(texture_budget_mb)
+    if stream_index is not None:
+        for material in stream_index['materials']:
+            if material['texture'] is not None:
+                texture_manager.register(material['texture'], material['texture'])
+        return
     if scene is None:
         return
     for name, material in scene.materials.items():
         if material.texture is not None:
-            try:
-                tid = load_texture_image(material.texture.path)
-                texture_ids[material.texture] = tid
-            except Exception as e:
-                print(f"Error Load Texture {material.texture.path}: {e}")
+            texture_manager.register(material.texture, material.texture.path)
 
 def calculate_bounding_box():
     global scene
     if scene is None:
         return None
-    min_x = min_y = min_z = float('inf')
-    max_x = max_y = max_z = float('-inf')
+    bbox_min = np.full(3, np.inf)
+    bbox_max = np.full(3, -np.inf)
 
+    # Vertices are interleaved (e.g. T2F_N3F_V3F): only the V3F columns count.
     for name, material in scene.materials.items():
-        vertices = material.vertices
-        for i in range(0, len(vertices), 3):
-            x, y, z = vertices[i], vertices[i + 1], vertices[i + 2]
-            if x < min_x: min_x = x
-            if x > max_x: max_x = x
-            if y < min_y: min_y = y
-            if y > max_y: max_y = y
-            if z < min_z: min_z = z
-            if z > max_z: max_z = z
+        stride, offsets = MeshLOD.parse_vertex_format(material.vertex_format)
+        if 'V' not in offsets or not material.vertices:
+            continue
+        vo = offsets['V'][0]
+        positions = np.asarray(material.vertices, dtype=np.float64).reshape(-1, stride)[:, vo:vo + 3]
+        bbox_min = np.minimum(bbox_min, positions.min(axis=0))
+        bbox_max = np.maximum(bbox_max, positions.max(axis=0))
+    if not np.isfinite(bbox_min).all():
+        bbox_min = bbox_max = np.zeros(3)
+
+    return (float(bbox_min[0]), float(bbox_max[0]), float(bbox_min[1]),
+            float(bbox_max[1]), float(bbox_min[2]), float(bbox_max[2]))
+
 
-    return (min_x, max_x, min_y, max_y, min_z, max_z)
+def calculate_bounding_sphere(bbox):
+    # (center, radius) used by the LOD selection: centered on the box, with
+    # the distance to the farthest vertex (half the box diagonal when the
+    # vertices are streamed and not in memory).
+    global scene
+    if bbox is None:
+        return None
+    min_x, max_x, min_y, max_y, min_z, max_z = bbox
+    center = np.array([(min_x + max_x) / 2, (min_y + max_y) / 2, (min_z + max_z) / 2])
+    radius = 0.5 * float(np.linalg.norm([max_x - min_x, max_y - min_y, max_z - min_z]))
+    if scene is not None:
+        radius = 0.0
+        for name, material in scene.materials.items():
+            stride, offsets = MeshLOD.parse_vertex_format(material.vertex_format)
+            if 'V' not in offsets or not material.vertices:
+                continue
+            vo = offsets['V'][0]
+            positions = np.asarray(material.vertices, dtype=np.float64).reshape(-1, stride)[:, vo:vo + 3]
+            radius = max(radius, float(np.linalg.norm(positions - center, axis=1).max()))
+    return center, radius
 
 
 def count_mesh_elements():
@@ -107,6 +177,7 @@ def create_vbos():
     vbo_dict.clear()
     if scene is None:
         return
+    reports = []
     for name, material in scene.materials.items():
         vertices = material.vertices
         vertex_format = material.vertex_format  # ex: 'T2F_N3F_V3F'
@@ -123,8 +194,96 @@ def create_vbos():
         if stride == 0:
             continue
         vertex_data = np.array(vertices, dtype=np.float32)
-        vbo = glvbo.VBO(vertex_data)
-        vbo_dict[name] = (vbo, material.texture, stride, has_texcoords, has_normals, has_vertices)
+        levels = [vertex_data] + lod_data.get(name, [])
+        # All materials share one quantization grid so that seams stay closed.
+        quant = None
+        if vertex_compact and has_vertices and model_bbox is not None:
+            center, scale = VertexQuant.position_transform(model_bbox)
+            quant = (center, scale, VertexQuant.compact_dtype(has_texcoords, has_normals).itemsize)
+        vbos = []
+        bvhs = []
+        for level in levels:
+            if has_vertices:
+                vertex_offset = 2 * has_texcoords + 3 * has_normals
+                level, bvh = MeshChunks.build_clusters(level, stride, vertex_offset, cluster_triangles)
+            else:
+                bvh = None
+            if quant is not None:
+                compact = VertexQuant.quantize(level, stride, has_texcoords, has_normals, quant[0], quant[1])
+                if not vbos:
+                    reports.append(VertexQuant.quality_report(level, stride, has_texcoords, has_normals,
+                                                              compact, quant[0], quant[1]))
+                level = compact.view(np.uint8)
+            vbos.append(glvbo.VBO(level))
+            GLResources.track('buffer', id(vbos[-1]), level.nbytes, 'mesh')
+            bvhs.append(bvh)
+        vbo_dict[name] = (vbos, bvhs, quant, material.texture, stride, has_texcoords, has_normals, has_vertices)
+    if reports:
+        report_compact(reports)
+    update_lod_triangles()
+
+def vertex_count(vbo, stride, quant):
+    # Compact buffers hold raw bytes, float buffers hold `stride` floats per vertex.
+    return len(vbo) // (quant[2] if quant is not None else stride)
+
+def report_compact(reports):
+    global compact_report
+    float_bytes = sum(r['float_bytes'] for r in reports)
+    compact_bytes = sum(r['compact_bytes'] for r in reports)
+    compact_report = {
+        'float_mb': float_bytes / 1024 / 1024,
+        'compact_mb': compact_bytes / 1024 / 1024,
+        'position_max_error': max(r['position_max_error'] for r in reports),
+        'normal_max_error_deg': max([r['normal_max_error_deg'] for r in reports if 'normal_max_error_deg' in r], default=0.0),
+        'texcoord_max_error': max([r['texcoord_max_error'] for r in reports if 'texcoord_max_error' in r], default=0.0),
+    }
+    print(f"Compact vertices : {compact_report['float_mb']:.1f} MB -> {compact_report['compact_mb']:.1f} MB, "
+          f"max error position {compact_report['position_max_error']:.3g}, "
+          f"normal {compact_report['normal_max_error_deg']:.2f} deg, "
+          f"texcoord {compact_report['texcoord_max_error']:.3g}")
+
+def check_compact_support():
+    # Half float attributes need GL 3.0.
+    global vertex_compact
+    try:
+        major, minor = [int(x) for x in glGetString(GL_VERSION).decode().split()[0].split('.')[:2]]
+    except (AttributeError, ValueError):
+        major, minor = 0, 0
+    if (major, minor) < (3, 0):
+        print("Compact vertices need OpenGL 3.0, using float vertices")
+        vertex_compact = False
+
+def update_lod_triangles():
+    global lod_triangles
+    num_levels = max([len(entry[0]) for entry in vbo_dict.values()], default=0)
+    lod_triangles = [0] * num_levels
+    for vbos, bvhs, quant, texture, stride, has_texcoords, has_normals, has_vertices in vbo_dict.values():
+        for i in range(num_levels):
+            level = vbos[min(i, len(vbos) - 1)]
+            lod_triangles[i] += vertex_count(level, stride, quant) // 3
+
+def update_lod():
+    global lod_index
+    if len(lod_triangles) < 2 or model_sphere is None:
+        lod_index = 0
+        return
+    modelview = np.array(glGetDoublev(GL_MODELVIEW_MATRIX), dtype=np.float64).reshape(4, 4)
+    viewport = glGetIntegerv(GL_VIEWPORT)
+    center = np.append(model_sphere[0], 1.0)
+    radius = model_sphere[1]
+    scale = max(np.linalg.norm(modelview[i, :3]) for i in range(3))
+    eye = center @ modelview
+    r = radius * scale
+    dist = -eye[2]
+    if dist <= r:
+        index = 0
+    else:
+        r_px = r / (dist * np.tan(np.radians(fov_y / 2))) * viewport[3] / 2
+        pixels = min(np.pi * r_px * r_px, float(viewport[2] * viewport[3]))
+        index = MeshLOD.select_lod(lod_triangles, pixels, lod_triangles_per_pixel)
+    if index != lod_index:
+        print(f"LOD level : {index} ({lod_triangles[index]} triangles)")
+    lod_index = index
 
 def init():
     glClearColor(0, 0, 0, 1)
@@ -136,8 +295,134 @@ def init():
     glLightfv(GL_LIGHT0, GL_SPECULAR, [1.0, 1.0, 1.0, 1])
     glEnable(GL_COLOR_MATERIAL)
     glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
+    if vertex_compact:
+        check_compact_support()
+    if vertex_compact:
+        # Decoded positions go through a scale on the modelview, which also
+        # rescales the normals.
+        glEnable(GL_NORMALIZE)
     init_textures()
     create_vbos()
+    if stream_index is not None:
+        init_stream()
+
+def create_stream_buffer(triangles):
+    buffer_id = GLResources.gen_buffers(1, 'mesh stream')
+    glBindBuffer(GL_ARRAY_BUFFER, buffer_id)
+    GLResources.buffer_data(GL_ARRAY_BUFFER, buffer_id, triangles * 3 * MeshStream.stride * 4, None, GL_STATIC_DRAW)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    return buffer_id
+
+def init_stream():
+    # Coarse levels are allocated first, then full resolution materials while
+    # they fit in the GPU share of the budget. A quarter of the budget bounds
+    # the batches waiting in host memory.
+    global stream_entries, stream_loader, stream_start
+    budget = stream_budget_mb * 1024 * 1024
+    host_budget = budget / 4
+    gpu_budget = budget - host_budget
+    vertex_bytes = 3 * MeshStream.stride * 4
+    stream_entries = []
+    jobs = []
+    used = 0
+    for i, material in enumerate(stream_index['materials']):
+        coarse = material['coarse_triangles']
+        entry = {'material': material, 'coarse': None, 'coarse_loaded': 0, 'full': None, 'full_loaded': 0}
+        if coarse > 0 and used + coarse * vertex_bytes <= gpu_budget:
+            entry['coarse'] = create_stream_buffer(coarse)
+            used += coarse * vertex_bytes
+            jobs.append((i, 0, material['coarse_file'], 0, coarse))
+        stream_entries.append(entry)
+    for i, material in enumerate(stream_index['materials']):
+        full = material['triangles']
+        if full > 0 and used + full * vertex_bytes <= gpu_budget:
+            stream_entries[i]['full'] = create_stream_buffer(full)
+            used += full * vertex_bytes
+            jobs.append((i, 1, material['file'], 0, full))
+        elif full > 0:
+            print(f"Material {material['name']} kept at coarse level (memory budget)")
+    print(f"Streaming {len(jobs)} levels, GPU memory {used / 1024 / 1024:.1f} MB")
+    stream_start = time.perf_counter()
+    stream_loader = MeshStream.StreamLoader(MeshStream.stream_dir(obj_path), jobs, host_budget)
+    stream_loader.start()
+    scheduler.set_animating(True)
+
+def pump_stream(time_budget=0.008):
+    global stream_loader
+    if stream_loader is None:
+        return
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < time_budget:
+        try:
+            item = stream_loader.queue.get_nowait()
+        except queue.Empty:
+            return
+        if item is None:
+            print(f"Streaming done in {time.perf_counter() - stream_start:.2f} s")
+            stream_loader = None
+            scheduler.set_animating(False)
+            scheduler.request_redraw()
+            return
+        i, level, first_vertex, data = item
+        entry = stream_entries[i]
+        glBindBuffer(GL_ARRAY_BUFFER, entry['coarse'] if level == 0 else entry['full'])
+        glBufferSubData(GL_ARRAY_BUFFER, first_vertex * MeshStream.stride * 4, data.nbytes, data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        entry['coarse_loaded' if level == 0 else 'full_loaded'] += len(data) // (3 * MeshStream.stride)
+
+def draw_stream_buffer(buffer_id, firsts, counts):
+    stride = MeshStream.stride * 4
+    glBindBuffer(GL_ARRAY_BUFFER, buffer_id)
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+    glEnableClientState(GL_NORMAL_ARRAY)
+    glTexCoordPointer(2, GL_FLOAT, stride, ctypes.c_void_p(0))
+    glNormalPointer(GL_FLOAT, stride, ctypes.c_void_p(2 * 4))
+    glVertexPointer(3, GL_FLOAT, stride, ctypes.c_void_p(5 * 4))
+    glMultiDrawArrays(GL_TRIANGLES, np.array(firsts, dtype=np.int32), np.array(counts, dtype=np.int32), len(firsts))
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+    glDisableClientState(GL_NORMAL_ARRAY)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+def draw_stream():
+    total_submitted = 0
+    total_culled = 0
+    for entry in stream_entries:
+        material = entry['material']
+        full_done = entry['full'] is not None and entry['full_loaded'] >= material['triangles']
+        firsts, counts = [], []
+        for first, count, bbox_min, bbox_max in material['batches']:
+            if first + count > entry['full_loaded']:
+                break
+            if frustum is not None and MeshChunks.classify(frustum, np.array(bbox_min), np.array(bbox_max)) == 0:
+                total_culled += count
+                continue
+            firsts.append(first * 3)
+            counts.append(count * 3)
+            total_submitted += count
+        draw_coarse = not full_done and entry['coarse_loaded'] > 0
+        if not firsts and not draw_coarse:
+            continue
+        texture = material['texture']
+        textured = texture is not None and texture_manager.bind(texture)
+        if textured:
+            glEnable(GL_TEXTURE_2D)
+        else:
+            glDisable(GL_TEXTURE_2D)
+        if firsts:
+            draw_stream_buffer(entry['full'], firsts, counts)
+        if draw_coarse:
+            # Pushed back so the full resolution batches win where both exist.
+            glEnable(GL_POLYGON_OFFSET_FILL)
+            glPolygonOffset(1.0, 1.0)
+            draw_stream_buffer(entry['coarse'], [0], [entry['coarse_loaded'] * 3])
+            glDisable(GL_POLYGON_OFFSET_FILL)
+            total_submitted += entry['coarse_loaded']
+        if textured:
+            glBindTexture(GL_TEXTURE_2D, 0)
+            glDisable(GL_TEXTURE_2D)
+    report_culling(total_submitted, total_culled)
 
 def reshape(w, h):
     if h == 0:
@@ -145,45 +430,114 @@ def reshape(w, h):
     glViewport(0, 0, w, h)
     glMatrixMode(GL_PROJECTION)
     glLoadIdentity()
-    gluPerspective(45.0, w / float(h), 0.1, 1000.0)
+    gluPerspective(fov_y, w / float(h), 0.1, 1000.0)
     glMatrixMode(GL_MODELVIEW)
+    scheduler.request_redraw()
+
+def update_frustum():
+    global frustum
+    if culling_enabled:
+        frustum = MeshChunks.frustum_planes(glGetDoublev(GL_MODELVIEW_MATRIX), glGetDoublev(GL_PROJECTION_MATRIX))
+    else:
+        frustum = None
+
+def report_culling(submitted, culled):
+    global cull_stats
+    if (submitted, culled) != cull_stats:
+        cull_stats = (submitted, culled)
+        if not QBenchmark:
+            glutSetWindowTitle(f"{window_title} - Triangles submitted : {submitted}, culled : {culled}".encode())
 
 def draw_scene():
-    global vbo_dict, texture_ids
-    for name, (vbo, texture, stride, has_texcoords, has_normals, has_vertices) in vbo_dict.items():
-        if texture is not None and texture in texture_ids:
+    global vbo_dict, texture_manager
+    total_submitted = 0
+    total_culled = 0
+    for name, (vbos, bvhs, quant, texture, stride, has_texcoords, has_normals, has_vertices) in vbo_dict.items():
+        level = min(lod_index, len(vbos) - 1)
+        vbo = vbos[level]
+        bvh = bvhs[level]
+        firsts = counts = None
+        if frustum is not None and bvh is not None:
+            firsts, counts, submitted, culled = MeshChunks.cull(bvh, frustum)
+            total_submitted += submitted
+            total_culled += culled
+            if submitted == 0:
+                continue
+        else:
+            total_submitted += vertex_count(vbo, stride, quant) // 3
+        textured = texture is not None and texture_manager.bind(texture)
+        if textured:
             glEnable(GL_TEXTURE_2D)
-            glBindTexture(GL_TEXTURE_2D, texture_ids[texture])
         else:
             glDisable(GL_TEXTURE_2D)
         vbo.bind()
         glEnableClientState(GL_VERTEX_ARRAY)
-        offset = 0
-        if has_texcoords:
-            glEnableClientState(GL_TEXTURE_COORD_ARRAY)
-            glTexCoordPointer(2, GL_FLOAT, stride * 4, vbo + offset)
-            offset += 2 * 4
+        if quant is not None:
+            set_compact_pointers(vbo, quant, has_texcoords, has_normals)
         else:
-            glDisableClientState(GL_TEXTURE_COORD_ARRAY)
-        if has_normals:
-            glEnableClientState(GL_NORMAL_ARRAY)
-            glNormalPointer(GL_FLOAT, stride * 4, vbo + offset)
-            offset += 3 * 4
+            set_float_pointers(vbo, stride, has_texcoords, has_normals, has_vertices)
+        if firsts is not None:
+            glMultiDrawArrays(GL_TRIANGLES, firsts, counts, len(firsts))
         else:
-            glDisableClientState(GL_NORMAL_ARRAY)
-        if has_vertices:
-            glVertexPointer(3, GL_FLOAT, stride * 4, vbo + offset)
-        count = int(len(vbo) / stride)
-        glDrawArrays(GL_TRIANGLES, 0, count)
+            glDrawArrays(GL_TRIANGLES, 0, vertex_count(vbo, stride, quant))
+        if quant is not None:
+            glPopMatrix()
         vbo.unbind()
         glDisableClientState(GL_VERTEX_ARRAY)
         glDisableClientState(GL_TEXTURE_COORD_ARRAY)
         glDisableClientState(GL_NORMAL_ARRAY)
-        if texture is not None and texture in texture_ids:
+        if textured:
             glBindTexture(GL_TEXTURE_2D, 0)
             glDisable(GL_TEXTURE_2D)
+    report_culling(total_submitted, total_culled)
+
+def set_float_pointers(vbo, stride, has_texcoords, has_normals, has_vertices):
+    offset = 0
+    if has_texcoords:
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glTexCoordPointer(2, GL_FLOAT, stride * 4, vbo + offset)
+        offset += 2 * 4
+    else:
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+    if has_normals:
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glNormalPointer(GL_FLOAT, stride * 4, vbo + offset)
+        offset += 3 * 4
+    else:
+        glDisableClientState(GL_NORMAL_ARRAY)
+    if has_vertices:
+        glVertexPointer(3, GL_FLOAT, stride * 4, vbo + offset)
+
+def set_compact_pointers(vbo, quant, has_texcoords, has_normals):
+    # Positions are int16 on the model grid: decode with translate + scale.
+    # PyOpenGL's array wrappers do not know GL_HALF_FLOAT, so the raw entry
+    # points are given byte offsets into the bound buffer.
+    center, scale, vertex_bytes = quant
+    glPushMatrix()
+    glTranslated(center[0], center[1], center[2])
+    glScaled(scale, scale, scale)
+    rawGL.glVertexPointer(3, GL_SHORT, vertex_bytes, ctypes.c_void_p(0))
+    offset = 8
+    if has_normals:
+        glEnableClientState(GL_NORMAL_ARRAY)
+        rawGL.glNormalPointer(GL_BYTE, vertex_bytes, ctypes.c_void_p(offset))
+        offset += 4
+    else:
+        glDisableClientState(GL_NORMAL_ARRAY)
+    if has_texcoords:
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        rawGL.glTexCoordPointer(2, GL_HALF_FLOAT, vertex_bytes, ctypes.c_void_p(offset))
+    else:
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
 
 def display():
+    scheduler.begin_frame()
+    render_frame()
+    glutSwapBuffers()
+    scheduler.end_frame()
+    leak_check.frame()
+
+def render_frame():
     global rotation_x, rotation_y, rotation_z
     global pos_x, pos_y, pos_z
     global scale_x, scale_y, scale_z
@@ -207,15 +561,20 @@ def display():
 
     glScalef(scale_x, scale_y, scale_z)
 
-    draw_scene()
+    if lod_enabled:
+        update_lod()
+    update_frustum()
+    texture_manager.begin_frame()
+    if stream_index is not None:
+        pump_stream()
+        draw_stream()
+    else:
+        draw_scene()
+    texture_manager.end_frame()
     
     if (Qwireframe) : glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
     
     glPopMatrix()
-    glutSwapBuffers()
-
-def idle():
-    glutPostRedisplay()
 
 def mouse(button, state, x, y):
     global mouse_left_down, mouse_x, mouse_y, zoom
@@ -224,10 +583,10 @@ def mouse(button, state, x, y):
         mouse_left_down = (state == GLUT_DOWN)
     elif button == 3 and state == GLUT_DOWN:
         zoom = max(10, zoom - 5)
-        glutPostRedisplay()
+        scheduler.request_redraw()
     elif button == 4 and state == GLUT_DOWN:
         zoom = min(500, zoom + 5)
-        glutPostRedisplay()
+        scheduler.request_redraw()
 
 def motion(x, y):
     global angle_x, angle_y, mouse_x, mouse_y
@@ -238,7 +597,7 @@ def motion(x, y):
         angle_x += dy * 0.5
         angle_x = max(-89, min(89, angle_x))
     mouse_x, mouse_y = x, y
-    glutPostRedisplay()
+    scheduler.request_redraw()
 
 def keyboard(key, x, y):
     global rotation_x, rotation_y, rotation_z
@@ -250,6 +609,12 @@ def keyboard(key, x, y):
         key = key.decode("utf-8")
         if key == '\x1b' or key == 'q':  # ESC or q
             print("Close Esc or Q")
+            print(scheduler.summary())
+            print(texture_manager.summary())
+            if stream_loader is not None:
+                stream_loader.stop()
+            release_gl_resources()
+            print(GLResources.summary())
             try:
                 glutLeaveMainLoop()
             except NameError:
@@ -259,6 +624,10 @@ def keyboard(key, x, y):
         elif key == 'w': 
             global Qwireframe
             Qwireframe = not Qwireframe
+        elif key == 'c':
+            global culling_enabled
+            culling_enabled = not culling_enabled
+            print("Frustum culling : " + ("on" if culling_enabled else "off"))
         elif key == '8':
             pos_y += deltaP
             print("position (x,z,z) = ("+str(pos_x)+","+str(pos_y)+","+str(pos_z)+")")
@@ -305,36 +674,219 @@ def keyboard(key, x, y):
             scale_y /= 1.1
             scale_z /= 1.1
             print("scale (x,z,z) = ("+str(scale_x)+","+str(scale_y)+","+str(scale_z)+")")
-        glutPostRedisplay()
+        scheduler.request_redraw()
     except SystemExit:
         pass
 
+class PhaseTimer:
+    def __init__(self):
+        self.phases = {}
+
+    def __call__(self, name):
+        self.name = name
+        return self
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.phases[self.name] = self.phases.get(self.name, 0.0) + time.perf_counter() - self.t0
+
+def release_gl_resources():
+    global stream_entries
+    for vbos, bvhs, quant, texture, stride, has_texcoords, has_normals, has_vertices in vbo_dict.values():
+        for vbo in vbos:
+            vbo.delete()
+            GLResources.untrack('buffer', id(vbo))
+    vbo_dict.clear()
+    for entry in stream_entries:
+        for level in ('coarse', 'full'):
+            if entry[level] is not None:
+                GLResources.delete_buffers([entry[level]])
+    stream_entries = []
+    if texture_manager is not None:
+        texture_manager.release()
+
+def peak_rss_mb():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 1024 / 1024
+        except (ImportError, AttributeError):
+            return None
+
+def geometry_bytes():
+    total = 0
+    for vbos, bvhs, quant, texture, stride, has_texcoords, has_normals, has_vertices in vbo_dict.values():
+        total += sum(vbo.data.nbytes for vbo in vbos)
+    for entry in stream_entries:
+        material = entry['material']
+        if entry['coarse'] is not None:
+            total += material['coarse_triangles'] * 3 * MeshStream.stride * 4
+        if entry['full'] is not None:
+            total += material['triangles'] * 3 * MeshStream.stride * 4
+    return total
+
+def percentiles(ms):
+    if len(ms) == 0:
+        return {}
+    return {
+        'mean': float(np.mean(ms)),
+        'p50': float(np.percentile(ms, 50)),
+        'p90': float(np.percentile(ms, 90)),
+        'p95': float(np.percentile(ms, 95)),
+        'p99': float(np.percentile(ms, 99)),
+        'max': float(np.max(ms)),
+    }
+
+def read_frame(width, height):
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    pixels = glReadPixels(0, 0, width, height, GL_RGB, GL_UNSIGNED_BYTE)
+    return np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 3)
+
+def compare_float_vertices(width, height):
+    # Renders the first orbit frame with the compact buffers, then again with
+    # float buffers, and returns the image difference.
+    global vertex_compact
+    if not vertex_compact or scene is None:
+        return None
+    render_frame()
+    compact = read_frame(width, height).copy()
+    for vbos, *_ in vbo_dict.values():
+        for vbo in vbos:
+            vbo.delete()
+            GLResources.untrack('buffer', id(vbo))
+    vertex_compact = False
+    create_vbos()
+    render_frame()
+    reference = read_frame(width, height)
+    vertex_compact = True
+    return VertexQuant.image_diff(reference, compact)
+
+def run_benchmark():
+    # Loads the model, renders benchmark_frames frames offscreen along an
+    # orbit around it and writes a JSON report.
+    global scene, scheduler, model_bbox, model_sphere, lod_data, stream_index, angle_y
+    timer = PhaseTimer()
+    scheduler = RenderScheduler(0)
+    width, height = benchmark_size
+    with timer("parse"):
+        if stream_enabled:
+            stream_index = MeshStream.ensure_preprocessed(obj_path, stream_budget_mb)
+            model_bbox = stream_index['bbox']
+        else:
+            scene = pywavefront.Wavefront(obj_path, create_materials=True, collect_faces=True, strict=False)
+            model_bbox = calculate_bounding_box()
+        model_sphere = calculate_bounding_sphere(model_bbox)
+    if lod_enabled and scene is not None:
+        with timer("lod"):
+            materials = [(name, material.vertices, material.vertex_format) for name, material in scene.materials.items()]
+            lod_data = MeshLOD.load_or_build_lods(obj_path, materials)
+    with timer("context"):
+        offscreen = create_offscreen_context(width, height)
+    with timer("create_vbos"):
+        init()
+        while stream_loader is not None:
+            pump_stream(1.0)
+            time.sleep(0.001)
+        glFinish()
+    with timer("textures"):
+        texture_manager.preload()
+        glFinish()
+    reshape(width, height)
+
+    frame_times = []
+    start_angle = angle_y
+    for i in range(benchmark_frames):
+        angle_y = start_angle + 360.0 * i / max(1, benchmark_frames)
+        t0 = time.perf_counter()
+        render_frame()
+        glFinish()
+        frame_times.append(time.perf_counter() - t0)
+    angle_y = start_angle
+    timer.phases["draw_scene"] = sum(frame_times)
+
+    if stream_index is not None:
+        triangles = sum(material['triangles'] for material in stream_index['materials'])
+    else:
+        triangles = lod_triangles[0] if lod_triangles else 0
+    vram_geometry = geometry_bytes()
+    image_diff = compare_float_vertices(width, height) if visual_diff else None
+    report = {
+        'file': obj_path,
+        'renderer': glGetString(GL_RENDERER).decode(errors='replace'),
+        'size': [width, height],
+        'frames': benchmark_frames,
+        'triangles': triangles,
+        'phases_s': timer.phases,
+        'peak_rss_mb': peak_rss_mb(),
+        'vram_estimate_mb': {
+            'geometry': vram_geometry / 1024 / 1024,
+            'textures': texture_manager.resident_bytes / 1024 / 1024,
+            'total': (vram_geometry + texture_manager.resident_bytes) / 1024 / 1024,
+        },
+        'frame_ms': percentiles(np.array(frame_times) * 1000.0),
+        'vertex_format': 'compact' if compact_report is not None else 'float',
+    }
+    if compact_report is not None:
+        report['compact'] = compact_report
+    if image_diff is not None:
+        report['visual_diff'] = image_diff
+    release_gl_resources()
+    destroy_offscreen_context(offscreen)
+
+    text = json.dumps(report, indent=2)
+    if benchmark_report:
+        with open(benchmark_report, 'w') as f:
+            f.write(text)
+        print(f"Benchmark report written to {benchmark_report}")
+    else:
+        print(text)
+    return report
+
 def main():
-    global scene
-    scene = pywavefront.Wavefront(obj_path, create_materials=True, collect_faces=True, strict=False)
-    bbox = calculate_bounding_box()
+    global scene, scheduler, model_bbox, model_sphere, lod_data, stream_index
+    scheduler = RenderScheduler(max_fps)
+    if stream_enabled:
+        stream_index = MeshStream.ensure_preprocessed(obj_path, stream_budget_mb)
+        bbox = stream_index['bbox']
+        triangles = sum(material['triangles'] for material in stream_index['materials'])
+        polygons, vertices = triangles, 3 * triangles
+    else:
+        scene = pywavefront.Wavefront(obj_path, create_materials=True, collect_faces=True, strict=False)
+        bbox = calculate_bounding_box()
+        polygons, triangles, vertices = count_mesh_elements()
+    model_bbox = bbox
+    model_sphere = calculate_bounding_sphere(bbox)
     print(f"Bounding box : X[{bbox[0]}, {bbox[1]}], Y[{bbox[2]}, {bbox[3]}], Z[{bbox[4]}, {bbox[5]}]")
     
-    polygons, triangles, vertices = count_mesh_elements()
     print(f"Polygones : {polygons}, Triangles : {triangles}, Vertices : {vertices}")
 
+    if lod_enabled and scene is not None:
+        materials = [(name, material.vertices, material.vertex_format) for name, material in scene.materials.items()]
+        lod_data = MeshLOD.load_or_build_lods(obj_path, materials)
+
 
     glutInit()
     glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGBA | GLUT_DEPTH)
         
     if QFullScreen:
-        glutCreateWindow(b"Load OBJ multitexture optimise VBO")
+        glutCreateWindow(window_title.encode())
         glutFullScreen()
     else:        
         glutInitWindowSize(800, 600)
-        glutCreateWindow(b"Load OBJ multitexture optimise VBO")
+        glutCreateWindow(window_title.encode())
     
     
     
+    scheduler.attach_glut(glutPostRedisplay, glutTimerFunc)
     init()
     glutDisplayFunc(display)
     glutReshapeFunc(reshape)
-    glutIdleFunc(idle)
     glutMouseFunc(mouse)
     glutMotionFunc(motion)
     glutKeyboardFunc(keyboard)
@@ -360,6 +912,21 @@ if __name__ == "__main__":
     parser.add_argument('--ScaleZ', type=float, default=0.1, help='ScaleZ Object.')
     
     parser.add_argument('--Fullscreen', type=int, default=0, help='Enable fullscreen mode')
+    parser.add_argument('--MaxFPS', type=float, default=60.0, help='Frame rate cap (redraws only on input).')
+    parser.add_argument('--LOD', type=int, default=1, help='Build and use simplified LOD levels (1 or 0).')
+    parser.add_argument('--Culling', type=int, default=1, help='Frustum culling of spatial clusters (1 or 0).')
+    parser.add_argument('--ClusterTriangles', type=int, default=4096, help='Triangles per spatial cluster.')
+    parser.add_argument('--Stream', type=int, default=0, help='Progressive out-of-core loading from preprocessed data (1 or 0).')
+    parser.add_argument('--MemoryBudgetMB', type=float, default=1024.0, help='Memory budget for streamed geometry.')
+    parser.add_argument('--TextureBudgetMB', type=float, default=512.0, help='VRAM budget for material textures.')
+    parser.add_argument('--Benchmark', type=int, default=0, help='Offscreen load and render benchmark with JSON report (1 or 0).')
+    parser.add_argument('--Frames', type=int, default=120, help='Benchmark frames rendered along the orbit.')
+    parser.add_argument('--Width', type=int, default=1280, help='Benchmark framebuffer width.')
+    parser.add_argument('--Height', type=int, default=720, help='Benchmark framebuffer height.')
+    parser.add_argument('--Report', type=str, default='', help='Benchmark JSON report file (stdout if empty).')
+    parser.add_argument('--LODTrianglesPerPixel', type=float, default=1.0, help='Triangle density kept on screen by the LOD selection.')
+    parser.add_argument('--Compact', type=int, default=0, help='Quantized 16 bytes vertices: int16 positions, packed normals, half float texcoords (1 or 0).')
+    parser.add_argument('--VisualDiff', type=int, default=0, help='Benchmark: compare the compact rendering with float vertices (1 or 0).')
         
     args = parser.parse_args()
     obj_path = args.Path + "/" + args.Name      
@@ -373,7 +940,24 @@ if __name__ == "__main__":
     scale_y = args.ScaleY
     scale_z = args.ScaleZ
     QFullScreen=args.Fullscreen
+    max_fps = args.MaxFPS
+    lod_enabled = bool(args.LOD)
+    lod_triangles_per_pixel = args.LODTrianglesPerPixel
+    culling_enabled = bool(args.Culling)
+    stream_enabled = bool(args.Stream)
+    stream_budget_mb = args.MemoryBudgetMB
+    texture_budget_mb = args.TextureBudgetMB
+    cluster_triangles = args.ClusterTriangles
+    QBenchmark = bool(args.Benchmark)
+    benchmark_frames = args.Frames
+    benchmark_size = (args.Width, args.Height)
+    benchmark_report = args.Report
+    vertex_compact = bool(args.Compact)
+    visual_diff = bool(args.VisualDiff)
     
-    main()
+    if QBenchmark:
+        run_benchmark()
+    else:
+        main()
     
 
@@ -1,13 +1,33 @@
 # Author(s): Dr. Patrick Lemoine
 
+import os
+import sys
+import time
+
+# The leak test renders offscreen through a surfaceless EGL display, which
+# has to be selected before PyOpenGL is imported.
+if __name__ == "__main__":
+    import argparse
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument('--LeakTest', type=int, default=0)
+    pre_args, _ = pre_parser.parse_known_args()
+    if pre_args.LeakTest:
+        os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
 import cv2
-import numpy as np
 import OpenGL.GL as gl
 import glfw
 import math
 from OpenGL.GLU import gluPerspective, gluLookAt
-import os
-import sys
+from PIL import Image
+from RenderScheduler import RenderScheduler
+import GLResources
+from TilePyramid import TilePyramid
+from ProgressiveTexture import ProgressiveTexture
+import RawImage
+from OffscreenGL import create_offscreen_context, destroy_offscreen_context
+
+Image.MAX_IMAGE_PIXELS = None
 
 yaw, pitch = 0.0, 0.0
 last_x, last_y = None, None
@@ -16,6 +36,16 @@ distance = 3.0
 
 vbo_vertices = None
 vbo_texcoords = None
+scheduler = None
+pyramid = None
+progressive = None
+texture_id = None
+
+leak_test_size = (800, 600)
+# Frames rendered at most while waiting for loads and uploads to settle.
+settle_frames = 2000
+# Camera distances visited by each leak test step, close-ups included.
+leak_test_distances = [3.0, 1.5, 0.8, 0.4, 0.2, 0.1]
 
 def load_texture(image_path):
     img = cv2.imread(image_path)
@@ -23,7 +53,8 @@ def load_texture(image_path):
         raise RuntimeError("Unable to load image")
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     h, w, _ = img.shape
-    texture_id = gl.glGenTextures(1)
+    texture_id = GLResources.gen_textures(1, 'picture')
+    GLResources.set_bytes('texture', texture_id, w * h * 3 * 4 // 3)
     gl.glBindTexture(gl.GL_TEXTURE_2D, texture_id)
     gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB, w, h, 0, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, img)
     gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
@@ -34,31 +65,30 @@ def load_texture(image_path):
     gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
     return texture_id, w, h
 
+def load_mapped_texture(image_path):
+    # .npy / PPM / raw: uploaded from the file mapping as stored, no decode
+    # and no channel swap on the CPU.
+    t0 = time.perf_counter()
+    image = RawImage.open_mapped(image_path)
+    texture_id = GLResources.gen_textures(1, 'picture')
+    GLResources.set_bytes('texture', texture_id, image.width * image.height * image.pixels.shape[2] * 4 // 3)
+    gl.glBindTexture(gl.GL_TEXTURE_2D, texture_id)
+    RawImage.upload_mapped(image)
+    gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR_MIPMAP_LINEAR)
+    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+    gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+    elapsed = time.perf_counter() - t0
+    print(f"Mapped {image.width}x{image.height} {image.order} {image.dtype.name}: {image.nbytes / 2 ** 20:.0f} MB "
+          f"uploaded in {1000.0 * elapsed:.0f} ms ({image.nbytes / 2 ** 20 / max(elapsed, 1e-6):.0f} MB/s)")
+    return texture_id, image.width, image.height
+
 def create_vbos(width, height):
+    # Shared per aspect ratio: calling this again allocates nothing.
     global vbo_vertices, vbo_texcoords
-    vertices = np.array([
-        [-width/2, -height/2, 0.0],
-        [ width/2, -height/2, 0.0],
-        [ width/2,  height/2, 0.0],
-        [-width/2,  height/2, 0.0]
-    ], dtype=np.float32)
-
-    texcoords = np.array([
-        [0.0, 1.0],
-        [1.0, 1.0],
-        [1.0, 0.0],
-        [0.0, 0.0]
-    ], dtype=np.float32)
-
-    vbo_vertices = gl.glGenBuffers(1)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vbo_vertices)
-    gl.glBufferData(gl.GL_ARRAY_BUFFER, vertices.nbytes, vertices, gl.GL_STATIC_DRAW)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
-
-    vbo_texcoords = gl.glGenBuffers(1)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vbo_texcoords)
-    gl.glBufferData(gl.GL_ARRAY_BUFFER, texcoords.nbytes, texcoords, gl.GL_STATIC_DRAW)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+    vbo_vertices, vbo_texcoords = GLResources.quad(width, height)
 
 def draw_quad():
     gl.glEnableClientState(gl.GL_VERTEX_ARRAY)
@@ -80,6 +110,7 @@ def mouse_button_callback(window, button, action, mods):
             last_x, last_y = glfw.get_cursor_pos(window)
         elif action == glfw.RELEASE:
             left_button_pressed = False
+        scheduler.request_redraw()
 
 def cursor_pos_callback(window, xpos, ypos):
     global yaw, pitch, last_x, last_y
@@ -92,15 +123,21 @@ def cursor_pos_callback(window, xpos, ypos):
             pitch += yoffset * sensitivity
             pitch = max(-80, min(80, pitch))  # Strict pitch limit
         last_x, last_y = xpos, ypos
+        scheduler.request_redraw()
 
 def scroll_callback(window, xoffset, yoffset):
     global distance
     distance -= yoffset * 0.1
     distance = max(0.1, min(10.0, distance))
+    scheduler.request_redraw()
 
 def key_callback(window, key, scancode, action, mods):
     if key == glfw.KEY_ESCAPE and action == glfw.PRESS:
         glfw.set_window_should_close(window, True)
+    scheduler.request_redraw()
+
+def refresh_callback(window, *args):
+    scheduler.request_redraw()
 
 def setup_projection(window_width, window_height):
     gl.glMatrixMode(gl.GL_PROJECTION)
@@ -135,8 +172,102 @@ def setup_spotlight():
     gl.glLightfv(gl.GL_LIGHT0, gl.GL_SPECULAR, [1.0, 1.0, 1.0, 1.0])
 
 
-def main(image_path, enable_spotlight=False, enable_fullscreen=False):
-    global distance
+def image_size(image_path):
+    # Read from the header only.
+    if RawImage.is_mapped(image_path):
+        image = RawImage.open_mapped(image_path)
+        return image.width, image.height
+    try:
+        with Image.open(image_path) as im:
+            return im.size
+    except OSError:
+        return None
+
+def open_picture(image_path, deep_zoom=False, tile_budget_mb=256.0, tile_loaders=4, progressive_open=True,
+                 upload_budget_ms=4.0, on_ready=None):
+    global pyramid, progressive, texture_id
+    pyramid, progressive, texture_id = None, None, None
+    # Deep zoom when asked, or when the image cannot be one texture.
+    size = image_size(image_path)
+    max_texture = int(gl.glGetIntegerv(gl.GL_MAX_TEXTURE_SIZE))
+    if not deep_zoom and size is not None and max(size) > max_texture:
+        print(f"Image {size[0]}x{size[1]} exceeds GL_MAX_TEXTURE_SIZE {max_texture}: deep zoom mode")
+        deep_zoom = True
+    if deep_zoom:
+        pyramid = TilePyramid(image_path, tile_budget_mb, tile_loaders, on_ready)
+    elif RawImage.is_mapped(image_path):
+        texture_id, img_w, img_h = load_mapped_texture(image_path)
+        max_dim = max(img_w, img_h)
+        create_vbos(img_w / max_dim, img_h / max_dim)
+    elif progressive_open:
+        progressive = ProgressiveTexture(image_path, on_ready, upload_budget_ms)
+        img_w, img_h = size if size is not None else [8 * s for s in progressive.preview_size]
+        max_dim = max(img_w, img_h)
+        create_vbos(img_w / max_dim, img_h / max_dim)
+    else:
+        texture_id, img_w, img_h = load_texture(image_path)
+        max_dim = max(img_w, img_h)
+        width = img_w / max_dim
+        height = img_h / max_dim
+        create_vbos(width, height)
+
+def close_picture():
+    if pyramid is not None:
+        pyramid.stop()
+        pyramid.release()
+    else:
+        GLResources.release_quads()
+        if progressive is not None:
+            progressive.release()
+        else:
+            GLResources.delete_textures([texture_id])
+
+def setup_gl(enable_spotlight):
+    gl.glEnable(gl.GL_TEXTURE_2D)
+    gl.glEnable(gl.GL_DEPTH_TEST)
+    # Finer tiles are drawn over coarser stand-ins at the same depth.
+    gl.glDepthFunc(gl.GL_LEQUAL)
+
+    if enable_spotlight:
+        setup_spotlight()
+    else:
+        gl.glDisable(gl.GL_LIGHTING)
+        gl.glDisable(gl.GL_LIGHT0)
+
+def render_frame(window_w, window_h):
+    # Draws the picture (tiles in deep zoom). Returns True while loads or
+    # uploads are pending.
+    global texture_id
+    gl.glViewport(0, 0, window_w, window_h)
+    gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+    gl.glClearColor(0.1, 0.1, 0.1, 1)
+    setup_projection(window_w, window_h)
+    gl.glLoadIdentity()
+
+    cam_x = distance * math.cos(math.radians(pitch)) * math.sin(math.radians(yaw))
+    cam_y = distance * math.sin(math.radians(pitch))
+    cam_z = distance * math.cos(math.radians(pitch)) * math.cos(math.radians(yaw))
+
+    gluLookAt(cam_x, cam_y, cam_z, 0, 0, 0, 0, 1, 0)
+
+    more = False
+    if pyramid is not None:
+        tiles, more = pyramid.update(distance, gl.glGetDoublev(gl.GL_MODELVIEW_MATRIX),
+                                     gl.glGetDoublev(gl.GL_PROJECTION_MATRIX), (0, 0, window_w, window_h))
+        pyramid.draw(tiles)
+    else:
+        if progressive is not None:
+            more = progressive.step()
+            texture_id = progressive.texture
+        gl.glBindTexture(gl.GL_TEXTURE_2D, texture_id)
+        draw_quad()
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+    return more
+
+def main(image_path, enable_spotlight=False, enable_fullscreen=False, max_fps=60.0,
+         deep_zoom=False, tile_budget_mb=256.0, tile_loaders=4, progressive_open=True, upload_budget_ms=4.0):
+    global scheduler
+    scheduler = RenderScheduler(max_fps)
     if not glfw.init():
         raise RuntimeError("GLFW initialization failed")
 
@@ -153,55 +284,115 @@ def main(image_path, enable_spotlight=False, enable_fullscreen=False):
     glfw.set_cursor_pos_callback(window, cursor_pos_callback)
     glfw.set_scroll_callback(window, scroll_callback)
     glfw.set_key_callback(window, key_callback)
+    glfw.set_window_refresh_callback(window, refresh_callback)
+    glfw.set_framebuffer_size_callback(window, refresh_callback)
 
-    texture_id, img_w, img_h = load_texture(image_path)
-    max_dim = max(img_w, img_h)
-    width = img_w / max_dim
-    height = img_h / max_dim
-    create_vbos(width, height)
-
-    gl.glEnable(gl.GL_TEXTURE_2D)
-    gl.glEnable(gl.GL_DEPTH_TEST)
-
-    if enable_spotlight:
-        setup_spotlight()
-    else:
-        gl.glDisable(gl.GL_LIGHTING)
-        gl.glDisable(gl.GL_LIGHT0)
+    open_picture(image_path, deep_zoom, tile_budget_mb, tile_loaders, progressive_open, upload_budget_ms,
+                 glfw.post_empty_event)
+    setup_gl(enable_spotlight)
 
+    leak_check = GLResources.LeakCheck()
     while not glfw.window_should_close(window):
+        scheduler.wait_events(glfw)
+        if pyramid is not None and pyramid.ready:
+            scheduler.request_redraw()
+        if progressive is not None and progressive.uploading:
+            scheduler.request_redraw()
+        if not scheduler.frame_due():
+            continue
+        scheduler.begin_frame()
         window_w, window_h = glfw.get_framebuffer_size(window)
-        gl.glViewport(0, 0, window_w, window_h)
-        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
-        gl.glClearColor(0.1, 0.1, 0.1, 1)
-        setup_projection(window_w, window_h)
-        gl.glLoadIdentity()
-
-        cam_x = distance * math.cos(math.radians(pitch)) * math.sin(math.radians(yaw))
-        cam_y = distance * math.sin(math.radians(pitch))
-        cam_z = distance * math.cos(math.radians(pitch)) * math.cos(math.radians(yaw))
-
-        gluLookAt(cam_x, cam_y, cam_z, 0, 0, 0, 0, 1, 0)
-
-        gl.glBindTexture(gl.GL_TEXTURE_2D, texture_id)
-        draw_quad()
-        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        if render_frame(window_w, window_h):
+            scheduler.request_redraw()
         glfw.swap_buffers(window)
-        glfw.poll_events()
-
-    gl.glDeleteBuffers(1, [vbo_vertices])
-    gl.glDeleteBuffers(1, [vbo_texcoords])
-    gl.glDeleteTextures([texture_id])
+        scheduler.end_frame()
+        leak_check.frame()
+
+    print(scheduler.summary())
+    if pyramid is not None:
+        print(pyramid.summary())
+    elif progressive is not None:
+        print(progressive.summary())
+        print(progressive.uploads.summary())
+    close_picture()
+    print(GLResources.summary())
     glfw.terminate()
 
+def busy():
+    if pyramid is not None:
+        return bool(pyramid.pending or pyramid.ready)
+    return progressive is not None and (progressive.thread.is_alive() or progressive.uploading)
+
+def settle(window_w, window_h):
+    # Renders until nothing is loading or uploading; returns the frame count.
+    for frame in range(1, settle_frames + 1):
+        more = render_frame(window_w, window_h)
+        if not (more or busy()):
+            return frame
+        time.sleep(0.001)
+    return settle_frames
+
+def leak_pass(steps, window_w, window_h):
+    # Zooms in and out (through the pyramid levels in deep zoom) while
+    # turning around the picture, then back to the initial view.
+    global distance, yaw
+    frames = 0
+    for step in range(steps):
+        distance = leak_test_distances[step % len(leak_test_distances)]
+        yaw = 20.0 * ((step // len(leak_test_distances)) % 3 - 1)
+        frames += settle(window_w, window_h)
+    distance, yaw = 3.0, 0.0
+    return frames + settle(window_w, window_h)
+
+def run_leak_test(image_path, steps, deep_zoom=False, tile_budget_mb=256.0, tile_loaders=4, progressive_open=True,
+                  upload_budget_ms=4.0):
+    # Offscreen: the picture is opened, viewed through `steps` zoom steps and
+    # closed twice; the second time must hold the live GL objects of the
+    # first, and closing must free them all. Returns True when nothing leaked.
+    width, height = leak_test_size
+    offscreen = create_offscreen_context(width, height)
+    setup_gl(False)
+    start = GLResources.owners()
+    frames = 0
+    held = []
+    grown = left = None
+    for _ in range(2):
+        open_picture(image_path, deep_zoom, tile_budget_mb, tile_loaders, progressive_open, upload_budget_ms)
+        frames += leak_pass(steps, width, height)
+        held.append(GLResources.owners())
+        close_picture()
+        left = GLResources.growth(start)
+        if left:
+            break
+    if len(held) == 2:
+        grown = held[1] - held[0]
+    destroy_offscreen_context(offscreen)
+    print(f"Leak test : 2 x {steps} zoom steps in {frames} frames, live objects "
+          f"{' then '.join(str(sum(h.values())) for h in held)}, {sum(left.values())} left after closing")
+    for label, diff in (("grew on the second opening", grown), ("left after closing", left)):
+        if diff:
+            print(f"GL leak : {label} : " + ", ".join(f"{name} x{n}" for name, n in diff.most_common()))
+    return not grown and not left
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--Path', type=str, default='.', help='Path.')
-    parser.add_argument('--Name', type=str, default='.', help='Name.')
+    parser.add_argument('--Name', type=str, default='.', help='Name (.npy, binary PPM/PGM and raw files with a .json sidecar are memory mapped).')
     parser.add_argument('--Spotlight',type=int, default=0, help='Enable spotlight effect')
     parser.add_argument('--Fullscreen', type=int, default=0, help='Enable fullscreen mode')
-        
+    parser.add_argument('--MaxFPS', type=float, default=60.0, help='Frame rate cap (redraws only on input)')
+    parser.add_argument('--Progressive', type=int, default=1, help='Show a 1/8 scale preview at once, then swap in full resolution (1 or 0)')
+    parser.add_argument('--UploadBudgetMS', type=float, default=4.0, help='Progressive: GPU upload time per frame (ms)')
+    parser.add_argument('--DeepZoom', type=int, default=0, help='Tiled pyramid mode (1 or 0; always on above GL_MAX_TEXTURE_SIZE)')
+    parser.add_argument('--TileBudgetMB', type=float, default=256.0, help='Deep zoom: VRAM budget of the tile cache')
+    parser.add_argument('--TileLoaders', type=int, default=4, help='Deep zoom: tile loading threads')
+    parser.add_argument('--LeakTest', type=int, default=0, help='Offscreen check: open, N zoom steps and close twice, exit code 1 if GL objects leak (0 = off)')
+
     args = parser.parse_args()
-    main(args.Path + "/" + args.Name, args.Spotlight, args.Fullscreen)
+    if args.LeakTest:
+        sys.exit(0 if run_leak_test(args.Path + "/" + args.Name, args.LeakTest, args.DeepZoom, args.TileBudgetMB,
+                                    args.TileLoaders, args.Progressive, args.UploadBudgetMS) else 1)
+    main(args.Path + "/" + args.Name, args.Spotlight, args.Fullscreen, args.MaxFPS,
+         args.DeepZoom, args.TileBudgetMB, args.TileLoaders, args.Progressive, args.UploadBudgetMS)
     
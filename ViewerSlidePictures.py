@@ -1,13 +1,30 @@
 # Author(s): Dr. Patrick Lemoine
 
-import cv2
-import numpy as np
+import os
+import sys
+import time
+
+# The leak test renders offscreen through a surfaceless EGL display, which
+# has to be selected before PyOpenGL is imported.
+if __name__ == "__main__":
+    import argparse
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument('--LeakTest', type=int, default=0)
+    pre_args, _ = pre_parser.parse_known_args()
+    if pre_args.LeakTest:
+        os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
 import OpenGL.GL as gl
 import glfw
 import math
 from OpenGL.GLU import gluPerspective, gluLookAt
-import os
 import glob
+from RenderScheduler import RenderScheduler
+import GLResources
+from SlideCache import SlideCache
+from ThumbnailGrid import ThumbnailGrid
+from DirectoryIndex import DirectoryIndex
+from OffscreenGL import create_offscreen_context, destroy_offscreen_context
 
 yaw, pitch = 0.0, 0.0
 last_x, last_y = None, None
@@ -15,54 +32,27 @@ left_button_pressed = False
 distance = 3.0
 vbo_vertices = None
 vbo_texcoords = None
+scheduler = None
 
 obj_pos_x, obj_pos_y, obj_pos_z = 0.0, 0.0, 0.0
 obj_rot_angle_x, obj_rot_angle_y, obj_rot_angle_z = 0.0, 0.0, 0.0
 obj_scale_x, obj_scale_y, obj_scale_z = 1.0, 1.0, 1.0
 
-texture_ids = []
-image_sizes = []
+image_files = []
 current_image_index = 0
+direction = 1
+slides = None
+grid = None
+grid_mode = False
 
-def load_texture(image_path):
-    img = cv2.imread(image_path)
-    if img is None:
-        raise RuntimeError("Unable to load image")
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    h, w, _ = img.shape
-    texture_id = gl.glGenTextures(1)
-    gl.glBindTexture(gl.GL_TEXTURE_2D, texture_id)
-    gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGB, w, h, 0, gl.GL_RGB, gl.GL_UNSIGNED_BYTE, img)
-    gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
-    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
-    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
-    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR_MIPMAP_LINEAR)
-    gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
-    gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
-    return texture_id, w, h
+leak_test_size = (800, 600)
+# Frames rendered at most while waiting for loads and uploads to settle.
+settle_frames = 2000
 
 def create_vbos(width, height):
+    # Shared per aspect ratio: calling this again allocates nothing.
     global vbo_vertices, vbo_texcoords
-    vertices = np.array([
-        [-width/2, -height/2, 0.0],
-        [ width/2, -height/2, 0.0],
-        [ width/2,  height/2, 0.0],
-        [-width/2,  height/2, 0.0]
-    ], dtype=np.float32)
-    texcoords = np.array([
-        [0.0, 1.0],
-        [1.0, 1.0],
-        [1.0, 0.0],
-        [0.0, 0.0]
-    ], dtype=np.float32)
-    vbo_vertices = gl.glGenBuffers(1)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vbo_vertices)
-    gl.glBufferData(gl.GL_ARRAY_BUFFER, vertices.nbytes, vertices, gl.GL_STATIC_DRAW)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
-    vbo_texcoords = gl.glGenBuffers(1)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, vbo_texcoords)
-    gl.glBufferData(gl.GL_ARRAY_BUFFER, texcoords.nbytes, texcoords, gl.GL_STATIC_DRAW)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+    vbo_vertices, vbo_texcoords = GLResources.quad(width, height)
 
 def draw_quad():
     gl.glEnableClientState(gl.GL_VERTEX_ARRAY)
@@ -77,13 +67,24 @@ def draw_quad():
     gl.glDisableClientState(gl.GL_TEXTURE_COORD_ARRAY)
 
 def mouse_button_callback(window, button, action, mods):
-    global left_button_pressed, last_x, last_y
+    global left_button_pressed, last_x, last_y, current_image_index, grid_mode
+    if grid_mode:
+        # A click on a thumbnail opens that slide.
+        if button == glfw.MOUSE_BUTTON_LEFT and action == glfw.PRESS:
+            x, y = glfw.get_cursor_pos(window)
+            index = grid.index_at(x, y, *glfw.get_window_size(window))
+            if index is not None:
+                current_image_index = index
+                grid_mode = False
+        scheduler.request_redraw()
+        return
     if button == glfw.MOUSE_BUTTON_LEFT:
         if action == glfw.PRESS:
             left_button_pressed = True
             last_x, last_y = glfw.get_cursor_pos(window)
         elif action == glfw.RELEASE:
             left_button_pressed = False
+        scheduler.request_redraw()
 
 def cursor_pos_callback(window, xpos, ypos):
     global yaw, pitch, last_x, last_y
@@ -96,19 +97,40 @@ def cursor_pos_callback(window, xpos, ypos):
             pitch += yoffset * sensitivity
             pitch = max(-80, min(80, pitch))  # Strict pitch limit
         last_x, last_y = xpos, ypos
+        scheduler.request_redraw()
 
 def scroll_callback(window, xoffset, yoffset):
     global distance
+    if grid_mode:
+        grid.scroll_by(-yoffset)
+        scheduler.request_redraw()
+        return
     distance -= yoffset * 0.1
     distance = max(0.1, min(10.0, distance))
+    scheduler.request_redraw()
 
 def key_callback(window, key, scancode, action, mods):
-    global current_image_index
+    global current_image_index, direction, grid_mode
     global obj_pos_x,obj_pos_y,obj_pos_z
     if key == glfw.KEY_ESCAPE and action == glfw.PRESS:
         glfw.set_window_should_close(window, True)
-    if key == glfw.KEY_SPACE and action == glfw.PRESS:
-        current_image_index = (current_image_index + 1) % len(texture_ids)
+    if key == glfw.KEY_G and action == glfw.PRESS:
+        grid_mode = not grid_mode
+    if grid_mode and action in (glfw.PRESS, glfw.REPEAT):
+        # Grid: arrows move the selection a row at a time, ENTER opens it.
+        rows = {glfw.KEY_UP: -1, glfw.KEY_DOWN: 1, glfw.KEY_PAGE_UP: -int(grid.visible_rows()),
+                glfw.KEY_PAGE_DOWN: int(grid.visible_rows())}.get(key, 0)
+        current_image_index = min(max(0, current_image_index + rows * grid.columns), len(image_files) - 1)
+        if key in (glfw.KEY_ENTER, glfw.KEY_KP_ENTER):
+            grid_mode = False
+    if key in (glfw.KEY_SPACE, glfw.KEY_RIGHT) and action in (glfw.PRESS, glfw.REPEAT):
+        direction = 1
+        current_image_index = (current_image_index + 1) % len(image_files)
+    if key in (glfw.KEY_BACKSPACE, glfw.KEY_LEFT) and action in (glfw.PRESS, glfw.REPEAT):
+        direction = -1
+        current_image_index = (current_image_index - 1) % len(image_files)
+    if grid_mode:
+        grid.show(current_image_index)
         
     if action == glfw.PRESS or action == glfw.REPEAT:
         delta_pos = 0.01
@@ -121,6 +143,10 @@ def key_callback(window, key, scancode, action, mods):
             obj_pos_y += delta_pos
         elif key == glfw.KEY_KP_2:  
             obj_pos_y -= delta_pos
+    scheduler.request_redraw()
+
+def refresh_callback(window, *args):
+    scheduler.request_redraw()
 
 def setup_projection(window_width, window_height):
     gl.glMatrixMode(gl.GL_PROJECTION)
@@ -142,8 +168,8 @@ def setup_spotlight():
     gl.glLightfv(gl.GL_LIGHT0, gl.GL_DIFFUSE, [1.0, 1.0, 1.0, 1.0])
     gl.glLightfv(gl.GL_LIGHT0, gl.GL_SPECULAR, [1.0, 1.0, 1.0, 1.0])
 
-def load_textures_from_directory(directory_path):
-    global texture_ids, image_sizes
+def list_images(directory_path):
+    # Files only: slides are decoded and uploaded on demand by SlideCache.
     extensions = ['*.png', '*.jpg', '*.jpeg', '*.bmp']
     files = []
     for ext in extensions:
@@ -151,41 +177,36 @@ def load_textures_from_directory(directory_path):
     files.sort()
     if not files:
         raise RuntimeError(f"No images found in {directory_path}")
-    for file in files:
-        try:
-            tex_id, w, h = load_texture(file)
-            texture_ids.append(tex_id)
-            image_sizes.append((w, h))
-        except RuntimeError as e:
-            print(f"Error loading image {file}: {e}")
-
-def main(directory_path, enable_spotlight=False, enable_fullscreen=False):
-    global distance, current_image_index
-    if not glfw.init():
-        raise RuntimeError("GLFW initialization failed")
-    monitor = glfw.get_primary_monitor() if enable_fullscreen else None
-    mode = glfw.get_video_mode(monitor) if enable_fullscreen else None
-    width, height = (mode.size.width, mode.size.height) if enable_fullscreen else (800, 600)
-    window = glfw.create_window(width, height, "OpenCV Image - OpenGL 3D VBO", monitor, None)
-    
-    if not window:
-        glfw.terminate()
-        raise RuntimeError("Window creation failed")
-    glfw.make_context_current(window)
-    glfw.set_mouse_button_callback(window, mouse_button_callback)
-    glfw.set_cursor_pos_callback(window, cursor_pos_callback)
-    glfw.set_scroll_callback(window, scroll_callback)
-    glfw.set_key_callback(window, key_callback)
+    return files
 
-    load_textures_from_directory(directory_path)
+def open_slides(directory_path, prefetch=2, budget_mb=512.0, loaders=2, upload_budget_ms=4.0, grid_columns=8,
+                grid_budget_mb=256.0, use_index=True, on_ready=None):
+    # Lists the folder and creates the slide cache and the thumbnail grid.
+    # Returns the directory index (None without).
+    global image_files, slides, grid
+    index = None
+    if use_index:
+        index = DirectoryIndex(directory_path)
+        image_files = index.refresh()
+        print(index.summary())
+        if not image_files:
+            raise RuntimeError(f"No images found in {directory_path}")
+    else:
+        image_files = list_images(directory_path)
+    slides = SlideCache(image_files, prefetch, budget_mb, loaders, on_ready, upload_budget_ms)
+    grid = ThumbnailGrid(image_files, grid_columns, grid_budget_mb, loaders, on_ready, upload_budget_ms, index)
+    return index
 
-    # Initialize VBO with first image size
-    w, h = image_sizes[0]
-    max_dim = max(w, h)
-    width = w / max_dim
-    height = h / max_dim
-    create_vbos(width, height)
+def close_slides(index):
+    slides.stop()
+    grid.stop()
+    GLResources.release_quads()
+    slides.release()
+    grid.release()
+    if index is not None:
+        index.close()
 
+def setup_gl(enable_spotlight):
     gl.glEnable(gl.GL_TEXTURE_2D)
     gl.glEnable(gl.GL_DEPTH_TEST)
     if enable_spotlight:
@@ -194,52 +215,170 @@ def main(directory_path, enable_spotlight=False, enable_fullscreen=False):
         gl.glDisable(gl.GL_LIGHTING)
         gl.glDisable(gl.GL_LIGHT0)
 
-    while not glfw.window_should_close(window):
-        window_w, window_h = glfw.get_framebuffer_size(window)
-        gl.glViewport(0, 0, window_w, window_h)
-        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
-        gl.glClearColor(0.1, 0.1, 0.1, 1)
-        setup_projection(window_w, window_h)
-
-        gl.glLoadIdentity()
-        cam_x = distance * math.cos(math.radians(pitch)) * math.sin(math.radians(yaw))
-        cam_y = distance * math.sin(math.radians(pitch))
-        cam_z = distance * math.cos(math.radians(pitch)) * math.cos(math.radians(yaw))
-        gluLookAt(cam_x, cam_y, cam_z, 0, 0, 0, 0, 1, 0)
-        
-        
-        # Position, rotation et scale de l'objet
-        gl.glTranslatef(obj_pos_x, obj_pos_y, obj_pos_z)
-        gl.glRotatef(obj_rot_angle_x, 1, 0, 0)
-        gl.glRotatef(obj_rot_angle_y, 0, 1, 0)
-        gl.glRotatef(obj_rot_angle_z, 0, 0, 1)
-        gl.glScalef(obj_scale_x, obj_scale_y, obj_scale_z)
+def render_frame(window_w, window_h):
+    # Draws the grid or the current slide. Returns True while loads or
+    # uploads are pending.
+    gl.glViewport(0, 0, window_w, window_h)
+    gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+    gl.glClearColor(0.1, 0.1, 0.1, 1)
+    if grid_mode:
+        more = grid.update(window_w, window_h)
+        grid.draw(window_w, window_h, current_image_index)
+        return more
+    setup_projection(window_w, window_h)
+
+    gl.glLoadIdentity()
+    cam_x = distance * math.cos(math.radians(pitch)) * math.sin(math.radians(yaw))
+    cam_y = distance * math.sin(math.radians(pitch))
+    cam_z = distance * math.cos(math.radians(pitch)) * math.cos(math.radians(yaw))
+    gluLookAt(cam_x, cam_y, cam_z, 0, 0, 0, 0, 1, 0)
+    
+    
+    # Position, rotation et scale de l'objet
+    gl.glTranslatef(obj_pos_x, obj_pos_y, obj_pos_z)
+    gl.glRotatef(obj_rot_angle_x, 1, 0, 0)
+    gl.glRotatef(obj_rot_angle_y, 0, 1, 0)
+    gl.glRotatef(obj_rot_angle_z, 0, 0, 1)
+    gl.glScalef(obj_scale_x, obj_scale_y, obj_scale_z)
 
+    slide, more = slides.update(current_image_index, direction)
+    if slide is not None:
         # Check if image size changed, update VBOs
-        w, h = image_sizes[current_image_index]
+        w, h = slide['size']
         max_dim = max(w, h)
         width = w / max_dim
         height = h / max_dim
         create_vbos(width, height)
 
-        gl.glBindTexture(gl.GL_TEXTURE_2D, texture_ids[current_image_index])
+        gl.glBindTexture(gl.GL_TEXTURE_2D, slide['texture'])
         draw_quad()
         gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+    return more
 
+def main(directory_path, enable_spotlight=False, enable_fullscreen=False, max_fps=60.0,
+         prefetch=2, budget_mb=512.0, loaders=2, upload_budget_ms=4.0, start_grid=False, grid_columns=8,
+         grid_budget_mb=256.0, use_index=True):
+    global scheduler, grid_mode
+    scheduler = RenderScheduler(max_fps)
+    if not glfw.init():
+        raise RuntimeError("GLFW initialization failed")
+    monitor = glfw.get_primary_monitor() if enable_fullscreen else None
+    mode = glfw.get_video_mode(monitor) if enable_fullscreen else None
+    width, height = (mode.size.width, mode.size.height) if enable_fullscreen else (800, 600)
+    window = glfw.create_window(width, height, "OpenCV Image - OpenGL 3D VBO", monitor, None)
+    
+    if not window:
+        glfw.terminate()
+        raise RuntimeError("Window creation failed")
+    glfw.make_context_current(window)
+    glfw.set_mouse_button_callback(window, mouse_button_callback)
+    glfw.set_cursor_pos_callback(window, cursor_pos_callback)
+    glfw.set_scroll_callback(window, scroll_callback)
+    glfw.set_key_callback(window, key_callback)
+    glfw.set_window_refresh_callback(window, refresh_callback)
+    glfw.set_framebuffer_size_callback(window, refresh_callback)
+
+    index = open_slides(directory_path, prefetch, budget_mb, loaders, upload_budget_ms, grid_columns, grid_budget_mb,
+                        use_index, glfw.post_empty_event)
+    grid_mode = start_grid
+    setup_gl(enable_spotlight)
+
+    leak_check = GLResources.LeakCheck()
+    while not glfw.window_should_close(window):
+        scheduler.wait_events(glfw)
+        if slides.ready or grid.ready:
+            scheduler.request_redraw()
+        if not scheduler.frame_due():
+            continue
+        scheduler.begin_frame()
+        window_w, window_h = glfw.get_framebuffer_size(window)
+        if render_frame(window_w, window_h):
+            scheduler.request_redraw()
         glfw.swap_buffers(window)
-        glfw.poll_events()
+        scheduler.end_frame()
+        leak_check.frame()
+
+    print(scheduler.summary())
+    print(slides.summary())
+    print(slides.queue.summary())
+    print(grid.summary())
 
-    gl.glDeleteBuffers(1, [vbo_vertices])
-    gl.glDeleteBuffers(1, [vbo_texcoords])
-    gl.glDeleteTextures(texture_ids)
+    close_slides(index)
+    print(GLResources.summary())
     glfw.terminate()
 
+def settle(window_w, window_h):
+    # Renders until nothing is loading or uploading; returns the frame count.
+    for frame in range(1, settle_frames + 1):
+        more = render_frame(window_w, window_h)
+        if not (more or slides.pending or slides.ready or grid.pending or grid.ready):
+            return frame
+        time.sleep(0.001)
+    return settle_frames
+
+def leak_pass(changes, window_w, window_h):
+    # Slide changes, two forward for one back, with a visit to the grid
+    # every tenth, then back to the first slide.
+    global current_image_index, direction, grid_mode
+    frames = 0
+    for step in range(changes):
+        direction = -1 if step % 3 == 2 else 1
+        current_image_index = (current_image_index + direction) % len(image_files)
+        if step % 10 == 9:
+            grid_mode = True
+            grid.show(current_image_index)
+            frames += settle(window_w, window_h)
+            grid_mode = False
+        frames += settle(window_w, window_h)
+    current_image_index, direction = 0, 1
+    return frames + settle(window_w, window_h)
+
+def run_leak_test(directory_path, changes, prefetch=2, budget_mb=512.0, loaders=2, upload_budget_ms=4.0,
+                  grid_columns=8, grid_budget_mb=256.0, use_index=True):
+    # Offscreen: a second identical pass of slide changes must end with the
+    # live GL objects of the first, and closing must free them all.
+    # Returns True when nothing leaked.
+    width, height = leak_test_size
+    offscreen = create_offscreen_context(width, height)
+    start = GLResources.owners()
+    index = open_slides(directory_path, prefetch, budget_mb, loaders, upload_budget_ms, grid_columns, grid_budget_mb,
+                        use_index)
+    setup_gl(False)
+    frames = leak_pass(changes, width, height)
+    first = GLResources.owners()
+    frames += leak_pass(changes, width, height)
+    grown = GLResources.growth(first)
+    live = sum(GLResources.owners().values())
+    close_slides(index)
+    left = GLResources.growth(start)
+    destroy_offscreen_context(offscreen)
+    print(f"Leak test : 2 x {changes} slide changes in {frames} frames, live objects {sum(first.values())} "
+          f"then {live}, {sum(left.values())} left after closing")
+    for label, diff in (("grew over the second pass", grown), ("left after closing", left)):
+        if diff:
+            print(f"GL leak : {label} : " + ", ".join(f"{name} x{n}" for name, n in diff.most_common()))
+    return not grown and not left
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--Path', type=str, default='.', help='Path to directory containing images')
     parser.add_argument('--Spotlight', type=int, default=0, help='Enable spotlight effect')
     parser.add_argument('--Fullscreen', type=int, default=0, help='Enable fullscreen mode')
+    parser.add_argument('--MaxFPS', type=float, default=60.0, help='Frame rate cap (redraws only on input)')
+    parser.add_argument('--Prefetch', type=int, default=2, help='Slides decoded ahead in the direction of travel')
+    parser.add_argument('--BudgetMB', type=float, default=512.0, help='VRAM budget of the resident slides')
+    parser.add_argument('--Loaders', type=int, default=2, help='Slide decoding threads')
+    parser.add_argument('--UploadBudgetMS', type=float, default=4.0, help='GPU upload time per frame (ms)')
+    parser.add_argument('--Grid', type=int, default=0, help='Start in thumbnail grid mode, G toggles (1 or 0)')
+    parser.add_argument('--GridColumns', type=int, default=8, help='Thumbnail grid columns')
+    parser.add_argument('--GridBudgetMB', type=float, default=256.0, help='VRAM budget of the thumbnail atlases')
+    parser.add_argument('--Index', type=int, default=1, help='Keep an image index (sizes, thumbnails) in the folder (1 or 0)')
+    parser.add_argument('--LeakTest', type=int, default=0, help='Offscreen check: N slide changes twice, exit code 1 if GL objects leak (0 = off)')
     
     args = parser.parse_args()
-    main(args.Path, args.Spotlight, args.Fullscreen)
+    if args.LeakTest:
+        sys.exit(0 if run_leak_test(args.Path, args.LeakTest, args.Prefetch, args.BudgetMB, args.Loaders,
+                                    args.UploadBudgetMS, args.GridColumns, args.GridBudgetMB, args.Index) else 1)
+    main(args.Path, args.Spotlight, args.Fullscreen, args.MaxFPS, args.Prefetch, args.BudgetMB, args.Loaders,
+         args.UploadBudgetMS, args.Grid, args.GridColumns, args.GridBudgetMB, args.Index)
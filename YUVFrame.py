@@ -0,0 +1,79 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Planar YUV 4:2:0 frames for ViewerMovieInVBO.
+# A frame is one uint8 array of height * 3 / 2 rows: the Y plane followed by
+# either the U and V planes (I420) or one interleaved UV plane (NV12), the
+# layouts FFmpeg decoders produce. Uploading the planes takes 1.5 bytes per
+# pixel instead of 3 for BGR.
+
+import cv2
+import numpy as np
+
+yuv_layouts = ('I420', 'NV12')
+
+
+def fourcc_name(value):
+    value = int(value)
+    return ''.join(chr((value >> (8 * i)) & 0xFF) for i in range(4))
+
+
+def yuv_planes(image, layout, width, height):
+    # Views on the planes of a frame: [Y, U, V] for I420, [Y, UV] for NV12.
+    y = image[:height]
+    chroma = image[height:].reshape(-1)
+    cw, ch = width // 2, height // 2
+    if layout == 'NV12':
+        return [y, chroma.reshape(ch, cw, 2)]
+    return [y, chroma[:cw * ch].reshape(ch, cw), chroma[cw * ch:2 * cw * ch].reshape(ch, cw)]
+
+
+def bgr_to_yuv(image, layout='I420', dst=None):
+    if layout == 'NV12':
+        h, w = image.shape[:2]
+        y, u, v = yuv_planes(cv2.cvtColor(image, cv2.COLOR_BGR2YUV_I420), 'I420', w, h)
+        out = dst if dst is not None else np.empty((h * 3 // 2, w), dtype=np.uint8)
+        out[:h] = y
+        out[h:].reshape(h // 2, w // 2, 2)[...] = np.dstack((u, v))
+        return out
+    return cv2.cvtColor(image, cv2.COLOR_BGR2YUV_I420, dst=dst)
+
+
+def resize_yuv(image, layout, width, height, target, dst=None):
+    # Resizes each plane of a YUV frame to target = (width, height), both even.
+    tw, th = target
+    if dst is None or dst.shape != (th * 3 // 2, tw):
+        dst = np.empty((th * 3 // 2, tw), dtype=np.uint8)
+    for src, out in zip(yuv_planes(image, layout, width, height), yuv_planes(dst, layout, tw, th)):
+        cv2.resize(src, (out.shape[1], out.shape[0]), dst=out, interpolation=cv2.INTER_AREA)
+    return dst
+
+
+def even_size(size):
+    return max(2, size[0] & ~1), max(2, size[1] & ~1)
+
+
+def open_native_yuv(path):
+    # Capture returning the decoder's own 4:2:0 frames (RGB conversion off),
+    # with its layout, or (None, None) when the backend cannot hand out
+    # planar frames (OpenCV's FFmpeg backend then only returns the Y plane).
+    quiet = hasattr(cv2, 'utils') and hasattr(cv2.utils, 'logging')
+    if quiet:
+        level = cv2.utils.logging.getLogLevel()
+        cv2.utils.logging.setLogLevel(cv2.utils.logging.LOG_LEVEL_ERROR)
+    try:
+        cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_CONVERT_RGB, 0])
+        if not cap.isOpened():
+            return None, None
+        layout = fourcc_name(cap.get(cv2.CAP_PROP_CODEC_PIXEL_FORMAT))
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        ret, frame = cap.read()
+        if (layout in yuv_layouts and ret and frame is not None and frame.ndim == 2
+                and frame.shape == (height * 3 // 2, width)):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            return cap, layout
+        cap.release()
+        return None, None
+    finally:
+        if quiet:
+            cv2.utils.logging.setLogLevel(level)
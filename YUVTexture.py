@@ -0,0 +1,126 @@
+# Author(s): Dr. Patrick Lemoine
+
+# Planar YUV 4:2:0 textures for ViewerMovieInVBO.
+# The Y plane and the chroma planes (U and V for I420, UV for NV12) stream
+# into their own textures through TextureStream, and a fragment shader turns
+# them back into RGB (BT.601, video range) while drawing. Vertex processing
+# and lighting stay fixed function; the result is modulated by gl_Color like
+# a GL_MODULATE texture.
+
+import OpenGL.GL as gl
+from TextureStream import TextureStream
+from YUVFrame import yuv_planes
+
+fragment_source = {
+    'I420': """
+#version 120
+uniform sampler2D y_plane;
+uniform sampler2D u_plane;
+uniform sampler2D v_plane;
+void main() {
+    vec2 t = gl_TexCoord[0].st;
+    float y = 1.1644 * (texture2D(y_plane, t).r - 0.0627);
+    float u = texture2D(u_plane, t).r - 0.5;
+    float v = texture2D(v_plane, t).r - 0.5;
+    vec3 rgb = vec3(y + 1.5960 * v, y - 0.3918 * u - 0.8130 * v, y + 2.0172 * u);
+    gl_FragColor = vec4(clamp(rgb, 0.0, 1.0), 1.0) * gl_Color;
+}
+""",
+    'NV12': """
+#version 120
+uniform sampler2D y_plane;
+uniform sampler2D uv_plane;
+void main() {
+    vec2 t = gl_TexCoord[0].st;
+    float y = 1.1644 * (texture2D(y_plane, t).r - 0.0627);
+    vec2 uv = texture2D(uv_plane, t).rg - 0.5;
+    vec3 rgb = vec3(y + 1.5960 * uv.y, y - 0.3918 * uv.x - 0.8130 * uv.y, y + 2.0172 * uv.x);
+    gl_FragColor = vec4(clamp(rgb, 0.0, 1.0), 1.0) * gl_Color;
+}
+""",
+}
+plane_names = {'I420': ('y_plane', 'u_plane', 'v_plane'), 'NV12': ('y_plane', 'uv_plane')}
+plane_formats = {'I420': (gl.GL_RED, gl.GL_RED, gl.GL_RED), 'NV12': (gl.GL_RED, gl.GL_RG)}
+
+# One program per layout, shared by all the streams of the context.
+programs = {}
+
+
+def yuv_program(layout):
+    if layout in programs:
+        return programs[layout]
+    shader = gl.glCreateShader(gl.GL_FRAGMENT_SHADER)
+    gl.glShaderSource(shader, fragment_source[layout])
+    gl.glCompileShader(shader)
+    if not gl.glGetShaderiv(shader, gl.GL_COMPILE_STATUS):
+        raise RuntimeError(f"YUV shader compilation failed: {gl.glGetShaderInfoLog(shader)}")
+    program = gl.glCreateProgram()
+    gl.glAttachShader(program, shader)
+    gl.glLinkProgram(program)
+    gl.glDeleteShader(shader)
+    if not gl.glGetProgramiv(program, gl.GL_LINK_STATUS):
+        raise RuntimeError(f"YUV shader link failed: {gl.glGetProgramInfoLog(program)}")
+    gl.glUseProgram(program)
+    for unit, name in enumerate(plane_names[layout]):
+        gl.glUniform1i(gl.glGetUniformLocation(program, name), unit)
+    gl.glUseProgram(0)
+    programs[layout] = program
+    return program
+
+
+def release_programs():
+    for program in programs.values():
+        gl.glDeleteProgram(program)
+    programs.clear()
+
+
+class YUVTextureStream:
+    def __init__(self, width, height, layout='I420', buffers=3, persistent=None):
+        self.layout = layout
+        self.width, self.height = width, height
+        self.program = yuv_program(layout)
+        sizes = [(width, height)] + [(width // 2, height // 2)] * (len(plane_formats[layout]) - 1)
+        self.planes = [TextureStream(w, h, pixel_format, buffers, persistent)
+                       for (w, h), pixel_format in zip(sizes, plane_formats[layout])]
+
+    def upload(self, image):
+        # image: height * 3 / 2 rows of `layout` data.
+        self.height, self.width = image.shape[0] * 2 // 3, image.shape[1]
+        for stream, plane in zip(self.planes, yuv_planes(image, self.layout, self.width, self.height)):
+            stream.upload(plane)
+
+    def bind(self):
+        gl.glUseProgram(self.program)
+        for unit, stream in enumerate(self.planes):
+            gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, stream.texture)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+
+    def unbind(self):
+        for unit in reversed(range(len(self.planes))):
+            gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        gl.glUseProgram(0)
+
+    def release(self):
+        for stream in self.planes:
+            stream.release()
+        self.planes = []
+
+    def stats(self):
+        planes = [stream.stats() for stream in self.planes]
+        return {
+            'persistent': planes[0]['persistent'],
+            'buffers': planes[0]['buffers'],
+            'uploads': planes[0]['uploads'],
+            'upload_ms': sum(p['upload_ms'] for p in planes),
+            'max_upload_ms': sum(p['max_upload_ms'] for p in planes),
+            'fence_waits': sum(p['fence_waits'] for p in planes),
+        }
+
+    def summary(self):
+        s = self.stats()
+        mapping = "persistent" if s['persistent'] else "orphaned"
+        return (f"Texture stream : {self.layout}, {len(self.planes)} planes x {s['buffers']} {mapping} PBOs, "
+                f"{s['uploads']} uploads, {s['upload_ms']:.2f} ms mean, {s['max_upload_ms']:.2f} ms max, "
+                f"fence waits {s['fence_waits']}")